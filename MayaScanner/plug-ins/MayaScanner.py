@@ -16,12 +16,19 @@
 import sys
 import os
 
+# the scanner modules need Python 3 : Maya 2022 or later, not in Python 2 mode
+if sys.version_info[0] < 3:
+    raise ImportError('Autodesk.MayaScanner needs Maya running Python 3 (Maya 2022 or later)')
+
 import maya.cmds as cmds
 import maya.mel as mel
 import maya.api.OpenMaya as om
 
-from MayaScannerCleaner import clean_malware, MayaScannerLogFile, rollOverLogFile, reportIssue, userConfirmFix
+from MayaScannerCleaner import clean_malware, MayaScannerLogFile, rollOverLogFile, reportIssue, userConfirmFix, log, scannerOpenFile
 from MayaScannerUtils import FnPlugin, MsgFormat
+from MayaScannerBatch import scanCachedSceneFile, scanDirectory, issueMessage, kIssuesFound, kScanErrors
+from MayaScannerCache import openCache
+from MayaScannerTiming import enableTiming, timingEnabled, timingStats, formatStats
 
 ###########
 ## 
@@ -31,6 +38,14 @@ from MayaScannerUtils import FnPlugin, MsgFormat
 
 kScanTypeFlag = "-st"
 kScanTypeLongFlag = "-scanType"
+kPathFlag = "-p"
+kPathLongFlag = "-path"
+kStatsFlag = "-sts"
+kStatsLongFlag = "-stats"
+kTimingFlag = "-tm"
+kTimingLongFlag = "-timing"
+kTimingFileFlag = "-tf"
+kTimingFileLongFlag = "-timingFile"
 kCurrent = 0
 kFile = 1
 kDirectory = 2
@@ -116,6 +131,20 @@ def endScanSummary(issuesFound, issuesFixed, malType):
         om.MGlobal.displayInfo("Autodesk.MayaScanner : Scan completed: no issues found")
 
 
+# end of the directory scan output summary, nothing has been loaded in the scene
+def endDirectoryScanSummary(scanned, infected, errors):
+
+    if infected or errors:
+        cmds.warning("Autodesk.MayaScanner : Scan completed: %d of %d files infected, %d files not scanned, see \'%s\' for issues found" % 
+                     (infected, scanned, errors, MayaScannerLogFile()))
+    else:
+        om.MGlobal.displayInfo("Autodesk.MayaScanner : Scan completed: no issues found in %d files" % scanned)
+
+    # in batch mode return the exit code to the shell, the same as MayaScannerBatch.py
+    if (infected or errors) and cmds.about(batch=True):
+        cmds.quit(force=True, exitCode=kIssuesFound if infected else kScanErrors, abort=True)
+
+
 def maya_useNewAPI():
     """
     The presence of this function tells Maya that the plugin produces, and
@@ -135,6 +164,10 @@ class MayaScannerCmd(om.MPxCommand):
     def _clear(self):
         #local data
         self._scanType = 0
+        self._path = None
+        self._stats = False
+        self._timing = None
+        self._timingFile = None
 
     @staticmethod
     def cmdCreator():
@@ -154,6 +187,18 @@ class MayaScannerCmd(om.MPxCommand):
         if argData.isFlagSet( kScanTypeLongFlag ):
             self._scanType = argData.flagArgumentInt( kScanTypeLongFlag, 0 )
 
+        if argData.isFlagSet( kPathFlag ):
+            self._path = argData.flagArgumentString( kPathFlag, 0 )
+
+        if argData.isFlagSet( kStatsFlag ):
+            self._stats = True
+
+        if argData.isFlagSet( kTimingFlag ):
+            self._timing = argData.flagArgumentBool( kTimingFlag, 0 )
+
+        if argData.isFlagSet( kTimingFileFlag ):
+            self._timingFile = argData.flagArgumentString( kTimingFileFlag, 0 )
+
 
 
     def doIt(self, args):
@@ -161,14 +206,30 @@ class MayaScannerCmd(om.MPxCommand):
         # if None given run command on current scene, 
         # else launch file browser to find file or directory name
         # if File load file run scanner, save file
-        # if Directory, travse the directory tree load file, scan, save repeat
+        # if Directory, scan the scene files of the directory tree offline
 
         # parse command arguments to know what type of scan to do
         self.parseArguments( args )
 
+        # timing of the scans, see MayaScannerTiming
+        # the settings not given (file, profile directory) are kept
+        if self._timing is not None or self._timingFile is not None:
+            enableTiming(timingEnabled() if self._timing is None else self._timing, self._timingFile)
+            if not self._stats:
+                return
+        if self._stats:
+            statsLines = formatStats(timingStats())
+            if not timingEnabled():
+                statsLines.append('timing is off, turn it on with MayaScan -timing on')
+            for line in statsLines:
+                om.MGlobal.displayInfo(line)
+            self.setResult(statsLines)
+            return
+
         # starting a new scan
         issuesFound = 0    
         issuesFixed = 0
+        malType = 0
         sceneFileSaved = 0
         quitRequest = 0
 
@@ -188,20 +249,74 @@ class MayaScannerCmd(om.MPxCommand):
 
         if self._scanType >= 1:
 
-            fileName = getReadFileName(actionTitle[self._scanType], self._scanType, '*.ma;;*.mb')
+            fileName = self._path
+            if fileName is None:
+                fileName = getReadFileName(actionTitle[self._scanType], self._scanType, '*.ma;;*.mb')
      
             #did the user press cancel ?
             if fileName is None:
                 om.MGlobal.displayInfo(u'Scan Cancelled')
             else:
+                offlineIssues = None
                 if self._scanType == 1:
+                    # scan the file offline first, so an infected scriptNode can't run before we check it
+                    offlineIssues = offlineScanFile(fileName)
+
+                if offlineIssues:
+                    scannerOpenFile(fileName)
+                    issuesFound, issuesFixed, malType = clean_malware('fileOpen')
+                elif self._scanType == 1 and offlineIssues is None:
                     cmds.file(fileName, open=True, force=True)
                     issuesFound, issuesFixed, malType = clean_malware('fileOpen')
+                elif self._scanType == 1:
+                    # a clean file is not opened, the session (mel globals, scriptJobs, userSetup files) is still checked
+                    issuesFound, issuesFixed, malType = clean_malware('fileOpen', nodes=[])
+                elif self._scanType == 2:
+                    scanned, infected, errors = scanSceneDirectory(fileName)
+                    endDirectoryScanSummary(scanned, infected, errors)
+                    return
 
         # end of scanning output summary
         endScanSummary(issuesFound, issuesFixed, malType )
 
 
+def offlineScanFile(fileName):
+    '''
+    scan a scene file without loading it in Maya. Returns the list of issues found,
+    or None if the file could not be scanned offline
+    '''
+    cache = openCache()
+    result = scanCachedSceneFile(cache, fileName)
+    if cache is not None:
+        cache.close()
+
+    if result['status'] == 'error':
+        om.MGlobal.displayWarning('Autodesk.MayaScanner : unable to scan \'%s\' offline : %s' % (fileName, result['error']))
+        return None
+    return result['issues']
+
+
+def scanSceneDirectory(directory):
+    '''
+    scan all the scene files of a directory tree offline, with a pool of worker processes.
+    Returns the number of files scanned, infected and not scanned
+    '''
+    scanned = infected = errors = 0
+    cache = openCache()
+    log.info("checking issues in directory: %s" % directory)
+    for result in scanDirectory(directory, cache=cache):
+        scanned += 1
+        if result['status'] == 'infected':
+            infected += 1
+        elif result['status'] == 'error':
+            errors += 1
+        if result['status'] != 'clean':
+            log.info(issueMessage(result))
+    if cache is not None:
+        cache.close()
+    return scanned, infected, errors
+
+
 def getReadFileName(message, scanType, fileFilter=''):
     fileName = cmds.fileDialog2(dialogStyle=2, fm=scanType, fileFilter=fileFilter, caption=message, okCaption="Scan")
     if not((fileName is None) or (len(fileName[0]) == 0)):
@@ -220,6 +335,16 @@ def syntaxCreator():
     # flag will be expecting a numeric value, denoted by OpenMaya.MSyntax.kDouble
     syntax.addFlag( kScanTypeFlag, kScanTypeLongFlag, om.MSyntax.kDouble )
 
+    # file or directory to scan, skips the file browser
+    syntax.addFlag( kPathFlag, kPathLongFlag, om.MSyntax.kString )
+
+    # print the timing statistics of the scanner phases instead of scanning
+    syntax.addFlag( kStatsFlag, kStatsLongFlag )
+
+    # turn the timing of the scanner phases on or off, and its JSON lines file
+    syntax.addFlag( kTimingFlag, kTimingLongFlag, om.MSyntax.kBoolean )
+    syntax.addFlag( kTimingFileFlag, kTimingFileLongFlag, om.MSyntax.kString )
+
     return syntax
 
 
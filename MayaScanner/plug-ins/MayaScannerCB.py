@@ -10,17 +10,37 @@
 #    maya.cmds.loadPlugin("MayaScannerCB.py")
 #    maya.cmds.MayaScannerCB()
 #
+# The latency of each scene callback is kept in a histogram, with the
+# number of files, nodes and bytes scanned, and flushed to a local JSON
+# file (see MayaScannerTiming.LatencyStats):
+#
+#    maya.cmds.MayaScannerCB(stats=True)
+#
 ########################################################################
 
 import sys
 import os
+import time
+from collections import OrderedDict
+
+# the scanner modules need Python 3 : Maya 2022 or later, not in Python 2 mode
+if sys.version_info[0] < 3:
+    raise ImportError('Autodesk.MayaScanner needs Maya running Python 3 (Maya 2022 or later)')
+
 import maya.cmds as cmds
 import maya.mel as mel
 import maya.api.OpenMaya as om
 import maya.OpenMaya as OpenMaya
 
-from MayaScannerCleaner import clean_malware, userConfirmFix
+from MayaScannerCleaner import clean_malware, userConfirmFix, reportIssue, test_scriptNodes, isScannerLoad
+from MayaScannerProbe import probeScene, SceneProbe
 from MayaScannerUtils import FnPlugin, MsgFormat
+from MayaScannerBatch import isSceneFile, scanCachedSceneFile, cachedSceneResult, issueMessage, kIssuesFound
+from MayaScannerCache import openCache
+from MayaScannerRefs import PrefetchScan
+from MayaScannerQuarantine import quarantineFile
+from MayaScannerDetect import matchScriptNode, test_scriptJobData
+from MayaScannerTiming import LatencyStats, statsFile
 
 
 def maya_useNewAPI():
@@ -34,17 +54,60 @@ def maya_useNewAPI():
 MayaScannerCB_cbIds = []
 MayaScannerCB_result = 0
 
+# latency of the callbacks by client data, and counts of the files, nodes and bytes scanned
+MayaScannerCB_stats = LatencyStats(statsFile('MayaScannerCB'))
+
+kStatsFlag = "-sts"
+kStatsLongFlag = "-stats"
+
+# files larger than this are not scanned by the check callbacks, before Maya reads them, but in
+# the background while Maya reads them (see MayaScanBeforeCB). Only their cached result can veto them
+kSyncScanMaxSize = 256 * 1024 * 1024
+
+# seconds to wait for the background scan of a loaded file, before scanning the scene in Maya instead
+kPrefetchTimeout = 2.0
+
+
+class MayaScannerSession(object):
+    """
+    Bookkeeping of a file load : the file opened, imported or referenced on its own, and the
+    references loaded with it. The references are kept in ordered sets (OrderedDict keys) and
+    only counted while they load, so the bookkeeping does not depend on the callbacks nesting.
+    The checks of the references are deferred to a single scan, once the whole file is loaded.
+    """
+
+    def __init__(self, kind, fileName):
+        self.kind = kind                    # 'Open', 'Import', 'LoadReference' or 'ImportReference'
+        self.fileName = fileName
+        self.references = OrderedDict()     # references loaded with the file
+        self.corrupted = OrderedDict()      # referenced files holding malicious scriptNodes
+        self.pending = 0                    # references being loaded
+        self.prefetch = None                # background scan of the file and its references
+
+    def isReference(self):
+        return self.kind in ['LoadReference', 'ImportReference']
+
+
+def timedCallback(callback):
+    """
+    Wrap a scene callback so its latency is recorded, by callback type (its client data)
+    """
+    def timed(*args):
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            MayaScannerCB_stats.record(args[-1], time.perf_counter() - start)
+    return timed
+
+
 # command
 class MayaScannerCBcmd(om.MPxCommand):
     kPluginCmdName = "MayaScannerCB"
-    referencedFiles = []
+    scanCache = None
 
-    mayaFile = {
-        'Open'            : "",
-        'Import'          : "",
-        'LoadReference'   : [],
-        'ImportReference' : []
-        }
+    # the file load in progress
+    session = None
 
     def __init__(self):
         om.MPxCommand.__init__(self)
@@ -54,91 +117,223 @@ class MayaScannerCBcmd(om.MPxCommand):
         return MayaScannerCBcmd()
 
     def doIt(self, args):
+        argData = om.MArgParser(self.syntax(), args)
+        if argData.isFlagSet(kStatsFlag):
+            # print the callbacks latency, and write it to the statistics file
+            statsLines = MayaScannerCB_stats.formatLines()
+            for line in statsLines:
+                om.MGlobal.displayInfo(line)
+            if MayaScannerCB_stats.flush():
+                om.MGlobal.displayInfo("Autodesk.MayaScannerCB : statistics written to '%s'" % MayaScannerCB_stats.fileName)
+            self.setResult(statsLines)
+            return
+
         if MayaScannerCB_result != 0:
            cmds.error("Autodesk.MayaScannerCB  : FileCallack : issues have been detected")
         return MayaScannerCB_result
 
     @staticmethod
-    def setFileName(clientData, fileName):
+    def offlineScan(fileName):
         """
-        Fill the MayaScannerCBcmd.mayaFile dictionary entry based on the clientData
+        Scan a scene file without loading it. Unchanged files are answered from the scan cache,
+        which is opened once per session.
         """
-        index = clientData.replace('before', '')
-        if index == clientData:
-            index = clientData.replace('after', '')
+        if MayaScannerCBcmd.scanCache is None:
+            MayaScannerCBcmd.scanCache = openCache()
+        return scanCachedSceneFile(MayaScannerCBcmd.scanCache, fileName)
 
-        # to keep track of recursive References, we push to the array
-        if index in ['LoadReference', 'ImportReference']:
-            MayaScannerCBcmd.mayaFile[index].append(fileName)
-        else:
-            MayaScannerCBcmd.mayaFile[index] = fileName
+    @staticmethod
+    def cachedScan(fileName):
+        """
+        Return the cached result of a scene file, or None if it needs to be scanned
+        """
+        if MayaScannerCBcmd.scanCache is None:
+            MayaScannerCBcmd.scanCache = openCache()
+        if MayaScannerCBcmd.scanCache is None:
+            return None
+        return cachedSceneResult(MayaScannerCBcmd.scanCache, fileName)
 
     @staticmethod
-    def getFileName(clientData):
+    def MayaPreScanCheckCB(fileObject, clientData):
         """
-        Get the MayaScannerCBcmd.mayaFile dictionary entry based on the clientData
+        Check callback : scan the file offline before Maya reads it, so the scriptNodes of an
+        infected file never get a chance to execute. Returns False to veto the file load.
+        Files over kSyncScanMaxSize are only vetoed from their cached result, their scan is
+        overlapped with Maya's read by the background scan.
         """
-        index = clientData.replace('after', '')
-        if index == clientData:
-            index = clientData.replace('before', '')
-         
-        # to keep track of recursive References, we pop from the array at each call.
-        # Note that this approach works because there is only one call of this function
-        # in the MayaScanAfterCB
-        if index in ['LoadReference', 'ImportReference']:
-            return MayaScannerCBcmd.mayaFile[index].pop()
+        global MayaScannerCB_result
+
+        fileName = fileObject.resolvedFullName()
+        if not isSceneFile(fileName) or not os.path.isfile(fileName):
+            return True
+
+        # MayaScan opens infected files, with their scriptNodes disabled, to clean them
+        if isScannerLoad(fileName):
+            return True
+
+        try:
+            if os.path.getsize(fileName) > kSyncScanMaxSize:
+                # large files are scanned in the background, while Maya reads them
+                result = MayaScannerCBcmd.cachedScan(fileName)
+                if result is None:
+                    MayaScannerCB_stats.count('deferredFiles')
+                    return True
+            else:
+                result = MayaScannerCBcmd.offlineScan(fileName)
+        except Exception as e:
+            # never block a file because the scanner failed, the After* callbacks still check the scene
+            sys.stderr.write("Autodesk.MayaScannerCB : unable to scan '%s' before loading it : %s\n" % (fileName, e))
+            return True
+
+        if result.get('cached'):
+            MayaScannerCB_stats.count('cachedFiles')
         else:
-            return MayaScannerCBcmd.mayaFile[index]
+            MayaScannerCB_stats.count('scannedFiles')
+            # the size stat'ed by the scan, the file may be gone since
+            if 'key' in result:
+                MayaScannerCB_stats.count('scannedBytes', result['key'][0])
+            else:
+                try:
+                    MayaScannerCB_stats.count('scannedBytes', os.path.getsize(fileName))
+                except OSError:
+                    pass
+
+        if result['status'] != 'infected':
+            return True
+
+        MayaScannerCB_result = kIssuesFound
+        reportIssue(issueMessage(result))
+        cmds.warning("Autodesk.MayaScannerCB  : %s : infected file '%s' was not loaded" % (clientData, os.path.basename(fileName)))
+
+        if not cmds.about(batch=True):
+            nodes = '<ul>'
+            for issue in result['issues']:
+                nodes += '<li>%s (%s)</li>' % (issue['node'], issue['malware'])
+            nodes += '</ul>'
+            cmds.confirmDialog(
+                title='Autodesk.MayaScannerCB',
+                message=MsgFormat("Found corrupted scene file '%s', it was not loaded.<br>" \
+                                  "Malicious scriptNodes:" \
+                                  "%s" \
+                                  "<br>Fix the file offline (cleanScriptNode) before using it.<br>" % (os.path.basename(fileName), nodes)),
+                messageAlign='center',
+                button=['OK'],
+                defaultButton='OK',
+                dismissString='OK'
+            )
+        return False
 
     @staticmethod
-    def UpdateReferencesList(fileName, corrupted, isRef):
+    def startPrefetch(fileName):
         """
-        Check if we need to remove fileName from MayaScannerCBcmd.referencedFiles
+        Start the background scan of a scene file and of the files it references
         """
-        if not corrupted and isRef:
-            # remove fileName from the list since it has been reported as 'not corrupted'
-            # and we don't want to display it in the dialog.
-            
-            # Just in case fileName is not in the list, let's ignore the raised exception
-            try:
-                MayaScannerCBcmd.referencedFiles.remove(fileName)
-            except ValueError:
-                sys.stderr.write("trying to remove unknown element(%s) from list\n" % fileName)
+        if not isSceneFile(fileName):
+            return None
+        try:
+            return PrefetchScan(fileName)
+        except Exception as e:
+            sys.stderr.write("Autodesk.MayaScannerCB : unable to scan '%s' in the background : %s\n" % (fileName, e))
+            return None
+
+    @staticmethod
+    def referenceNodes(fileName):
+        """
+        Return the nodes brought in by a loaded reference, or None if they can't be found
+        (imported references no longer have a reference node)
+        """
+        try:
+            refNode = cmds.referenceQuery(fileName, referenceNode=True)
+            return cmds.referenceQuery(refNode, nodes=True) or []
+        except RuntimeError:
+            return None
 
     @staticmethod
     def MayaScanBeforeCB(clientData):
-        # This callback is only used to remember the Maya file name in case it gets cleared because
-        # of reading errors so the call 'cmds.file(q=True, sn=True)' would not be able to return a
-        # meaningful value
+        # Remember the Maya file name in case it gets cleared because of reading errors so the call
+        # 'cmds.file(q=True, sn=True)' would not be able to return a meaningful value, and start
+        # the background scan of the file
+        global MayaScannerCB_result
+
+        kind = clientData.replace('before', '')
         if clientData == 'beforeOpen':
-            # when running in Python 2.x, the list does not defines 'clear'
-            if sys.version_info[0] < 3:
-                MayaScannerCBcmd.referencedFiles[:] = []
-            else:
-                MayaScannerCBcmd.referencedFiles.clear()
-            MayaScannerCBcmd.setFileName(clientData, OpenMaya.MFileIO.beforeOpenFilename())
+            fileName = OpenMaya.MFileIO.beforeOpenFilename()
         elif clientData == 'beforeImport':
-            # when running in Python 2.x, the list does not defines 'clear'
-            if sys.version_info[0] < 3:
-                MayaScannerCBcmd.referencedFiles[:] = []
-            else:
-                MayaScannerCBcmd.referencedFiles.clear()
-            MayaScannerCBcmd.setFileName(clientData, OpenMaya.MFileIO.beforeImportFilename())
-        elif clientData == 'beforeLoadReference' or clientData == 'beforeImportReference':
-            fname = OpenMaya.MFileIO.beforeReferenceFilename()
-            MayaScannerCBcmd.setFileName(clientData, fname)
-            if fname not in MayaScannerCBcmd.referencedFiles:
-                MayaScannerCBcmd.referencedFiles.append(fname)
-        
+            fileName = OpenMaya.MFileIO.beforeImportFilename()
+        else:
+            fileName = OpenMaya.MFileIO.beforeReferenceFilename()
+
+        session = MayaScannerCBcmd.session
+        if session is not None and not OpenMaya.MFileIO.isReadingFile():
+            # left over by a load that failed before its After* callback, so it was never checked.
+            # Its references would otherwise be queued forever, and the session never checked again
+            session = None
+        if session is not None and kind in ['LoadReference', 'ImportReference']:
+            # a reference loaded with the current file, it is checked with it
+            session.references[fileName] = None
+            session.pending += 1
+            return
+
+        # a new file load, the issues of the previous ones are no longer reported by the command
+        MayaScannerCB_result = 0
+
+        session = MayaScannerSession(kind, fileName)
+        if session.isReference():
+            session.pending = 1
+        session.prefetch = MayaScannerCBcmd.startPrefetch(fileName)
+        MayaScannerCBcmd.session = session
+
     @staticmethod
     def MayaScanAfterCB(clientData):
+        session = MayaScannerCBcmd.session
+        if session is None:
+            # the plug-in was loaded while the file was loading
+            session = MayaScannerSession(clientData.replace('after', ''), cmds.file(q=True, sn=True))
+
+        if clientData in ['afterLoadReference', 'afterImportReference']:
+            session.pending -= 1
+            if not session.isReference() or session.pending > 0:
+                # queued, the references are checked once the whole file is loaded
+                return
+
+        MayaScannerCBcmd.session = None
+        MayaScannerCBcmd.checkSession(session)
+
+    @staticmethod
+    def sessionTainted(probe):
+        """
+        Return True if the session evidence of a probe shows the malware at work : mel procedures
+        entered interactively, scriptJob id globals or malware scriptJobs
+        """
+        if probe.jobGlobals:
+            return True
+        if 'Mel procedure entered interactively.' in probe.procs.values():
+            return True
+        return any([test_scriptJobData(job) for job in probe.scriptJobs])
+
+    @staticmethod
+    def checkSession(session):
+        """
+        Check a loaded file and all the references loaded with it in a single scan, and report
+        the issues found in one dialog. The session (mel globals, scriptJobs, userSetup files)
+        is checked after every load, whatever the verdict of the background scan.
+        """
         kSaveAndQuit     = 'Save and Quit'
         kQuitWithoutSave = 'Quit without Saving'
         retStatus = 0    # no issues found
 
-        # get the correct baseName from the fileName dictionary
-        fileName = MayaScannerCBcmd.getFileName(clientData)
-        mayaBaseName = os.path.basename(fileName)
+        mayaBaseName = os.path.basename(session.fileName)
+        referenceLoad = session.isReference()
+
+        # the background scan is usually done by now. When it found the file, and every file it
+        # references, clean, their script nodes need not be checked again in the scene. The session
+        # (mel globals, scriptJobs, userSetup files) is always checked, and the whole scene too when
+        # the session is infected : its scriptJobs may have created script nodes since the file loaded
+        probe = None
+        if session.prefetch is not None and session.prefetch.verdict(timeout=kPrefetchTimeout) == 'clean':
+            sessionProbe = probeScene([])
+            if not MayaScannerCBcmd.sessionTainted(sessionProbe):
+                probe = sessionProbe
 
         # define the QUARANTINED folder where 'fixed' file will be saved. This is only used
         # when 'cmds.file(q=True,sn=True) == ""' because we don't want to overwrite the orinal file (even
@@ -147,19 +342,35 @@ class MayaScannerCBcmd(om.MPxCommand):
 
         # detect if we are processing a referenced file so we don't 'prompt to fix' inside the clean_malware
         # since, anyway, we can't modify referenced files and user must fix them manually
-        referenceLoad = False
         warnCase = 'FileCallback'
-        if clientData == 'afterLoadReference' or clientData == 'afterImportReference':
+        if referenceLoad:
             warnCase = 'ReferenceCallback'
-            referenceLoad = True
-        elif clientData == 'afterImport' and cmds.file(q=True,sn=True) == "":
+        elif session.kind == 'Import' and cmds.file(q=True,sn=True) == "":
             warnCase = 'Import No Scene Name'
 
-        userConfirmFix('reset', '', 1)
-        corrupt_found, corrupt_fixed, malType = clean_malware('FileOpenCB', referenceLoad)
+        # the script nodes to check : the whole scene, or only the nodes of a reference loaded on its own
+        nodes = None
+        if referenceLoad:
+            nodes = []
+            for fileName in [session.fileName] + list(session.references):
+                nodes += MayaScannerCBcmd.referenceNodes(fileName) or []
+
+        # gather all the in-scene evidence at once. Referenced script nodes can't be removed,
+        # report their files instead
+        if probe is None:
+            probe = probeScene(nodes)
+        MayaScannerCB_stats.count('scannedNodes', len(probe.scriptNodes))
+        MayaScannerCB_stats.count('scannedNodeBytes', sum([len(script[1] or '') for script in probe.scriptNodes]))
+        refProbe = SceneProbe()
+        refProbe.scriptNodes = [script for script in probe.scriptNodes if script[2]]
+        probe.scriptNodes = [script for script in probe.scriptNodes if not script[2]]
+        refCorrupted = test_scriptNodes(probe=refProbe)
+        for script in refCorrupted:
+            session.corrupted[cmds.referenceQuery(script, filename=True)] = None
 
-        # if the clean_malware detected no corruption, remove mayaBaseName from the References list
-        MayaScannerCBcmd.UpdateReferencesList(fileName, corrupt_found, referenceLoad)
+        userConfirmFix('reset', '', 1)
+        corrupt_found, corrupt_fixed, malType = clean_malware('FileOpenCB', referenceLoad, nodes, probe=probe)
+        corrupt_found += len(refCorrupted)
 
         if corrupt_found != 0:
             retStatus = 19        # issues found
@@ -171,6 +382,15 @@ class MayaScannerCBcmd(om.MPxCommand):
             
             cmds.warning("Autodesk.MayaScannerCB  : %s : detected corrupted scene. Please check scene file '%s'" % (warnCase,mayaBaseName))
 
+            # keep the infected files, as loaded, in the quarantine store before the scene gets saved over
+            # the quarantine entries keep the ids of the rules hit
+            matched = [(script, matchScriptNode(script[0], script[1])) for script in probe.scriptNodes + refProbe.scriptNodes]
+            infected = [script[0] for script, rule in matched if rule and not script[2]]
+            ruleIds = [rule['id'] for script, rule in matched if rule]
+            for fileName in ([session.fileName] if infected else []) + list(session.corrupted):
+                if os.path.isfile(fileName) and quarantineFile(fileName, ruleIds) is None:
+                    cmds.warning("Autodesk.MayaScannerCB  : unable to quarantine '%s'" % fileName)
+
             if not referenceLoad:
                 # if errors occured while reading the file and we can't get its filename from the
                 # 'cmds.file()' command, we use the mayaBaseName instead
@@ -180,12 +400,12 @@ class MayaScannerCBcmd(om.MPxCommand):
                 if not os.path.exists(quarantinedFolder):
                     os.makedirs(quarantinedFolder)
 
-                if len(MayaScannerCBcmd.referencedFiles) > 0:
+                if len(session.corrupted) > 0:
                     # we have a list of corrupted references files. Display info (this is a delayed pop-up because
                     # we want to display it only once with the list of all 'corrupted' references (instead of popping
                     # it for each file)
                     refFiles = '<ul>'
-                    for f in MayaScannerCBcmd.referencedFiles:
+                    for f in session.corrupted:
                         refFiles += '<li>'+os.path.basename(f)+'</li>'
                     refFiles += '</ul>'
 
@@ -282,12 +502,23 @@ class MayaScannerCBcmd(om.MPxCommand):
                 om.MMessage.removeCallback(id)
 
 
+def syntaxCreator():
+    ''' Define argument flag syntax  '''
+
+    syntax = om.MSyntax()
+
+    # print the latency statistics of the callbacks, and flush them to their file
+    syntax.addFlag( kStatsFlag, kStatsLongFlag )
+
+    return syntax
+
+
 # Initialize the plug-in
 def initializePlugin(obj):
     plugin = FnPlugin(obj)
     try:
         plugin.registerCommand(
-            MayaScannerCBcmd.kPluginCmdName, MayaScannerCBcmd.creator
+            MayaScannerCBcmd.kPluginCmdName, MayaScannerCBcmd.creator, syntaxCreator
         )
     except:
         sys.stderr.write(
@@ -296,16 +527,22 @@ def initializePlugin(obj):
         raise
 
     # add Before* callbacks so we can get the filename before it gets cleared if errors occurred during the file read pass
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeOpen, MayaScannerCBcmd.MayaScanBeforeCB,'beforeOpen'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeImport, MayaScannerCBcmd.MayaScanBeforeCB,'beforeImport'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeLoadReference, MayaScannerCBcmd.MayaScanBeforeCB,'beforeLoadReference'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeImportReference, MayaScannerCBcmd.MayaScanBeforeCB,'beforeImportReference'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeOpen, timedCallback(MayaScannerCBcmd.MayaScanBeforeCB),'beforeOpen'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeImport, timedCallback(MayaScannerCBcmd.MayaScanBeforeCB),'beforeImport'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeLoadReference, timedCallback(MayaScannerCBcmd.MayaScanBeforeCB),'beforeLoadReference'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kBeforeImportReference, timedCallback(MayaScannerCBcmd.MayaScanBeforeCB),'beforeImportReference'))
+
+    # add the Before*Check callbacks to scan the files offline and refuse the infected ones before they are read
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCheckFileCallback(om.MSceneMessage.kBeforeOpenCheck, timedCallback(MayaScannerCBcmd.MayaPreScanCheckCB),'beforeOpenCheck'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCheckFileCallback(om.MSceneMessage.kBeforeImportCheck, timedCallback(MayaScannerCBcmd.MayaPreScanCheckCB),'beforeImportCheck'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCheckFileCallback(om.MSceneMessage.kBeforeLoadReferenceCheck, timedCallback(MayaScannerCBcmd.MayaPreScanCheckCB),'beforeLoadReferenceCheck'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCheckFileCallback(om.MSceneMessage.kBeforeCreateReferenceCheck, timedCallback(MayaScannerCBcmd.MayaPreScanCheckCB),'beforeCreateReferenceCheck'))
 
     # add the After* callbacks to scan the opened file for issues
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterOpen, MayaScannerCBcmd.MayaScanAfterCB,'afterOpen'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterImport, MayaScannerCBcmd.MayaScanAfterCB,'afterImport'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterLoadReference, MayaScannerCBcmd.MayaScanAfterCB,'afterLoadReference'))
-    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterImportReference, MayaScannerCBcmd.MayaScanAfterCB,'afterImportReference'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterOpen, timedCallback(MayaScannerCBcmd.MayaScanAfterCB),'afterOpen'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterImport, timedCallback(MayaScannerCBcmd.MayaScanAfterCB),'afterImport'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterLoadReference, timedCallback(MayaScannerCBcmd.MayaScanAfterCB),'afterLoadReference'))
+    MayaScannerCB_cbIds.append(om.MSceneMessage.addCallback(om.MSceneMessage.kAfterImportReference, timedCallback(MayaScannerCBcmd.MayaScanAfterCB),'afterImportReference'))
 
 # Uninitialize the plug-in
 def uninitializePlugin(obj):
@@ -313,6 +550,11 @@ def uninitializePlugin(obj):
 
     for id in MayaScannerCB_cbIds:
         om.MMessage.removeCallback(id)
+    MayaScannerCB_stats.flush()
+
+    if MayaScannerCBcmd.scanCache is not None:
+        MayaScannerCBcmd.scanCache.close()
+        MayaScannerCBcmd.scanCache = None
 
     try:
         plugin.deregisterCommand(MayaScannerCBcmd.kPluginCmdName)
@@ -0,0 +1,462 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline scanner for Maya ascii (.ma) scene files.
+#
+# The scene is streamed line by line, without Maya, so an infected
+# scriptNode never gets a chance to execute. Only the 'createNode script'
+# blocks and their string attributes are buffered, every other statement
+# is skipped as it is read, which keeps the memory use constant. Lines
+# are read kMaxLineSize bytes at most, and a script node attribute larger
+# than kMaxStatementSize is matched as it is read instead of buffered.
+#
+# Infected files are cleaned in the same single pass: the malicious
+# 'createNode script' blocks are dropped while the scene is copied to a
+# temporary file, which then atomically replaces the original.
+#
+########################################################################
+
+import os
+import re
+import shutil
+import tempfile
+
+from MayaScannerDetect import ruleSet, matchScriptNode
+from MayaScannerQuarantine import quarantineFile
+
+# string attributes of the script node we want to assess
+kScriptNodeAttrs = {
+    '.b'      : 'b',
+    '.before' : 'b',
+    '.a'      : 'a',
+    '.after'  : 'a',
+    }
+
+# longest line piece read at once, and largest script node statement buffered
+kMaxLineSize = 1 << 20
+kMaxStatementSize = 4 << 20
+kUnescapeWindow = 64 << 10
+
+_codeSpecial = re.compile(b'[";]')
+_stringSpecial = re.compile(b'["\\\\]')
+_tokens = re.compile(b'"((?:[^"\\\\]|\\\\.)*)"|([^\\s";()+]+)|;', re.S)
+_melEscape = re.compile(r'\\(.)', re.S)
+_melEscapes = {'n': '\n', 't': '\t', 'r': '\r'}
+_melByteEscape = re.compile(b'\\\\(.)', re.S)
+_melByteEscapes = {b'n': b'\n', b't': b'\t', b'r': b'\r'}
+_stringBody = re.compile(b'[^"\\\\]*(?:\\\\.[^"\\\\]*)*', re.S)
+
+
+def melUnescape(string):
+    '''
+    convert a MEL string literal body to its value
+    '''
+    if '\\' not in string:
+        return string
+    return _melEscape.sub(lambda m: _melEscapes.get(m.group(1), m.group(1)), string)
+
+
+def iterLines(stream, maxSize=kMaxLineSize):
+    '''
+    yield the lines of a stream opened in binary mode, the lines longer than
+    maxSize bytes in pieces of maxSize bytes
+    '''
+    readline = stream.readline
+    line = readline(maxSize)
+    while line:
+        yield line
+        line = readline(maxSize)
+
+
+class MelStatementSplitter(object):
+    '''
+    Follow the MEL statement boundaries over the lines of a Maya ascii file.
+    The lines are not buffered, only the string/statement state is kept.
+    A long line may be fed in pieces (see iterLines).
+    '''
+
+    def __init__(self):
+        self.inStatement = False
+        self.inString = False
+        self.inComment = False      # the last piece ended in a comment line
+        self.escaped = False        # the last piece ended on a backslash, in a string
+
+    def feed(self, line):
+        '''
+        advance over a line, return True if this line starts a new statement
+        '''
+        if self.inComment:
+            self.inComment = not line.endswith(b'\n')
+            return False
+
+        started = False
+        if not self.inStatement:
+            stripped = line.lstrip()
+            if not stripped:
+                return False
+            if stripped.startswith(b'//'):
+                self.inComment = not line.endswith(b'\n')
+                return False
+            started = True
+            self.inStatement = True
+
+        # fast path, no string literal to follow on this line
+        if not self.inString and b'"' not in line:
+            end = line.rfind(b';')
+            if end >= 0:
+                self.inStatement = bool(line[end+1:].strip())
+            return started
+
+        pos = 0
+        if self.escaped:
+            self.escaped = False
+            pos = 1
+        while True:
+            if self.inString:
+                m = _stringSpecial.search(line, pos)
+                if m is None:
+                    break
+                if m.group() == b'\\':
+                    pos = m.end() + 1
+                    self.escaped = pos > len(line)
+                    continue
+                self.inString = False
+                pos = m.end()
+            else:
+                m = _codeSpecial.search(line, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == b'"':
+                    self.inString = True
+                else:
+                    self.inStatement = bool(line[pos:].strip())
+
+        return started
+
+
+class SetAttrStringStream(object):
+    '''
+    Follow a 'setAttr' statement too large to be buffered, fed in line pieces.
+    The attribute name is kept, and the string value, unescaped, is fed by chunks
+    to a StreamMatch of the script node rules.
+    '''
+
+    def __init__(self):
+        self.attribute = None
+        self.isString = False       # '-type "string"' seen, the next literals are the value
+        self.value = ruleSet().stream('scriptNode')
+        self._literal = []          # the current literal before the value, or the value not fed yet
+        self._literalSize = 0
+        self._inString = False
+        self._escaped = False
+        self._typeNext = False
+        self._code = b''            # the end of the code read, a '-type' may straddle two pieces
+
+    def _emit(self, data):
+        if self._literalSize < kMaxLineSize or self.isString:
+            self._literal.append(data)
+            self._literalSize += len(data)
+        if self.isString and self._literalSize >= kMaxLineSize:
+            self._flush()
+
+    def _flush(self):
+        self.value.feed(b''.join(self._literal))
+        self._literal = []
+        self._literalSize = 0
+
+    def _closeLiteral(self):
+        if self.isString:
+            return
+        literal = b''.join(self._literal)
+        self._literal = []
+        self._literalSize = 0
+        if self.attribute is None:
+            self.attribute = melUnescape(literal.decode('utf-8', 'replace'))
+        elif self._typeNext:
+            self.isString = literal == b'string'
+            self._typeNext = False
+
+    def feed(self, line):
+        pos = 0
+        size = len(line)
+        while pos < size:
+            if self._inString:
+                if self._escaped:
+                    self._escaped = False
+                    self._emit(_melByteEscapes.get(line[pos:pos+1], line[pos:pos+1]))
+                    pos += 1
+                    continue
+                # unescape by windows, the escapes of a window are substituted at once
+                end = min(size, pos + kUnescapeWindow)
+                body = _stringBody.match(line, pos, end)
+                data = body.group()
+                if b'\\' in data:
+                    data = _melByteEscape.sub(lambda m: _melByteEscapes.get(m.group(1), m.group(1)), data)
+                self._emit(data)
+                pos = body.end()
+                if pos >= size:
+                    break
+                if pos == end:
+                    continue
+                if line[pos:pos+1] == b'\\':
+                    # the escaped character is in the next piece
+                    self._escaped = True
+                else:
+                    self._inString = False
+                    self._closeLiteral()
+                pos += 1
+            else:
+                end = line.find(b'"', pos)
+                self._code = (self._code + line[pos:size if end < 0 else end])[-16:]
+                if end < 0:
+                    break
+                if b'-type' in self._code:
+                    self._typeNext = True
+                self._code = b''
+                self._inString = True
+                pos = end + 1
+
+    def close(self):
+        '''
+        return the StreamMatch of the string value
+        '''
+        if self.isString:
+            self._flush()
+        return self.value
+
+
+def parseStatement(data):
+    '''
+    split a MEL statement in its words and (unescaped) string literals.
+    Returns a list of (isString, value) tuples.
+    '''
+    tokens = []
+    for m in _tokens.finditer(data):
+        if m.group(1) is not None:
+            tokens.append((True, melUnescape(m.group(1).decode('utf-8', 'replace'))))
+        elif m.group(2) is not None:
+            tokens.append((False, m.group(2).decode('utf-8', 'replace')))
+        else:
+            # only parse the first statement of the buffer
+            break
+    return tokens
+
+
+def createNodeInfo(tokens):
+    '''
+    return the (type, name) of a 'createNode' statement
+    '''
+    nodeType = None
+    nodeName = None
+    for i, (isString, value) in enumerate(tokens[1:], 1):
+        if not isString and value in ['-n', '-name'] and i+1 < len(tokens):
+            nodeName = tokens[i+1][1]
+        elif not isString and nodeType is None and not value.startswith('-'):
+            nodeType = value
+    return nodeType, nodeName
+
+
+def setAttrStringInfo(tokens):
+    '''
+    return the (attribute, value) of a 'setAttr -type "string"' statement,
+    or (attribute, None) if the statement does not set a string
+    '''
+    attribute = None
+    for i, (isString, value) in enumerate(tokens[1:], 1):
+        if isString:
+            attribute = value
+            break
+    else:
+        return None, None
+
+    for j in range(i+1, len(tokens)-1):
+        if tokens[j] == (False, '-type') and tokens[j+1] == (True, 'string'):
+            return attribute, ''.join([v for isString, v in tokens[j+2:] if isString])
+
+    return attribute, None
+
+
+def iterScriptNodes(stream):
+    '''
+    yield (nodeName, attributes) for each script node created in a Maya ascii
+    stream opened in binary mode. attributes holds the string attributes set
+    on the node, keyed by their short name ('b', 'a').
+    '''
+    splitter = MelStatementSplitter()
+    nodeName = None
+    attributes = {}
+    buffered = None
+    bufferedSize = 0
+    large = None
+
+    for line in stream:
+        started = splitter.feed(line)
+
+        if started:
+            head = line.lstrip()
+            if head.startswith(b'createNode '):
+                # a new node closes the current script node block
+                if nodeName is not None:
+                    yield nodeName, attributes
+                    nodeName = None
+                if head.startswith(b'createNode script '):
+                    buffered = [line]
+                    bufferedSize = 0
+            elif nodeName is not None and head.startswith(b'setAttr '):
+                buffered = [line]
+                bufferedSize = 0
+            elif nodeName is not None and not line[:1].isspace():
+                # any other top level statement closes the block
+                yield nodeName, attributes
+                nodeName = None
+        elif buffered is not None:
+            buffered.append(line)
+        elif large is not None:
+            large.feed(line)
+
+        if buffered is not None:
+            bufferedSize += len(line)
+            if bufferedSize > kMaxStatementSize and nodeName is not None and splitter.inStatement:
+                # a huge attribute, match its value as it is read
+                large = SetAttrStringStream()
+                for piece in buffered:
+                    large.feed(piece)
+                buffered = None
+
+        if large is not None and not splitter.inStatement:
+            if large.attribute in kScriptNodeAttrs and large.isString:
+                attributes[kScriptNodeAttrs[large.attribute]] = large.close()
+            large = None
+
+        if buffered is not None and not splitter.inStatement:
+            tokens = parseStatement(b''.join(buffered))
+            buffered = None
+            if tokens and tokens[0] == (False, 'createNode'):
+                nodeType, name = createNodeInfo(tokens)
+                if nodeType == 'script' and name:
+                    nodeName = name
+                    attributes = {}
+            elif tokens:
+                attribute, value = setAttrStringInfo(tokens)
+                if attribute in kScriptNodeAttrs and value is not None:
+                    attributes[kScriptNodeAttrs[attribute]] = value
+
+    if nodeName is not None:
+        yield nodeName, attributes
+
+
+def _hashedLines(stream, digest):
+    for line in iterLines(stream):
+        digest.update(line)
+        yield line
+
+
+def scanAsciiScene(fileName, digest=None):
+    '''
+    scan a Maya ascii scene file without loading it in Maya.
+    Returns the list of issues found, each issue being a dictionary
+    holding the 'node' name, the 'malware' name and the 'rule' id.
+    The file content is fed to the digest hash object when given.
+    '''
+    issues = []
+    with open(fileName, 'rb') as stream:
+        lines = iterLines(stream) if digest is None else _hashedLines(stream, digest)
+        for nodeName, attributes in iterScriptNodes(lines):
+            rule = matchScriptNode(nodeName, attributes.get('b'))
+            if rule:
+                issues.append({'node': nodeName, 'malware': rule['malware'], 'rule': rule['id']})
+    return issues
+
+
+def cleanAsciiScene(fileName, quarantine=True, digest=None):
+    '''
+    remove the malicious script nodes of a Maya ascii scene file, without Maya.
+    The file is read once, the cleaned scene is written to a temporary file which
+    atomically replaces the original. Nothing is written when the file is clean, the
+    original of an infected file is kept in the quarantine store.
+    Returns (exitCode, issues): 0 no issues found, 19 issues found but not fixed,
+    20 issues found and fixed.
+    The original file content is fed to the digest hash object when given.
+    '''
+    issues = []
+    state = {'temp': None}
+    directory = os.path.dirname(os.path.abspath(fileName))
+
+    def openTemp(prefixSize):
+        # first infected block : copy the file up to it
+        temp = tempfile.NamedTemporaryFile(dir=directory, prefix='.%s.' % os.path.basename(fileName),
+                                           suffix='.tmp', delete=False)
+        with open(fileName, 'rb') as original:
+            while prefixSize > 0:
+                data = original.read(min(prefixSize, 1 << 20))
+                if not data:
+                    break
+                temp.write(data)
+                prefixSize -= len(data)
+        return temp
+
+    def closeBlock(block, blockStart):
+        # the block is spooled to disk when large, read it back by lines
+        with block:
+            block.seek(0)
+            for nodeName, attributes in iterScriptNodes(iterLines(block)):
+                rule = matchScriptNode(nodeName, attributes.get('b'))
+                if rule:
+                    issues.append({'node': nodeName, 'malware': rule['malware'], 'rule': rule['id']})
+                    if state['temp'] is None:
+                        state['temp'] = openTemp(blockStart)
+                    return
+            if state['temp'] is not None:
+                block.seek(0)
+                shutil.copyfileobj(block, state['temp'])
+
+    splitter = MelStatementSplitter()
+    block = None
+    blockStart = 0
+    offset = 0
+    try:
+        with open(fileName, 'rb') as stream:
+            for line in iterLines(stream) if digest is None else _hashedLines(stream, digest):
+                comment = not splitter.inStatement and not splitter.inComment and line.startswith(b'//')
+                started = splitter.feed(line)
+                if block is not None and (started or comment) and not line[:1].isspace():
+                    # any top level statement or comment closes the script node block
+                    closeBlock(block, blockStart)
+                    block = None
+
+                if started and line.lstrip().startswith(b'createNode script '):
+                    block = tempfile.SpooledTemporaryFile(max_size=kMaxStatementSize)
+                    block.write(line)
+                    blockStart = offset
+                elif block is not None:
+                    block.write(line)
+                elif state['temp'] is not None:
+                    state['temp'].write(line)
+                offset += len(line)
+
+            if block is not None:
+                closeBlock(block, blockStart)
+
+        temp = state['temp']
+        if temp is None:
+            return 0, issues
+
+        temp.close()
+        shutil.copymode(fileName, temp.name)
+        if quarantine and quarantineFile(fileName, [issue['rule'] for issue in issues]) is None:
+            raise IOError('unable to quarantine %s' % fileName)
+        os.replace(temp.name, fileName)
+        state['temp'] = None
+
+    except (IOError, OSError):
+        if not issues:
+            raise
+        return 19, issues
+
+    finally:
+        if state['temp'] is not None:
+            state['temp'].close()
+            os.remove(state['temp'].name)
+
+    return 20, issues
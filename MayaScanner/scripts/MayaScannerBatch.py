@@ -0,0 +1,508 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline batch scanning of Maya scene files, without Maya.
+#
+# Directory trees are walked with os.scandir and the scene files are
+# fanned out to a bounded pool of worker processes. Results are streamed
+# back as soon as they are available.
+#
+# To scan a directory tree from a shell:
+#
+#    python MayaScannerBatch.py <path> [-j <workers>] [--no-cache] [--clean]
+#
+# --clean removes the infected scriptNodes of the Maya ascii files, the
+# original files are kept in the quarantine store (MayaScannerQuarantine)
+#
+# To scan scenes and all the files they reference, recursively:
+#
+#    python MayaScannerBatch.py --references <scene> [-s <search path>]
+#
+# --json streams one JSON record per file (NDJSON) to stdout as soon as
+# the file is scanned, for pipelines. The paths are read from stdin, one
+# per line, when none is given or when the path is '-':
+#
+#    find /assets -name "*.ma" | python -m MayaScannerBatch --json
+#
+# --resume keeps a checkpoint journal of the files scanned (see
+# MayaScannerJournal), an interrupted scan run again resumes where it
+# stopped. --order schedules the files : 'recent' most recently modified
+# first, 'smallest' first, or 'priority' the files matching the --priority
+# path patterns first, by the order given. The files are stat'ed and sorted
+# by windows of --window files as the walk finds them, so the scan starts
+# without waiting for the whole walk:
+#
+#    python MayaScannerBatch.py <path> --clean --resume --order priority --priority "*/shots/*"
+#
+# exit codes: 0 no issues found, 19 issues found, 20 issues found and fixed,
+# 21 no issues found but some files could not be scanned
+#
+########################################################################
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import fnmatch
+import argparse
+import itertools
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from MayaScannerAscii import scanAsciiScene, cleanAsciiScene
+from MayaScannerBinary import scanBinaryScene
+from MayaScannerCache import openCache, contentDigest, fileKey
+from MayaScannerDetect import ruleSet
+from MayaScannerJournal import ScanJournal, journalFile
+
+# offline scanners by scene file extension
+kSceneScanners = {
+    '.ma' : scanAsciiScene,
+    '.mb' : scanBinaryScene,
+    }
+
+# exit codes, same as the MayaScan command
+kNoIssues = 0
+kIssuesFound = 19
+kIssuesFixed = 20
+kScanErrors = 21
+
+# scan orders, see scheduleFiles()
+kScanOrders = ['walk', 'recent', 'smallest', 'priority']
+
+# files sorted together by the scan orders
+kScheduleWindow = 10000
+
+# number of files sent to a worker at once, and number of batches queued per worker
+kBatchSize = 16
+kQueueDepth = 2
+
+
+def isSceneFile(fileName):
+    return os.path.splitext(fileName)[1].lower() in kSceneScanners
+
+
+def scanSceneFile(fileName, withHash=False):
+    '''
+    scan a scene file offline. Returns a result dictionary holding the file 'path',
+    its 'status' ('clean', 'infected' or 'error') and the list of 'issues' found.
+    withHash adds the file 'key' (see MayaScannerCache.fileKey) and content 'hash'.
+    '''
+    result = {'path': fileName, 'status': 'clean', 'issues': []}
+    scanner = kSceneScanners.get(os.path.splitext(fileName)[1].lower())
+    digest = contentDigest() if withHash else None
+    try:
+        if scanner is None:
+            raise ValueError('unknown scene file type')
+        if withHash:
+            result['key'] = fileKey(os.stat(fileName))
+        result['issues'] = scanner(fileName, digest)
+    except (IOError, OSError, ValueError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    if result['issues']:
+        result['status'] = 'infected'
+    if withHash:
+        result['hash'] = digest.hexdigest()
+    return result
+
+
+def cleanSceneFile(fileName, withHash=False):
+    '''
+    scan a scene file offline and remove its infected script nodes. Same result as
+    scanSceneFile(), the status is 'cleaned' when the file has been fixed.
+    Only Maya ascii files can be cleaned offline.
+    '''
+    if os.path.splitext(fileName)[1].lower() != '.ma':
+        return scanSceneFile(fileName, withHash)
+
+    result = {'path': fileName, 'status': 'clean', 'issues': []}
+    digest = contentDigest() if withHash else None
+    try:
+        key = fileKey(os.stat(fileName))
+        exitCode, result['issues'] = cleanAsciiScene(fileName, digest=digest)
+    except (IOError, OSError, ValueError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    if exitCode == kIssuesFixed:
+        result['status'] = 'cleaned'
+    elif exitCode == kIssuesFound:
+        result['status'] = 'infected'
+    elif withHash:
+        # unchanged file, its scan result can be cached
+        result['key'] = key
+        result['hash'] = digest.hexdigest()
+    return result
+
+
+def _scanBatch(fileNames, withHash=False, clean=False):
+    if clean:
+        return [cleanSceneFile(fileName, withHash) for fileName in fileNames]
+    return [scanSceneFile(fileName, withHash) for fileName in fileNames]
+
+
+def cachedSceneResult(cache, fileName):
+    '''
+    return the cached result of a scene file, or None if it needs to be scanned
+    '''
+    cached = cache.lookup(fileName, ruleSet().targetDigests['scriptNode'])
+    if cached is None:
+        return None
+    result = {'path': fileName, 'cached': True}
+    result.update(cached)
+    return result
+
+
+def storeSceneResult(cache, result):
+    '''
+    store the result of a scene file scanned with withHash=True
+    '''
+    if result['status'] not in ['clean', 'infected'] or 'key' not in result:
+        return
+    rules = ruleSet()
+    cache.store(result['path'], rules.targetDigests['scriptNode'],
+                {'status': result['status'], 'issues': result['issues']},
+                result['key'], result.get('hash'), rules.version)
+
+
+def scanCachedSceneFile(cache, fileName):
+    '''
+    return the cached result of a scene file, or scan it and store its result.
+    cache may be None.
+    '''
+    if cache is None:
+        return scanSceneFile(fileName)
+    result = cachedSceneResult(cache, fileName)
+    if result is None:
+        result = scanSceneFile(fileName, withHash=True)
+        storeSceneResult(cache, result)
+        cache.commit()
+    return result
+
+
+def iterSceneFiles(root):
+    '''
+    yield the scene files found under root, recursively.
+    Symbolic links to directories are not followed. A root which is not a
+    directory is yielded as is, so a missing file is reported by its scan.
+    '''
+    if not os.path.isdir(root):
+        yield root
+        return
+
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and isSceneFile(entry.name):
+                    yield entry.path
+            except OSError:
+                continue
+
+
+def scheduleFiles(fileNames, order='walk', priorities=(), window=kScheduleWindow):
+    '''
+    return the scene files in scan order : 'walk' as they are found, 'recent' most recently
+    modified first, 'smallest' smallest first, 'priority' the files matching the first
+    priority path pattern first, then the second... most recently modified first.
+    Files which can't be stat'ed come last, their scan reports the error.
+    The files are sorted by windows of window files, in walk order, so the first files
+    are scanned before the walk is over. window=None sorts all the files, which stats
+    every file of the walk before the first one is scanned.
+    '''
+    if order == 'walk':
+        return fileNames
+
+    def sortKey(fileName):
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return (len(priorities) + 1, 0)
+        if order == 'smallest':
+            return (0, st.st_size)
+        rank = 0
+        if order == 'priority':
+            rank = len(priorities)
+            for i, pattern in enumerate(priorities):
+                if fnmatch.fnmatch(fileName, pattern):
+                    rank = i
+                    break
+        return (rank, -st.st_mtime_ns)
+
+    if not window:
+        return sorted(fileNames, key=sortKey)
+    return _windowSorted(iter(fileNames), sortKey, window)
+
+
+def _windowSorted(fileNames, sortKey, window):
+    while True:
+        batch = sorted(itertools.islice(fileNames, window), key=sortKey)
+        if not batch:
+            return
+        for fileName in batch:
+            yield fileName
+
+
+def poolContext():
+    '''
+    return the multiprocessing context for the worker processes.
+    Inside Maya, sys.executable is Maya itself, so the workers are started with mayapy.
+    '''
+    context = multiprocessing.get_context('spawn')
+    executable = os.path.basename(sys.executable).lower()
+    if executable.startswith('maya') and not executable.startswith('mayapy'):
+        mayapy = 'mayapy.exe' if os.name == 'nt' else 'mayapy'
+        context.set_executable(os.path.join(os.path.dirname(sys.executable), mayapy))
+    return context
+
+
+def scanFiles(fileNames, workers=None, cache=None, clean=False):
+    '''
+    scan the scene files with a pool of worker processes, yield the results
+    as they are completed. workers=1 scans the files in the current process.
+    Files unchanged since they were scanned are answered from the ScanCache
+    when given, and the new results are stored in it.
+    clean removes the infected script nodes of the files (see cleanSceneFile).
+    '''
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 61)
+    withHash = cache is not None
+
+    def cachedResult(fileName):
+        if cache is None:
+            return None
+        result = cachedSceneResult(cache, fileName)
+        # infected files still have to be cleaned
+        if result is not None and clean and result['status'] == 'infected':
+            return None
+        return result
+
+    def completed(results):
+        for result in results:
+            if cache is not None:
+                storeSceneResult(cache, result)
+            yield result
+
+    if workers <= 1:
+        for fileName in fileNames:
+            result = cachedResult(fileName)
+            if result is None:
+                result = next(completed(_scanBatch([fileName], withHash, clean)))
+            yield result
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=poolContext()) as pool:
+        pending = set()
+        batch = []
+        for fileName in fileNames:
+            result = cachedResult(fileName)
+            if result is not None:
+                yield result
+                continue
+
+            batch.append(fileName)
+            if len(batch) < kBatchSize:
+                continue
+            pending.add(pool.submit(_scanBatch, batch, withHash, clean))
+            batch = []
+
+            # bound the number of queued batches, the file list may be huge
+            if len(pending) >= workers * kQueueDepth:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in completed(future.result()):
+                        yield result
+
+        if batch:
+            pending.add(pool.submit(_scanBatch, batch, withHash, clean))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in completed(future.result()):
+                    yield result
+
+
+def scanDirectory(root, workers=None, cache=None, clean=False):
+    '''
+    scan all the scene files found under root, yield the results as they are completed
+    '''
+    return scanFiles(iterSceneFiles(root), workers, cache, clean)
+
+
+def issueMessage(result):
+    '''
+    format the issues of a scan result for the logs
+    '''
+    if result['status'] == 'error':
+        return '%s : unable to scan : %s' % (result['path'], result['error'])
+    action = 'removed' if result['status'] == 'cleaned' else 'present'
+    return '\n'.join(['%s : scriptNode %s : %s (%s)' % (result['path'], action, issue['node'], issue['malware'])
+                      for issue in result['issues']])
+
+
+# result fields written to the JSON records
+kRecordFields = ['path', 'status', 'issues', 'error', 'cached', 'hash']
+
+
+def jsonRecord(result):
+    '''
+    format a scan result as a single line JSON record
+    '''
+    return json.dumps(dict([(k, result[k]) for k in kRecordFields if k in result]), sort_keys=True)
+
+
+def iterPaths(paths, stdin=None):
+    '''
+    yield the paths given, the '-' path reads the paths from stdin, one per line
+    '''
+    for path in paths:
+        if path != '-':
+            yield path
+            continue
+        for line in stdin or sys.stdin:
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan Maya scene files for malicious scripts, without Maya.')
+    parser.add_argument('paths', nargs='*', help='scene files or directories to scan, - to read them from stdin')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--cache', default=None, help='scan cache file (default: MAYASCANNER_CACHE or the user cache directory)')
+    parser.add_argument('--no-cache', action='store_true', help='scan all the files, ignoring the scan cache')
+    parser.add_argument('--clean', action='store_true', help='remove the infected scriptNodes of the Maya ascii files')
+    parser.add_argument('-r', '--references', action='store_true', help='scan the scenes references, recursively')
+    parser.add_argument('-s', '--search-path', action='append', default=[], help='directory to resolve references from')
+    parser.add_argument('--json', action='store_true', help='write one JSON record per file to stdout (NDJSON)')
+    parser.add_argument('--resume', action='store_true', help='keep a checkpoint journal, to resume an interrupted scan')
+    parser.add_argument('--journal', default=None, help='checkpoint journal file (default: in the user cache directory)')
+    parser.add_argument('--order', choices=kScanOrders, default='walk', help='scan order of the files')
+    parser.add_argument('--priority', action='append', default=[], help='path pattern scanned first (--order priority)')
+    parser.add_argument('--window', type=int, default=kScheduleWindow,
+                        help='files sorted together by --order, 0 to sort all the files after the whole walk (default: %d)' % kScheduleWindow)
+    args = parser.parse_args(argv)
+    if not args.paths:
+        args.paths = ['-']
+
+    cache = None if args.no_cache else openCache(args.cache)
+    if args.references:
+        status = mainReferences(args, cache)
+        if cache is not None:
+            cache.close()
+        return status
+
+    # the summary goes to stderr when stdout holds the JSON records
+    summary = sys.stderr if args.json else sys.stdout
+    fileNames = itertools.chain.from_iterable(iterSceneFiles(path) for path in iterPaths(args.paths))
+
+    counts = {'clean': 0, 'infected': 0, 'cleaned': 0, 'error': 0}
+    journal = None
+    if args.resume or args.journal:
+        try:
+            journal = ScanJournal(args.journal or journalFile(args.paths, args.clean))
+        except (IOError, OSError) as e:
+            print('unable to open the checkpoint journal : %s' % e, file=sys.stderr)
+            if cache is not None:
+                cache.close()
+            return 2
+        if journal.results:
+            print('resuming : %d files already scanned (%s)' % (len(journal.results), journal.fileName), file=summary)
+        # the files which could not be scanned are not journaled as done, they are scanned again
+        for record in journal.results.values():
+            counts[record['status']] += 1
+        fileNames = (fileName for fileName in fileNames if not journal.done(fileName))
+
+    try:
+        for result in scanFiles(scheduleFiles(fileNames, args.order, args.priority, args.window), args.workers, cache, args.clean):
+            counts[result['status']] += 1
+            if journal is not None:
+                journal.record(result)
+            if args.json:
+                print(jsonRecord(result))
+            elif result['status'] != 'clean':
+                print(issueMessage(result))
+            sys.stdout.flush()
+        if journal is not None:
+            journal.complete()
+    finally:
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+
+    scanned = sum(counts.values())
+    infected, cleaned, errors = counts['infected'], counts['cleaned'], counts['error']
+
+    if args.clean:
+        print('scanned %d files : %d cleaned, %d infected, %d errors' % (scanned, cleaned, infected, errors), file=summary)
+    else:
+        print('scanned %d files : %d infected, %d errors' % (scanned, infected, errors), file=summary)
+
+    if infected:
+        return kIssuesFound
+    if errors:
+        # an unscanned file is not a clean file
+        return kScanErrors
+    return kIssuesFixed if cleaned else kNoIssues
+
+
+def mainReferences(args, cache):
+    from MayaScannerRefs import scanReferenceGraph
+
+    scenes = []
+    for path in iterPaths(args.paths):
+        scenes.extend(iterSceneFiles(path))
+    report = scanReferenceGraph(scenes, args.workers, cache, args.search_path)
+
+    if args.json:
+        tainted = 0
+        for scene, sceneReport in sorted(report['scenes'].items()):
+            print(json.dumps({'path': scene, 'status': sceneReport['status'], 'paths': sceneReport['paths'],
+                              'unresolved': sceneReport['unresolved']}, sort_keys=True))
+            if sceneReport['status'] == 'tainted':
+                tainted += 1
+        return referencesStatus(report, tainted)
+
+    for result in report['files'].values():
+        if result['status'] == 'error':
+            print(issueMessage(result))
+    for scene, reference in report['unresolved']:
+        print('%s : unresolved reference : %s' % (scene, reference))
+
+    tainted = 0
+    for scene, sceneReport in sorted(report['scenes'].items()):
+        for path in sceneReport['paths']:
+            print('%s : tainted through %s' % (scene, ' -> '.join(path)))
+        if sceneReport['status'] == 'tainted':
+            tainted += 1
+
+    print('scanned %d scenes, %d unique files : %d tainted scenes, %d unresolved references' %
+          (len(report['scenes']), len(report['files']), tainted, len(report['unresolved'])))
+    return referencesStatus(report, tainted)
+
+
+def referencesStatus(report, tainted):
+    if tainted:
+        return kIssuesFound
+    # a reference not found is a file not scanned
+    if report['unresolved'] or any([result['status'] == 'error' for result in report['files'].values()]):
+        return kScanErrors
+    return kNoIssues
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline scanner for Maya binary (.mb) scene files.
+#
+# A Maya binary file is an IFF file (FOR4 for 32 bits files, FOR8 for
+# 64 bits files). The file is memory mapped and only the chunk headers
+# are read while walking the file. The script node groups are located
+# from their type, and their string attributes are tested in place,
+# without copying them out of the mapped file.
+#
+########################################################################
+
+import mmap
+import struct
+
+from MayaScannerDetect import matchScriptNode
+
+# IFF layout of the Maya binary flavours : chunk header, alignment, group tags
+_format32 = (struct.Struct('>4sI'), 4, (b'FOR4', b'LIS4', b'CAT4', b'PRO4'))
+_format64 = (struct.Struct('>4s4xQ'), 8, (b'FOR8', b'LIS8', b'CAT8', b'PRO8'))
+
+kMayaFormType = b'Maya'
+kScriptNodeType = b'SCRP'
+kCreateTag = b'CREA'
+kStringTag = b'STR '
+
+# string attributes of the script node we want to assess
+kScriptNodeAttrs = {
+    b'b'      : 'b',
+    b'before' : 'b',
+    b'a'      : 'a',
+    b'after'  : 'a',
+    }
+
+
+class MappedString(object):
+    '''
+    A string attribute value left in the mapped file. Substring tests are
+    run in place so large payloads are never copied.
+    '''
+
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def __contains__(self, value):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        return self.buffer.find(value, self.start, self.end) >= 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __bool__(self):
+        return self.end > self.start
+    __nonzero__ = __bool__
+
+    def view(self):
+        return memoryview(self.buffer)[self.start:self.end]
+
+    def decode(self):
+        return self.buffer[self.start:self.end].strip(b'\0').decode('utf-8', 'replace')
+
+
+def _align(offset, alignment):
+    return (offset + alignment - 1) & ~(alignment - 1)
+
+
+def binaryFormat(buffer):
+    '''
+    return the IFF layout of a Maya binary buffer, or None if the buffer is
+    not a Maya binary file
+    '''
+    for layout in [_format32, _format64]:
+        header, alignment, groupTags = layout
+        if len(buffer) >= header.size + 4 and buffer[0:4] == groupTags[0]:
+            if buffer[header.size:header.size+4] == kMayaFormType:
+                return layout
+    return None
+
+
+def iterChunks(buffer, layout):
+    '''
+    walk all the chunks of a Maya binary buffer, yield
+    (tag, groupType, dataStart, dataEnd, parentType) tuples.
+    groupType is None for data chunks.
+    '''
+    header, alignment, groupTags = layout
+    end = len(buffer)
+    stack = [(0, end, None)]
+
+    while stack:
+        offset, groupEnd, parentType = stack.pop()
+        while offset + header.size <= groupEnd:
+            tag, size = header.unpack_from(buffer, offset)
+            dataStart = offset + header.size
+            dataEnd = dataStart + size
+            if dataEnd > groupEnd:
+                raise ValueError('corrupted chunk %r at offset %d' % (tag, offset))
+
+            offset = _align(dataEnd, alignment)
+            if tag in groupTags:
+                groupType = bytes(buffer[dataStart:dataStart+4])
+                yield tag, groupType, dataStart, dataEnd, parentType
+                # visit the children before the next siblings
+                stack.append((offset, groupEnd, parentType))
+                stack.append((_align(dataStart + 4, alignment), dataEnd, groupType))
+                break
+            yield tag, None, dataStart, dataEnd, parentType
+
+
+def _cString(buffer, start, end):
+    '''
+    return the null terminated string at start, and the offset after it
+    '''
+    stop = buffer.find(b'\0', start, end)
+    if stop < 0:
+        stop = end
+    return bytes(buffer[start:stop]), stop + 1
+
+
+def iterScriptNodes(buffer):
+    '''
+    yield (nodeName, attributes) for each script node of a Maya binary buffer.
+    attributes holds the string attributes of the node, keyed by their short
+    name ('b', 'a'), as MappedString values.
+    '''
+    layout = binaryFormat(buffer)
+    if layout is None:
+        raise ValueError('not a Maya binary file')
+
+    nodeName = None
+    attributes = {}
+    for tag, groupType, start, end, parentType in iterChunks(buffer, layout):
+        if groupType is not None:
+            if nodeName is not None:
+                yield nodeName, attributes
+                nodeName = None
+            continue
+
+        if parentType != kScriptNodeType:
+            continue
+
+        if tag == kCreateTag:
+            # one byte of flags, then the node name and its parent name
+            name, offset = _cString(buffer, start + 1, end)
+            if nodeName is not None:
+                yield nodeName, attributes
+            nodeName = name.decode('utf-8', 'replace')
+            attributes = {}
+        elif tag == kStringTag and nodeName is not None:
+            attribute, offset = _cString(buffer, start, end)
+            attribute = attribute.lstrip(b'.')
+            if attribute in kScriptNodeAttrs:
+                attributes[kScriptNodeAttrs[attribute]] = MappedString(buffer, offset, end)
+
+    if nodeName is not None:
+        yield nodeName, attributes
+
+
+def scanBinaryScene(fileName, digest=None):
+    '''
+    scan a Maya binary scene file without loading it in Maya.
+    Returns the list of issues found, each issue being a dictionary
+    holding the 'node' name, the 'malware' name and the 'rule' id.
+    The file content is fed to the digest hash object when given.
+    '''
+    issues = []
+    with open(fileName, 'rb') as stream:
+        try:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            raise ValueError('not a Maya binary file')
+        try:
+            for nodeName, attributes in iterScriptNodes(buffer):
+                rule = matchScriptNode(nodeName, attributes.get('b'))
+                if rule:
+                    issues.append({'node': nodeName, 'malware': rule['malware'], 'rule': rule['id']})
+            if digest is not None:
+                digest.update(buffer)
+        finally:
+            buffer.close()
+    return issues
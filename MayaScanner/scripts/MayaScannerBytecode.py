@@ -0,0 +1,185 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline scanner for python bytecode (.pyc) files, without running them.
+#
+# A compiled payload keeps working when its source is removed or
+# renamed. The code object of a .pyc is unmarshalled, never executed,
+# and the 'pyc' rules are matched against its constants, names and
+# nested code objects. Bytecode of another python version can't be
+# unmarshalled, its raw content is scanned instead, as is the content
+# of the files larger than kMaxUnmarshalSize, by chunks.
+#
+# Verdicts are cached in the process by the .pyc header (magic, flags
+# and source mtime/size or source hash) and file size, so the copies of
+# a same compiled module are only scanned once.
+#
+# To scan directory trees:
+#
+#    python MayaScannerBytecode.py <path> [<path> ...]
+#
+# exit codes: 0 no issues found, 19 issues found
+#
+########################################################################
+
+import sys
+import os
+import types
+import marshal
+import argparse
+import importlib.util
+
+from MayaScannerDetect import ruleSet, matchRules, scanFile
+
+# python 3.7+ header : magic, flags, then source mtime and size, or source hash
+kHeaderSize = 16
+
+# larger files are not unmarshalled, their raw content is scanned by chunks
+kMaxUnmarshalSize = 16 << 20
+
+kSeverity = ['clean', 'suspect', 'compromised', 'infected']
+kIssuesFound = 19
+
+# verdicts by (header, size, rules digest) : (status, rule ids)
+_verdicts = {}
+
+
+def codeStrings(code):
+    '''
+    return the names and string constants of a code object and of its nested
+    code objects, as bytes separated by new lines
+    '''
+    strings = []
+    stack = [code]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, types.CodeType):
+            strings.append(item.co_name)
+            strings.extend(item.co_names)
+            strings.extend(item.co_varnames)
+            strings.extend(item.co_freevars)
+            strings.extend(item.co_cellvars)
+            stack.extend(item.co_consts)
+        elif isinstance(item, str):
+            strings.append(item)
+        elif isinstance(item, bytes):
+            strings.append(item.decode('utf-8', 'replace'))
+        elif isinstance(item, (tuple, frozenset)):
+            stack.extend(item)
+    return '\n'.join(strings).encode('utf-8', 'replace')
+
+
+def bytecodeData(data):
+    '''
+    return the data to match the rules against : the strings of the code object when
+    the bytecode is of this python version, the raw file content otherwise
+    '''
+    if data[:4] == importlib.util.MAGIC_NUMBER and len(data) > kHeaderSize:
+        try:
+            code = marshal.loads(data[kHeaderSize:])
+        except (ValueError, EOFError, TypeError):
+            return data
+        if isinstance(code, types.CodeType):
+            return codeStrings(code)
+    return data
+
+
+def moduleName(fileName):
+    '''
+    return the module name of a .pyc file (__pycache__/vaccine.cpython-37.pyc : vaccine)
+    '''
+    return os.path.basename(fileName).split('.')[0]
+
+
+def scanBytecodeFile(fileName):
+    '''
+    scan a .pyc file. Returns a result dictionary holding the file 'path', its 'status'
+    ('clean', 'suspect', 'compromised', 'infected' or 'error'), the ids of the
+    'rules' matched and the 'error' message.
+    '''
+    result = {'path': fileName, 'status': 'clean', 'rules': []}
+    name = moduleName(fileName)
+    try:
+        with open(fileName, 'rb') as f:
+            header = f.read(kHeaderSize)
+            size = os.fstat(f.fileno()).st_size
+            key = (header, size, name, ruleSet().targetDigests['pyc'])
+            if key not in _verdicts:
+                if size <= kMaxUnmarshalSize:
+                    data = bytecodeData(header + f.read())
+                else:
+                    # no compiled module is that large, match its raw content by chunks
+                    data = scanFile('pyc', fileName)
+                status = 'clean'
+                rules = []
+                for rule in matchRules('pyc', data, name):
+                    rules.append(rule['id'])
+                    if kSeverity.index(rule['verdict']) > kSeverity.index(status):
+                        status = rule['verdict']
+                _verdicts[key] = (status, rules)
+    except (IOError, OSError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    result['status'], rules = _verdicts[key]
+    result['rules'] = list(rules)
+    return result
+
+
+def iterBytecodeFiles(root):
+    '''
+    yield the .pyc files found under root, recursively.
+    Symbolic links to directories are not followed.
+    '''
+    if not os.path.isdir(root):
+        yield root
+        return
+
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.pyc') and entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
+
+
+def scanBytecodeDir(root):
+    '''
+    scan all the .pyc files found under root, yield their results
+    '''
+    for fileName in iterBytecodeFiles(root):
+        yield scanBytecodeFile(fileName)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan python bytecode files for the known malware, without running them.')
+    parser.add_argument('paths', nargs='+', help='.pyc files or directories to scan')
+    args = parser.parse_args(argv)
+
+    scanned = issues = errors = 0
+    for path in args.paths:
+        for result in scanBytecodeDir(path):
+            scanned += 1
+            if result['status'] == 'error':
+                errors += 1
+                print('%s : unable to scan : %s' % (result['path'], result['error']))
+            elif result['status'] != 'clean':
+                issues += 1
+                print('%s : %s (%s)' % (result['path'], result['status'], ', '.join(result['rules'])))
+
+    print('scanned %d files : %d issues, %d errors' % (scanned, issues, errors))
+    return kIssuesFound if issues else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
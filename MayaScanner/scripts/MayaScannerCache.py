@@ -0,0 +1,188 @@
+########################################################################
+# DESCRIPTION:
+#
+# Persistent scan cache, so unchanged files are never scanned again.
+#
+# A sqlite index maps (path, size, mtime, inode) to the content hash and
+# the scan result of a file. Each entry is tagged with the digest of the
+# rules of its target (see RuleSet.targetDigests), so updating the
+# rules only invalidates the entries of the targets whose rules changed.
+# Results are also indexed by content hash. The batch scanner hashes the
+# files while it scans them, so it only stores the content results, the
+# farm workers hash the files first and skip the copies already scanned.
+#
+# The cache defaults to MayaScannerCache.db in the user cache directory
+# (see userCacheDir), it can be overridden with the MAYASCANNER_CACHE
+# environment variable. The directory is private to its user, a shared
+# cache would let any user whitelist an infected file.
+#
+########################################################################
+
+import os
+import stat
+import json
+import sqlite3
+import hashlib
+
+kCacheEnvVar = 'MAYASCANNER_CACHE'
+
+# commit the stored results every kCommitInterval entries
+kCommitInterval = 256
+
+
+def userCacheDir():
+    '''
+    return the MayaScanner directory of the user cache directory, created private
+    to the user : %LOCALAPPDATA%\\MayaScanner on Windows, $XDG_CACHE_HOME/MayaScanner
+    or ~/.cache/MayaScanner otherwise. Raises OSError when the directory is not
+    owned by the user or is writable by others.
+    '''
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return privateDir(os.path.join(root, 'MayaScanner'))
+
+
+def privateDir(directory):
+    '''
+    return a directory, created private to the user (mode 0700) when missing.
+    Raises OSError when it is not owned by the user or is writable by others.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    if os.name != 'nt':
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise OSError('unsafe directory %s : not a private directory of the user' % directory)
+    return directory
+
+
+def cacheFile():
+    return os.environ.get(kCacheEnvVar) or os.path.join(userCacheDir(), 'MayaScannerCache.db')
+
+
+def contentDigest():
+    '''
+    return a new hash object for the file contents
+    '''
+    return hashlib.blake2b(digest_size=20)
+
+
+def hashFile(fileName, blockSize=1 << 20):
+    '''
+    return the content hash of a file, read by blocks
+    '''
+    digest = contentDigest()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fileKey(st):
+    '''
+    return the (size, mtime_ns, inode) key of an os.stat result
+    '''
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class ScanCache(object):
+    '''
+    sqlite index of the scan results
+    '''
+
+    def __init__(self, fileName=None):
+        self.fileName = fileName or cacheFile()
+        self._pending = 0
+        self._db = sqlite3.connect(self.fileName, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, '
+                         'hash TEXT, rules TEXT, version TEXT, result TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS contents ('
+                         'hash TEXT, rules TEXT, result TEXT, PRIMARY KEY (hash, rules))')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def lookup(self, path, rules, key=None):
+        '''
+        return the cached result of a file if the file did not change since it was
+        scanned with the same rules, None otherwise. key is the fileKey() of the
+        file when already known.
+        '''
+        if key is None:
+            try:
+                key = fileKey(os.stat(path))
+            except OSError:
+                return None
+        try:
+            row = self._db.execute('SELECT size, mtime_ns, inode, rules, result FROM files WHERE path=?',
+                                   (path,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or tuple(row[:3]) != tuple(key) or row[3] != rules:
+            return None
+        return json.loads(row[4])
+
+    def lookupContent(self, contentHash, rules):
+        '''
+        return the cached result of a file content scanned with the same rules, or None
+        '''
+        try:
+            row = self._db.execute('SELECT result FROM contents WHERE hash=? AND rules=?',
+                                   (contentHash, rules)).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def store(self, path, rules, result, key, contentHash=None, version=''):
+        '''
+        store the result of a file scan. key is the fileKey() of the file taken
+        before the file was scanned.
+        '''
+        data = json.dumps(result)
+        size, mtime_ns, inode = key
+        try:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (path, size, mtime_ns, inode, contentHash, rules, version, data))
+            if contentHash:
+                self._db.execute('INSERT OR REPLACE INTO contents VALUES (?, ?, ?)', (contentHash, rules, data))
+        except sqlite3.Error:
+            return
+
+        self._pending += 1
+        if self._pending >= kCommitInterval:
+            self.commit()
+
+    def forget(self, path):
+        self._db.execute('DELETE FROM files WHERE path=?', (path,))
+
+    def commit(self):
+        try:
+            self._db.commit()
+        except sqlite3.Error:
+            pass
+        self._pending = 0
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+def openCache(fileName=None):
+    '''
+    return a ScanCache, or None if the cache file can't be opened
+    '''
+    try:
+        return ScanCache(fileName)
+    except (sqlite3.Error, OSError):
+        return None
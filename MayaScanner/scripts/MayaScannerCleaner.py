@@ -28,13 +28,19 @@ import os
 import logging
 import logging.handlers
 import tempfile
-import fnmatch
 
 import maya.cmds as cmds
 import maya.mel as mel
 
 from stat import S_IWUSR, S_IREAD
 from MayaScannerUtils import MsgFormat
+from MayaScannerDetect import ruleSet, scanFile, scriptFileRuleIds, test_scriptNodeData, test_scriptJobData, test_userSetupMelData, test_userSetupPyData, test_vaccinePyData
+from MayaScannerUserSetup import cleanUserSetupFile, kUserSetupTargets
+from MayaScannerProbe import probeScene
+from MayaScannerCache import fileKey
+from MayaScannerBytecode import scanBytecodeDir
+from MayaScannerQuarantine import quarantineFile
+from MayaScannerTiming import span
 
 
 # create a log file of found issues
@@ -55,25 +61,41 @@ if not len(log.handlers):
 def rollOverLogFile():
     log.handlers[0].doRollover()
 
+# open an infected scene with its scriptNodes disabled, so the scanner can clean it.
+# The MayaScannerCB check callbacks let this load through (see isScannerLoad)
+def scannerOpenFile(fileName):
+    scannerOpenFile.loading = os.path.normcase(os.path.realpath(fileName))
+    try:
+        cmds.file(fileName, open=True, force=True, executeScriptNodes=False)
+    finally:
+        scannerOpenFile.loading = None
+
+scannerOpenFile.loading = None
+
+# is the file being opened by the scanner itself
+def isScannerLoad(fileName):
+    return scannerOpenFile.loading is not None and scannerOpenFile.loading == os.path.normcase(os.path.realpath(fileName))
+
 # ask user if ok to attempt to fix the issue
 
-def userConfirmFix(dlgTitle, msgString, smode=0):
+def userConfirmFix(dlgTitle, msgString, smode=0, choice='fix'):
 
+    # the user choices, kept until reset : the fixes are confirmed once, the other choices on their own
     if 'state' not in userConfirmFix.__dict__:
-        userConfirmFix.state = 0
+        userConfirmFix.state = {}
     if smode == 1:
-        userConfirmFix.state = 0
+        userConfirmFix.state = {}
         return 0
 
-    if userConfirmFix.state == 0:
+    if not userConfirmFix.state.get(choice):
         # check with user to continue with attempted fix
         answer = cmds.confirmDialog( title=dlgTitle, message=MsgFormat(msgString+'<br>Attempt to fix issue?'),
                button=['Yes','No'], defaultButton='Yes', cancelButton='No', dismissString='No' )
         if cmds.about(batch=True) or answer == 'Yes':
-           userConfirmFix.state = 1
+           userConfirmFix.state[choice] = 1
 
     # return status of user choice 
-    return userConfirmFix.state
+    return userConfirmFix.state.get(choice, 0)
 
 
 def reportIssue(msgString, smode=0):
@@ -92,51 +114,71 @@ def reportIssue(msgString, smode=0):
     log.info(msgString)
 
 
+# script file verdicts, by path : (file key, verdict)
+_scriptFileVerdicts = {}
+
+def testScriptFile(filePath, target, test):
+    '''
+    return test(content) for a script file, or None if the file does not exist.
+    Verdicts are kept for the session, keyed by the file (size, mtime, inode) and
+    the rules of the target, so an unchanged file is only stat'ed, not read again.
+    '''
+    try:
+        key = fileKey(os.stat(filePath)) + (ruleSet().targetDigests[target],)
+    except OSError:
+        return None
+    cached = _scriptFileVerdicts.get(filePath)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # read by chunks, with universal new lines
+    with span(target):
+        verdict = test(scanFile(target, filePath, universalNewlines=True))
+    _scriptFileVerdicts[filePath] = (key, verdict)
+    return verdict
+
+
+def userScriptsDir():
+    '''
+    return the scripts directory of the Maya application directory, where the malware writes its files
+    '''
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.dirname(cmds.about(env=True))), 'scripts'))
+
+
 def test_ConcreteScriptFiles():
     '''
     test if the userSetup.mel has been created, or appended by the malware
     '''
-    prefs = os.path.dirname(os.path.dirname(cmds.about(env=True)))
+    scripts = userScriptsDir()
     usersetups = []
     malType = 0
     status = ''
-    testedFilePath = os.path.normpath(os.path.join(prefs, 'scripts', 'userSetup.mel'))
-    if os.path.exists(testedFilePath):
-        f = open(testedFilePath, "r")
-        data = f.read()
-        f.close()
+    testedFilePath = os.path.join(scripts, 'userSetup.mel')
+    verdict = testScriptFile(testedFilePath, 'userSetup.mel', test_userSetupMelData)
+    if verdict is not None:
+        compromised, infected = verdict
 
-        if 'fuck_All_U' in data:
+        if compromised:
             status = 'compromised'
             reportIssue('userSetup.mel : Compromised by Malware!')
-        if all([len(data) >= 4118,
-                '// Maya Mel UI Configuration File.Maya Mel UI Configuration File..\n// \n//\n//  This script is machine generated.  Edit at your own risk' in data,
-                'string $chengxu' in data]):
+        if infected:
             reportIssue('userSetup.mel : Infected by Malware!')
             status = 'rename'
             usersetups.append(testedFilePath)
             malType = 1
 
-    testedFilePath = os.path.normpath(os.path.join(prefs, 'scripts', 'userSetup.py'))
-    if os.path.exists(testedFilePath):
-        f = open(testedFilePath, "r")
-        data = f.read()
-        f.close()
-
-        if "cmds.evalDeferred(\'leukocyte = vaccine.phage()\')" in data and "cmds.evalDeferred(\'leukocyte.occupation()\')" in data:
-            reportIssue('userSetup.py : Infected by Malware!')
-            status = 'rename'
-            usersetups.append(testedFilePath)
-            malType += 2
+    testedFilePath = os.path.join(scripts, 'userSetup.py')
+    if testScriptFile(testedFilePath, 'userSetup.py', test_userSetupPyData):
+        reportIssue('userSetup.py : Infected by Malware!')
+        status = 'rename'
+        usersetups.append(testedFilePath)
+        malType += 2
 
-    testedFilePath = os.path.normpath(os.path.join(prefs, 'scripts', 'vaccine.py'))
-    if os.path.exists(testedFilePath):
-        f = open(testedFilePath, "r")
-        data = f.read()
-        f.close()
+    testedFilePath = os.path.join(scripts, 'vaccine.py')
+    verdict = testScriptFile(testedFilePath, 'vaccine.py', test_vaccinePyData)
+    if verdict is not None:
         msg = 'vaccine.py found : Unable to assess if it is really infected. Please verify manually.'
         
-        if "petri_dish_path = cmds.internalVar(userAppDir=True) + 'scripts/userSetup.py" in data:
+        if verdict:
             msg = 'vaccine.py found : Infected by Malware!'
 
         # the vaccine.py content may not contain the 'petri_dish_path' pattern. This may occur if the python interpreter
@@ -154,13 +196,39 @@ def test_ConcreteScriptFiles():
 
     return usersetups, status, malType
 
-def find(pattern, path):
-    result = []
-    for root, dirs, files in os.walk(path):
-        for name in files:
-            if fnmatch.fnmatch(name, pattern):
-                result.append(os.path.join(root, name))
-    return result
+def test_compiledScriptFiles(scriptDirs):
+    '''
+    test the compiled python files of the __pycache__ of script directories, whatever their
+    name. Each directory is scanned once. Returns the results of the infected files.
+    '''
+    pycResults = []
+    for pyCache in sorted(set([os.path.join(os.path.normpath(d), '__pycache__') for d in scriptDirs])):
+        if not os.path.isdir(pyCache):
+            continue
+        with span('pyc'):
+            pycResults += [pycResult for pycResult in scanBytecodeDir(pyCache)
+                           if pycResult['status'] not in ['clean', 'error']]
+    for pycResult in pycResults:
+        reportIssue('Pyc vaccine file : %s (%s)' % (pycResult['path'], ', '.join(pycResult['rules'])))
+    return pycResults
+
+def fix_compiledScriptFiles(prefixTitle, smode, scriptDirs):
+    issueFixed = 0
+    pycResults = test_compiledScriptFiles(scriptDirs)
+    # deleting files is confirmed on its own, whatever the answer given to the other fixes
+    if pycResults and userConfirmFix('Autodesk.MayaScanner: %s : ' % prefixTitle,
+                                     'Found corrupted compiled python file(s), they will be deleted :<br>%s' %
+                                     '<br>'.join([pycResult['path'] for pycResult in pycResults]), smode, 'deletePyc'):
+        for pycResult in pycResults:
+            try:
+                if quarantineFile(pycResult['path'], pycResult['rules']) is None:
+                    raise IOError('unable to quarantine %s' % pycResult['path'])
+                os.remove(pycResult['path'])
+                issueFixed += 1
+                reportIssue('Pyc vaccine file : %s has deleted' % pycResult['path'])
+            except (IOError, OSError):
+                reportIssue("Can't quarantine %s file" % pycResult['path'])
+    return len(pycResults), issueFixed
 
 def fix_userSetup(prefixTitle, smode):
     issueFound = 0
@@ -175,45 +243,51 @@ def fix_userSetup(prefixTitle, smode):
                 #
                 os.chmod(usersetup, S_IWUSR | S_IREAD)
                 try:
-                    pyCache = os.path.join(os.path.dirname(usersetup),'__pycache__')
-                    if os.path.exists(pyCache):
-                        findvaccine = find('vaccine*', pyCache)
-                        for vacPath in findvaccine:
-                            os.remove(vacPath)
-                            reportIssue('Pyc vaccine file : %s has deleted' % vacPath)
-                    if os.path.exists(usersetup + '.INFECTED') == True:
-                        os.remove(usersetup + '.INFECTED')
-                        reportIssue('Previous infected file : %s has deleted' % usersetup + '.INFECTED')
-
-                    os.rename(usersetup, usersetup + '.INFECTED')
+                    # remove only the injected code of the userSetup files, keep the user's own code
+                    if os.path.basename(usersetup) in kUserSetupTargets.values():
+                        result = cleanUserSetupFile(usersetup)
+                        if result['status'] == 'cleaned':
+                            issueFixed += 1
+                            reportIssue('Cleaned : %s, original kept in the quarantine store' % usersetup)
+                            continue
+                        reportIssue("Can't clean %s : %s" % (usersetup, result.get('error', result['status'])))
+
+                    entry = quarantineFile(usersetup, scriptFileRuleIds(os.path.basename(usersetup), usersetup))
+                    if entry is None:
+                        raise IOError('unable to quarantine %s' % usersetup)
+                    os.remove(usersetup)
                     issueFixed += 1
-                    reportIssue('Renamed : %s' % usersetup)
+                    reportIssue('Quarantined : %s (entry %d)' % (usersetup, entry['id']))
                 except:
-                    reportIssue("Can't rename %s file" % usersetup)
+                    reportIssue("Can't quarantine %s file" % usersetup)
 
-    return issueFound, issueFixed, malwareType
+    # compiled payloads, next to clean userSetup files too
+    pycFound, pycFixed = fix_compiledScriptFiles(prefixTitle, smode,
+                                                 [userScriptsDir()] + [os.path.dirname(f) for f in usersetups])
+    return issueFound + pycFound, issueFixed + pycFixed, malwareType
 
-def test_scriptNodes():
+def test_scriptNodes(nodes=None, probe=None):
     '''
-    test for the known scriptNode with specific data
+    test for the known scriptNode with specific data.
+    nodes limits the test to the script nodes of a node list (the nodes of a reference),
+    probe is the SceneProbe to test, the scene is probed when not given.
     '''
     malware_scripts = []
-    for script in cmds.ls(type='script'):
-        if 'MayaMelUIConfigurationFile' in script.split('|')[-1].split(':')[-1]:
-            scriptdata = cmds.scriptNode(script, bs=True, q=True)
-            if 'This script is machine generated.  Edit at your own risk' in scriptdata and 'fuck_All_U' in scriptdata:
+    if probe is None:
+        probe = probeScene(nodes, sessionChecks=False)
+    with span('test_scriptNodes', nodes=len(probe.scriptNodes)):
+        for script, scriptdata, referenced in probe.scriptNodes:
+            if test_scriptNodeData(script, scriptdata):
                 malware_scripts.append(script)
-                reportIssue('scriptNode present : %s' % script)
-        if 'vaccine_gene' in script or 'breed_gene' in script:
-            malware_scripts.append(script)
-            reportIssue('scriptNode present : %s' % script)
+    for script in malware_scripts:
+        reportIssue('scriptNode present : %s' % script)
 
     return malware_scripts
 
-def fix_scriptNodes(prefixTitle, smode):
+def fix_scriptNodes(prefixTitle, smode, nodes=None, probe=None):
     issueFound = 0
     issueFixed = 0
-    for script in test_scriptNodes():
+    for script in test_scriptNodes(nodes, probe):
         if userConfirmFix('Autodesk.MayaScanner: %s : ' % prefixTitle, 'Found corrupted scriptNode', smode ):
           cmds.delete(script)
           reportIssue('Removed : scriptNode: %s' % script)
@@ -222,21 +296,23 @@ def fix_scriptNodes(prefixTitle, smode):
 
     return issueFound, issueFixed
 
-def test_scriptJob():
+def test_scriptJob(probe=None):
     '''
-    test for the scriptJob this Malware geenerates
+    test for the scriptJob this Malware geenerates.
+    probe is the SceneProbe to test, the scene is probed when not given.
     '''
     scriptjob_id = []
     try:
-        a = -1
-        if (mel.eval('whatIs "$autoUpdateAttrEd_aoto_int"') != "Unknown"):
-            a = int(mel.eval('$temp=$autoUpdateAttrEd_aoto_int'))
-        for jobStr in cmds.scriptJob(listJobs=True):
-            if jobStr.startswith(str(a)) == True:
-                scriptjob_id.append(a)
-                reportIssue('Malware 1: scriptJob present : %s' % a)
+        if probe is None:
+            probe = probeScene(nodes=[])
+        globalIds = list(probe.jobGlobals.values())
+        for jobStr in probe.scriptJobs:
+            for a in globalIds:
+                if jobStr.startswith(str(a)) == True:
+                    scriptjob_id.append(a)
+                    reportIssue('Malware 1: scriptJob present : %s' % a)
             # find Malware 2
-            if 'leukocyte.antivirus()' in jobStr:
+            if test_scriptJobData(jobStr):
                 foundId = jobStr.split(":")[0]
                 if foundId.isdigit():
                     scriptjob_id.append(int(foundId))
@@ -245,10 +321,11 @@ def test_scriptJob():
         reportIssue('scriptjob not found')
     return scriptjob_id
 
-def fix_scriptJob(prefixTitle, smode):
+def fix_scriptJob(prefixTitle, smode, probe=None):
     issueFound = 0
     issueFixed = 0
-    ids = test_scriptJob()
+    with span('test_scriptJob'):
+        ids = test_scriptJob(probe)
     for foundId in ids:
         if userConfirmFix('Autodesk.MayaScanner: %s : ' % prefixTitle, 'Found corrupted scriptJob', smode):
             cmds.scriptJob(kill=foundId, force=True)
@@ -260,30 +337,43 @@ def fix_scriptJob(prefixTitle, smode):
 
 #
 # script to run, would like to know if running single file or multiple for file logging
-def clean_malware(prefixTitle, dontPrompt=False):
+def clean_malware(prefixTitle, dontPrompt=False, nodes=None, sessionChecks=True, probe=None):
     '''
     remove the damn thing and all nodes created!
+    nodes limits the scriptNode checks to a node list (the nodes of a loaded reference).
+    sessionChecks=False skips the checks of the session (mel globals, scriptJobs and
+    userSetup files), when they are run once for a whole file open.
+    probe is the SceneProbe to check, the scene is probed once when not given.
     '''
 
-    # first kill the mel globals!
-    mel_globals = ['UI_Mel_Configuration_think',
-                   'UI_Mel_Configuration_think_a',
-                   'UI_Mel_Configuration_think_b',
-                   'autoUpdateAttrEd_SelectSystem',
-                   'autoUpdatcAttrEd',
-                   'autoUpdatoAttrEnd']
-    for glb in mel_globals:
-        if mel.eval('whatIs("%s")' % glb) == 'Mel procedure entered interactively.':
-            mel.eval('global proc %s(){error -sl "attempted to run corrupted command: %s";}' % (glb,glb))
-
-    # run the base fixes
-    issuesFound = 0
-    issuesFixed = 0
-
-    sJobFound, sJobFixed     = fix_scriptJob(prefixTitle, int(dontPrompt))
-    sNodeFound, sNodeFixed   = fix_scriptNodes(prefixTitle, int(dontPrompt))
-    sSetupFound, sSetupFixed, malType = fix_userSetup(prefixTitle, int(dontPrompt))
-    
+    with span('clean_malware', phase=prefixTitle):
+        # gather all the in-scene evidence at once
+        if probe is None:
+            with span('probeScene'):
+                probe = probeScene(nodes, sessionChecks)
+
+        # run the base fixes
+        issuesFound = 0
+        issuesFixed = 0
+        sJobFound = sJobFixed = sSetupFound = sSetupFixed = malType = 0
+
+        if sessionChecks:
+            # first kill the mel globals!
+            with span('melGlobals'):
+                for glb, whatIs in probe.procs.items():
+                    if whatIs == 'Mel procedure entered interactively.':
+                        mel.eval('global proc %s(){error -sl "attempted to run corrupted command: %s";}' % (glb,glb))
+
+            with span('fix_scriptJob'):
+                sJobFound, sJobFixed = fix_scriptJob(prefixTitle, int(dontPrompt), probe)
+
+        with span('fix_scriptNodes'):
+            sNodeFound, sNodeFixed   = fix_scriptNodes(prefixTitle, int(dontPrompt), nodes, probe)
+
+        if sessionChecks:
+            with span('fix_userSetup'):
+                sSetupFound, sSetupFixed, malType = fix_userSetup(prefixTitle, int(dontPrompt))
+
     issuesFound = sJobFound + sNodeFound + sSetupFound
     issuesFixed = sJobFixed + sNodeFixed + sSetupFixed
 
@@ -0,0 +1,152 @@
+########################################################################
+# DESCRIPTION:
+#
+# Maya independent detection of the known malware signatures.
+#
+# Shared by the in-scene scanner (MayaScannerCleaner) and the offline
+# scene file scanners, so this module must not import any maya module.
+#
+# The signatures and rules come from the rules file (see MayaScannerRules).
+# All the signatures of a rule set are compiled in a single matcher so a
+# buffer is read only once whatever the number of signatures.
+#
+########################################################################
+
+from MayaScannerRules import loadRules, StreamMatch
+
+# files are matched by chunks of kChunkSize bytes
+kChunkSize = 1 << 20
+
+
+def _buffer(data):
+    if data is None or isinstance(data, bytes):
+        return data
+    if hasattr(data, 'view'):
+        return data.view()
+    return data.encode('utf-8')
+
+
+def ruleSet():
+    '''
+    return the current compiled rule set
+    '''
+    return loadRules()
+
+
+def findSignatures(data):
+    '''
+    return the set of the signature names found in data (str, bytes, MappedString or StreamMatch)
+    '''
+    if isinstance(data, StreamMatch):
+        return set(data.found)
+    if not data:
+        return set()
+    return ruleSet().findSignatures(_buffer(data))
+
+
+def matchRules(target, data=None, name=None):
+    '''
+    return the rules of the target matching the name and/or the data
+    (str, bytes, MappedString or the StreamMatch of the target)
+    '''
+    if isinstance(data, StreamMatch):
+        return data.match(name)
+    return ruleSet().match(target, _buffer(data), name)
+
+
+def scanFile(target, fileName, universalNewlines=False, chunkSize=kChunkSize):
+    '''
+    feed a file to a StreamMatch of the target by chunks, so memory use does not grow
+    with the file size. universalNewlines converts the CRLF new lines to LF.
+    Returns the StreamMatch, to give to matchRules() or the test_*Data() functions.
+    '''
+    scanned = ruleSet().stream(target)
+    with open(fileName, 'rb') as f:
+        carry = b''
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            if universalNewlines:
+                # a \r ending the chunk may start a \r\n
+                chunk = (carry + chunk).replace(b'\r\n', b'\n')
+                carry = b'\r' if chunk.endswith(b'\r') else b''
+                if carry:
+                    chunk = chunk[:-1]
+            scanned.feed(chunk)
+        if carry:
+            scanned.feed(carry)
+    return scanned
+
+
+def shortNodeName(node):
+    '''
+    strip the DAG path and namespaces from a node name
+    '''
+    return node.split('|')[-1].split(':')[-1]
+
+
+def scriptNodeNeedsData(node):
+    '''
+    return True if the script content of the node is needed to assess it.
+    Used to avoid querying (or decoding) the script of every script node.
+    '''
+    return ruleSet().needsData('scriptNode', node)
+
+
+def matchScriptNode(node, scriptData):
+    '''
+    return the first scriptNode rule matching a script node name and its 'before'
+    script, or None if the node is clean
+    '''
+    for rule in matchRules('scriptNode', scriptData, node):
+        return rule
+    return None
+
+
+def test_scriptNodeData(node, scriptData):
+    '''
+    test a script node name and its 'before' script against the known malware.
+    Returns the malware name, or None if the node is clean.
+    '''
+    rule = matchScriptNode(node, scriptData)
+    return rule['malware'] if rule else None
+
+
+def scriptFileRuleIds(target, fileName):
+    '''
+    return the ids of the target rules matching a script file, read by chunks
+    '''
+    return [rule['id'] for rule in matchRules(target, scanFile(target, fileName, universalNewlines=True))]
+
+
+def test_scriptJobData(jobStr):
+    '''
+    test a scriptJob description, returns True if it is a known malware job
+    '''
+    return len(matchRules('scriptJob', jobStr)) > 0
+
+
+def test_userSetupMelData(data):
+    '''
+    test the content of a userSetup.mel.
+    Returns (compromised, infected) booleans.
+    '''
+    verdicts = [rule['verdict'] for rule in matchRules('userSetup.mel', data)]
+    return 'compromised' in verdicts, 'infected' in verdicts
+
+
+def test_userSetupPyData(data):
+    '''
+    test the content of a userSetup.py, returns True if infected
+    '''
+    return 'infected' in [rule['verdict'] for rule in matchRules('userSetup.py', data)]
+
+
+def test_vaccinePyData(data):
+    '''
+    test the content of a vaccine.py, returns True if it is known to be infected.
+    A vaccine.py without the signature may still be a partially written payload.
+    '''
+    return 'infected' in [rule['verdict'] for rule in matchRules('vaccine.py', data)]
+
+
+# compile the rule set once per process, at import
+loadRules()
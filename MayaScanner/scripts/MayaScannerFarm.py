@@ -0,0 +1,532 @@
+########################################################################
+# DESCRIPTION:
+#
+# Distributed offline scan of Maya scene files, on many hosts.
+#
+# A coordinator shards the files to scan into leases of a work queue.
+# Workers, on any number of hosts (idle render farm nodes for instance),
+# pull the leases, scan their files with the offline scanners and push
+# the results back. A lease not completed in time is given to another
+# worker. The queue keeps the results in its scan cache, indexed by path
+# and content hash, so copies of a file already scanned anywhere on the
+# farm are answered without being scanned again.
+#
+# The queue is a sqlite file. On many hosts the coordinator serves it on
+# a socket (--listen), authenticated with the key of the
+# MAYASCANNER_FARM_KEY environment variable: sqlite locking is not reliable
+# on network file systems (NFS, SMB), so the queue file itself is only
+# shared by the coordinator and workers of a single host.
+#
+# A worker renews its lease from a timer thread while it scans the files
+# of the lease, so a long file does not let the lease expire.
+#
+#    python MayaScannerFarm.py coordinate <path> [<path> ...] -q <queue.db> [--listen <host:port>]
+#    python MayaScannerFarm.py work -q <queue.db | host:port> [-j <workers>] [--clean]
+#
+# A coordinator started again with the same queue file resumes it, the paths
+# given are added to the queue when not in it yet. A finished queue only
+# reports its results again, it is not reused for new paths.
+#
+# exit codes: 0 no issues found, 19 issues found, 20 issues found and fixed,
+# 21 some files could not be scanned, 2 the queue could not be used
+#
+########################################################################
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import itertools
+import threading
+
+from multiprocessing.connection import Listener, Client, AuthenticationError, deliver_challenge, answer_challenge
+
+from MayaScannerBatch import scanFiles, iterSceneFiles, iterPaths, storeSceneResult, issueMessage, jsonRecord
+from MayaScannerBatch import kNoIssues, kIssuesFound, kIssuesFixed, kScanErrors
+from MayaScannerCache import ScanCache, openCache, fileKey, hashFile
+from MayaScannerDetect import ruleSet
+
+kFarmKeyEnvVar = 'MAYASCANNER_FARM_KEY'
+
+# files per lease, and seconds a worker holds a lease before it is given to another worker
+kLeaseSize = 64
+kLeaseTime = 600.0
+
+# files from kDedupeSize bytes are hashed before they are scanned, to look their content up
+kDedupeSize = 4 << 20
+
+# seconds between the polls of the queue, and the timeout of a socket request
+kPollInterval = 5.0
+kRequestTimeout = 30.0
+
+# queue methods served on the socket
+kRemoteMethods = ['acquire', 'renew', 'complete', 'known', 'remaining']
+
+
+class SqliteQueue(ScanCache):
+    '''
+    leases of the files to scan and their results, in the scan cache sqlite file
+    '''
+
+    def __init__(self, fileName):
+        ScanCache.__init__(self, fileName)
+        self._db.execute('CREATE TABLE IF NOT EXISTS leases ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, files TEXT, state TEXT, worker TEXT, '
+                         'token TEXT, expires REAL, attempts INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (path TEXT PRIMARY KEY, lease INTEGER, worker TEXT, result TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS queued (path TEXT PRIMARY KEY)')
+        self._db.commit()
+
+    def submit(self, fileNames, leaseSize=kLeaseSize):
+        '''
+        shard the files into leases, returns the number of files submitted. The files
+        already in the queue are skipped.
+        '''
+        count = 0
+        batch = []
+        for fileName in itertools.chain(fileNames, [None]):
+            if fileName is not None:
+                if self._db.execute('INSERT OR IGNORE INTO queued VALUES (?)', (fileName,)).rowcount != 1:
+                    continue
+                batch.append(fileName)
+                count += 1
+            if batch and (fileName is None or len(batch) >= leaseSize):
+                self._db.execute("INSERT INTO leases (files, state, attempts) VALUES (?, 'pending', 0)", (json.dumps(batch),))
+                batch = []
+        self._db.commit()
+        return count
+
+    def acquire(self, worker, leaseTime=kLeaseTime):
+        '''
+        lease the next pending, or expired, lease to a worker. Returns (lease id, files),
+        or None when there is no lease to give now.
+        '''
+        now = time.time()
+        token = uuid.uuid4().hex
+        # a single statement, so two workers never get the same lease
+        self._db.execute("UPDATE leases SET state='leased', worker=?, token=?, expires=?, attempts=attempts+1 "
+                         "WHERE id=(SELECT id FROM leases WHERE state='pending' OR (state='leased' AND expires<?) "
+                         "ORDER BY id LIMIT 1)", (worker, token, now + leaseTime, now))
+        self._db.commit()
+        row = self._db.execute('SELECT id, files FROM leases WHERE token=?', (token,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def renew(self, leaseId, worker, leaseTime=kLeaseTime):
+        '''
+        extend a lease still held by the worker, returns False when it has been given to another worker
+        '''
+        cursor = self._db.execute("UPDATE leases SET expires=? WHERE id=? AND worker=? AND state='leased'",
+                                  (time.time() + leaseTime, leaseId, worker))
+        self._db.commit()
+        return cursor.rowcount == 1
+
+    def complete(self, leaseId, worker, results):
+        '''
+        store the results of a lease, and mark it done. The results of a worker which
+        lost its lease are still kept, a file is scanned the same by every worker.
+        '''
+        for result in results:
+            storeSceneResult(self, result)
+            record = json.loads(jsonRecord(result))
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                             (result['path'], leaseId, worker, json.dumps(record)))
+        self._db.execute("UPDATE leases SET state='done', worker=? WHERE id=?", (worker, leaseId))
+        self.commit()
+
+    def known(self, entries):
+        '''
+        return the results already known of files, by path : entries are the (path, fileKey,
+        content hash or None) of the files, a file is known when it did not change since it
+        was scanned, or when a copy of its content was scanned.
+        '''
+        rules = ruleSet().targetDigests['scriptNode']
+        known = {}
+        for path, key, contentHash in entries:
+            result = None
+            if key is not None:
+                result = self.lookup(path, rules, key)
+            if result is None and contentHash:
+                result = self.lookupContent(contentHash, rules)
+            if result is not None:
+                known[path] = result
+        return known
+
+    def remaining(self):
+        '''
+        return the number of leases not done yet
+        '''
+        return self._db.execute("SELECT COUNT(*) FROM leases WHERE state!='done'").fetchone()[0]
+
+    def progress(self):
+        '''
+        return the number of leases by state
+        '''
+        progress = {'pending': 0, 'leased': 0, 'done': 0}
+        for state, count in self._db.execute('SELECT state, COUNT(*) FROM leases GROUP BY state'):
+            progress[state] = count
+        return progress
+
+    def results(self):
+        '''
+        return the results of the files scanned
+        '''
+        return [json.loads(row[0]) for row in self._db.execute('SELECT result FROM results ORDER BY path')]
+
+    def connect(self):
+        '''
+        return a connection to the queue usable from another thread
+        '''
+        return SqliteQueue(self.fileName)
+
+
+class RemoteQueue(object):
+    '''
+    queue served by a coordinator on a socket, one connection per request
+    '''
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+
+    def _call(self, method, *args):
+        connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send((method, args))
+            status, value = connection.recv()
+        finally:
+            connection.close()
+        if status == 'error':
+            raise RuntimeError('%s : %s' % (method, value))
+        return value
+
+    def acquire(self, worker, leaseTime=kLeaseTime):
+        return self._call('acquire', worker, leaseTime)
+
+    def renew(self, leaseId, worker, leaseTime=kLeaseTime):
+        return self._call('renew', leaseId, worker, leaseTime)
+
+    def complete(self, leaseId, worker, results):
+        return self._call('complete', leaseId, worker, results)
+
+    def known(self, entries):
+        return self._call('known', entries)
+
+    def remaining(self):
+        return self._call('remaining')
+
+    def connect(self):
+        # one connection per request, usable from any thread
+        return self
+
+    def close(self):
+        pass
+
+
+def farmKey():
+    '''
+    return the key authenticating the queue socket
+    '''
+    key = os.environ.get(kFarmKeyEnvVar)
+    if not key:
+        raise ValueError('set the %s environment variable to use the queue socket' % kFarmKeyEnvVar)
+    return key.encode('utf-8')
+
+
+def parseAddress(spec):
+    '''
+    return the (host, port) of a host:port queue spec, None for a queue file
+    '''
+    host, sep, port = spec.rpartition(':')
+    if not sep or not host or not port.isdigit() or os.path.exists(spec):
+        return None
+    return host, int(port)
+
+
+def openQueue(spec):
+    '''
+    return the queue of a spec : host:port for a coordinator serving the queue, a sqlite file otherwise
+    '''
+    address = parseAddress(spec)
+    if address is not None:
+        return RemoteQueue(address, farmKey())
+    return SqliteQueue(spec)
+
+
+def _serveConnection(queue, connection, authkey):
+    # authenticate the peer and answer its request, on the thread of the connection
+    try:
+        deliver_challenge(connection, authkey)
+        answer_challenge(connection, authkey)
+        if not connection.poll(kRequestTimeout):
+            return
+        method, args = connection.recv()
+        queue = queue.connect()
+        try:
+            if method not in kRemoteMethods:
+                raise ValueError('unknown method')
+            reply = ('ok', getattr(queue, method)(*args))
+        except Exception as e:
+            reply = ('error', str(e))
+        finally:
+            queue.close()
+        connection.send(reply)
+    except (OSError, EOFError, AuthenticationError):
+        pass
+    finally:
+        connection.close()
+
+
+def serveQueue(fileName, address, authkey):
+    '''
+    serve the queue file on a socket until the process exits. Each connection is
+    authenticated and served on its own thread, so a stalled peer does not block
+    the other workers.
+    '''
+    queue = SqliteQueue(fileName)
+    listener = Listener(address)
+    while True:
+        try:
+            connection = listener.accept()
+        except (OSError, EOFError):
+            continue
+        thread = threading.Thread(target=_serveConnection, args=(queue, connection, authkey))
+        thread.daemon = True
+        thread.start()
+
+
+class LeaseRenewer(threading.Thread):
+    '''
+    renew a lease every third of the lease time, until stopped. lost is set when
+    the lease has been given to another worker, error to the last renew failure.
+    '''
+
+    def __init__(self, queue, leaseId, worker, leaseTime=kLeaseTime):
+        threading.Thread.__init__(self, name='MayaScannerLease-%d' % leaseId)
+        self.daemon = True
+        self.queue = queue
+        self.leaseId = leaseId
+        self.worker = worker
+        self.leaseTime = leaseTime
+        self.lost = False
+        self.error = None
+        self._done = threading.Event()
+
+    def run(self):
+        queue = None
+        try:
+            while not self._done.wait(self.leaseTime / 3):
+                try:
+                    if queue is None:
+                        queue = self.queue.connect()
+                    if not queue.renew(self.leaseId, self.worker, self.leaseTime):
+                        self.lost = True
+                        return
+                    self.error = None
+                except (OSError, EOFError, RuntimeError, sqlite3.Error) as e:
+                    # retried at the next renewal, the lease may still be held
+                    self.error = e
+        finally:
+            if queue is not None and queue is not self.queue:
+                queue.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def scanLease(queue, leaseId, worker, fileNames, workers=None, cache=None, clean=False, leaseTime=kLeaseTime):
+    '''
+    scan the files of a lease, the files known by the queue are not scanned again.
+    The lease is renewed from a timer thread while its files are scanned. Returns the results.
+    '''
+    renewer = LeaseRenewer(queue, leaseId, worker, leaseTime)
+    renewer.start()
+    try:
+        return _scanLease(queue, fileNames, workers, cache, clean)
+    finally:
+        renewer.stop()
+        if renewer.lost:
+            print('lease %d expired and was given to another worker' % leaseId, file=sys.stderr)
+        elif renewer.error is not None:
+            print('lease %d : unable to renew : %s' % (leaseId, renewer.error), file=sys.stderr)
+
+
+def _scanLease(queue, fileNames, workers, cache, clean):
+    entries = []
+    for fileName in fileNames:
+        key = contentHash = None
+        try:
+            key = fileKey(os.stat(fileName))
+            if key[0] >= kDedupeSize:
+                contentHash = hashFile(fileName)
+        except (IOError, OSError):
+            pass
+        entries.append((fileName, key, contentHash))
+
+    results = []
+    known = queue.known(entries)
+    for fileName, key, contentHash in entries:
+        result = known.get(fileName)
+        # infected files still have to be cleaned
+        if result is not None and not (clean and result['status'] == 'infected'):
+            result = dict(result, path=fileName, cached=True)
+            if key is not None:
+                result['key'] = key
+            if contentHash:
+                result['hash'] = contentHash
+            results.append(result)
+    done = set([result['path'] for result in results])
+
+    results.extend(scanFiles([fileName for fileName in fileNames if fileName not in done], workers, cache, clean))
+    return results
+
+
+def workQueue(queue, workers=None, cache=None, clean=False, leaseTime=kLeaseTime, worker=None):
+    '''
+    pull the leases of the queue and scan their files until all the leases are done,
+    yield the results of each lease completed. A coordinator gone once reached has
+    no lease left: it stops serving the queue when all the leases are done.
+    '''
+    worker = worker or '%s:%d' % (socket.gethostname(), os.getpid())
+    reached = False
+    while True:
+        try:
+            lease = queue.acquire(worker, leaseTime)
+            if lease is None and not queue.remaining():
+                return
+        except (OSError, EOFError):
+            if reached and isinstance(queue, RemoteQueue):
+                return
+            raise
+        reached = True
+        if lease is None:
+            # the leases held by other workers may expire
+            time.sleep(kPollInterval)
+            continue
+        leaseId, fileNames = lease
+        results = scanLease(queue, leaseId, worker, fileNames, workers, cache, clean, leaseTime)
+        queue.complete(leaseId, worker, results)
+        for result in results:
+            yield result
+
+
+def mainCoordinate(args):
+    address = None
+    if args.listen:
+        address = parseAddress(args.listen)
+        if address is None or not os.environ.get(kFarmKeyEnvVar):
+            print('--listen needs a host:port address and the %s environment variable' % kFarmKeyEnvVar, file=sys.stderr)
+            return 2
+
+    queue = SqliteQueue(args.queue)
+    started = queue.remaining() or queue.progress()['done']
+    if started and args.paths and not queue.remaining():
+        # the results of a finished queue would be reported for files possibly changed since
+        print('queue %s is finished, use a new queue file to scan %s' % (args.queue, ' '.join(args.paths)),
+              file=sys.stderr)
+        queue.close()
+        return 2
+    if started:
+        print('resuming queue %s' % args.queue, file=sys.stderr)
+    if args.paths or not started:
+        fileNames = itertools.chain.from_iterable(iterSceneFiles(path) for path in iterPaths(args.paths or ['-']))
+        print('submitted %d files' % queue.submit(fileNames, args.lease_size), file=sys.stderr)
+
+    if address is not None:
+        server = threading.Thread(target=serveQueue, args=(args.queue, address, farmKey()))
+        server.daemon = True
+        server.start()
+
+    while queue.remaining():
+        progress = queue.progress()
+        print('leases : %d pending, %d leased, %d done' % (progress['pending'], progress['leased'], progress['done']),
+              file=sys.stderr)
+        time.sleep(kPollInterval)
+
+    counts = {'clean': 0, 'infected': 0, 'cleaned': 0, 'error': 0}
+    for result in queue.results():
+        counts[result['status']] += 1
+        if args.json:
+            print(jsonRecord(result))
+        elif result['status'] != 'clean':
+            print(issueMessage(result))
+    queue.close()
+
+    summary = sys.stderr if args.json else sys.stdout
+    print('scanned %d files : %d cleaned, %d infected, %d errors' %
+          (sum(counts.values()), counts['cleaned'], counts['infected'], counts['error']), file=summary)
+    if counts['infected']:
+        return kIssuesFound
+    if counts['error']:
+        return kScanErrors
+    return kIssuesFixed if counts['cleaned'] else kNoIssues
+
+
+def mainWork(args):
+    try:
+        queue = openQueue(args.queue)
+    except (ValueError, sqlite3.Error) as e:
+        print('%s : %s' % (args.queue, e), file=sys.stderr)
+        return 2
+    cache = openCache(args.cache)
+    counts = {'clean': 0, 'infected': 0, 'cleaned': 0, 'error': 0}
+    failed = False
+    try:
+        for result in workQueue(queue, args.workers, cache, args.clean):
+            counts[result['status']] += 1
+    except AuthenticationError:
+        print('%s : wrong %s' % (args.queue, kFarmKeyEnvVar), file=sys.stderr)
+        return 2
+    except (OSError, EOFError, RuntimeError, sqlite3.Error) as e:
+        # the queue is unreachable, or failed during a lease : its files are not reported
+        print('%s : %s' % (args.queue, e), file=sys.stderr)
+        failed = True
+    finally:
+        if cache is not None:
+            cache.close()
+        queue.close()
+
+    scanned = sum(counts.values())
+    print('scanned %d files : %d cleaned, %d infected, %d errors' %
+          (scanned, counts['cleaned'], counts['infected'], counts['error']))
+    if failed and not scanned:
+        return 2
+    if counts['infected']:
+        return kIssuesFound
+    if failed or counts['error']:
+        return kScanErrors
+    return kIssuesFixed if counts['cleaned'] else kNoIssues
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan Maya scene files for malicious scripts on many hosts, without Maya.')
+    commands = parser.add_subparsers(dest='command')
+    coordinate = commands.add_parser('coordinate', help='shard the files into leases and collect the results')
+    coordinate.add_argument('paths', nargs='*', help='scene files or directories to scan, - to read them from stdin')
+    coordinate.add_argument('-q', '--queue', required=True, help='queue file')
+    coordinate.add_argument('--listen', default=None, help='serve the queue on host:port')
+    coordinate.add_argument('--lease-size', type=int, default=kLeaseSize, help='number of files per lease')
+    coordinate.add_argument('--json', action='store_true', help='write one JSON record per file to stdout (NDJSON)')
+    work = commands.add_parser('work', help='scan the files of the queue leases')
+    work.add_argument('-q', '--queue', required=True, help='queue file, or host:port of the coordinator')
+    work.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    work.add_argument('--cache', default=None, help='local scan cache file (default: MAYASCANNER_CACHE or the user cache directory)')
+    work.add_argument('--clean', action='store_true', help='remove the infected scriptNodes of the Maya ascii files')
+    args = parser.parse_args(argv)
+
+    if args.command == 'coordinate':
+        return mainCoordinate(args)
+    if args.command == 'work':
+        return mainWork(args)
+    parser.print_usage()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
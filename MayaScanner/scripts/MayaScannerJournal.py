@@ -0,0 +1,111 @@
+########################################################################
+# DESCRIPTION:
+#
+# Checkpoint journal of the bulk scans, so an interrupted scan resumes
+# where it stopped instead of starting over.
+#
+# The journal is a JSON lines file: one record per file scanned (path,
+# status, issues, error), appended as soon as its result is available
+# and synced to disk at least every kSyncInterval seconds. The files of
+# the journal are skipped when the scan is run again, but for the files
+# which could not be scanned, which are retried. A completed scan ends
+# its journal with a 'complete' record, the next run starts over.
+#
+# The default journal lives in the private user cache directory of the
+# scan cache (see MayaScannerCache.userCacheDir), one per scan command
+# (the paths scanned and whether they are cleaned).
+#
+########################################################################
+
+import os
+import json
+import time
+import hashlib
+
+from MayaScannerCache import userCacheDir
+
+# journaled result fields
+kJournalFields = ['path', 'status', 'issues', 'error']
+
+# sync the journal to disk every kSyncInterval seconds
+kSyncInterval = 1.0
+
+
+def journalFile(paths, clean=False):
+    '''
+    return the default journal file of a scan command
+    '''
+    key = '\n'.join([path if path == '-' else os.path.abspath(path) for path in paths] + [str(clean)])
+    return os.path.join(userCacheDir(), 'MayaScannerJournal-%s.jsonl' % hashlib.md5(key.encode('utf-8')).hexdigest()[:12])
+
+
+class ScanJournal(object):
+    '''
+    append only journal of the files scanned
+    '''
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.results = {}   # absolute path : journaled result, of the files already scanned (not in error)
+        self._lastSync = time.time()
+
+        data = b''
+        if os.path.exists(fileName):
+            with open(fileName, 'rb') as f:
+                data = f.read()
+        for line in data.splitlines():
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                # the last record of an interrupted scan may be truncated
+                continue
+            if record.get('complete'):
+                self.results = {}
+            elif record.get('status') == 'error':
+                self.results.pop(record.get('path'), None)
+            elif 'path' in record:
+                self.results[record['path']] = record
+
+        self._file = open(fileName, 'ab' if self.results else 'wb')
+        if self.results and not data.endswith(b'\n'):
+            self._file.write(b'\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def done(self, fileName):
+        return os.path.abspath(fileName) in self.results
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, sort_keys=True).encode('utf-8') + b'\n')
+        self._file.flush()
+
+    def record(self, result):
+        '''
+        journal the result of a file scanned
+        '''
+        record = dict([(k, result[k]) for k in kJournalFields if k in result])
+        record['path'] = os.path.abspath(result['path'])
+        self._write(record)
+        if time.time() - self._lastSync >= kSyncInterval:
+            self.sync()
+
+    def complete(self):
+        '''
+        mark the scan as completed, the next run of the same scan starts over
+        '''
+        self._write({'complete': True, 'time': time.time()})
+        self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._lastSync = time.time()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,146 @@
+########################################################################
+# DESCRIPTION:
+#
+# Multi signature matcher (Aho-Corasick automaton).
+#
+# All the signatures are searched in a single pass over a buffer, so the
+# scan cost does not grow with the number of signatures. The automaton
+# is compiled once, the buffer may be bytes, a memoryview or a mmap.
+#
+# The automaton is keyed by byte values (ints). Indexing bytes, memoryview
+# or mmap gives ints on Python 3 but 1 byte strings on Python 2, where the
+# buffers are read through a bytearray.
+#
+# Short buffers searched in one go are tested with a substring search per
+# signature, faster than the automaton loop below kShortBuffer bytes.
+#
+########################################################################
+
+import re
+
+# indexing bytes gives 1 byte strings (Python 2)
+_indexesAsStr = isinstance(b'x'[0], bytes)
+
+# largest bytes buffer searched with a substring search per signature
+kShortBuffer = 1 << 16
+
+
+class SignatureMatcher(object):
+    '''
+    Find all the occurrences of a set of signatures in a single pass.
+
+    signatures is a dictionary of {name: signature}, signatures are bytes
+    (str signatures are utf-8 encoded).
+    '''
+
+    def __init__(self, signatures):
+        self.signatures = {}
+        for name, signature in signatures.items():
+            if not isinstance(signature, bytes):
+                signature = signature.encode('utf-8')
+            if not signature:
+                raise ValueError('empty signature: %s' % name)
+            self.signatures[name] = signature
+        self._compile()
+
+    def _compile(self):
+        # build the trie of the signatures
+        goto = [{}]
+        outputs = [[]]
+        for name, signature in sorted(self.signatures.items()):
+            state = 0
+            for byte in bytearray(signature):
+                if byte not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][byte] = len(goto) - 1
+                state = goto[state][byte]
+            outputs[state].append((name, len(signature)))
+
+        # breadth first, resolve the failure links into a deterministic automaton:
+        # every state knows its next state for every byte starting a signature path
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = list(goto[0].values())
+        while queue:
+            nextQueue = []
+            for state in queue:
+                transitions = dict(delta[fail[state]])
+                for byte, child in goto[state].items():
+                    fail[child] = delta[fail[state]].get(byte, 0) if state else 0
+                    transitions[byte] = child
+                    nextQueue.append(child)
+                delta[state] = transitions
+            queue = nextQueue
+
+        # states are visited breadth first, so the outputs of the failure states are complete
+        for state in self._breadthFirst(goto):
+            if fail[state]:
+                outputs[state] = outputs[state] + outputs[fail[state]]
+
+        self._delta = delta
+        self._outputs = [tuple(output) for output in outputs]
+
+        # from the root state, jump straight to the next byte starting a signature
+        firstBytes = sorted(goto[0].keys())
+        self._first = re.compile(b'[' + b''.join([re.escape(bytes(bytearray([b]))) for b in firstBytes]) + b']')
+        self.maxLength = max([len(s) for s in self.signatures.values()]) if self.signatures else 0
+
+    @staticmethod
+    def _breadthFirst(goto):
+        queue = list(goto[0].values())
+        while queue:
+            nextQueue = []
+            for state in queue:
+                yield state
+                nextQueue.extend(goto[state].values())
+            queue = nextQueue
+
+    def scan(self, buffer, state=0, offset=0):
+        '''
+        scan a buffer, starting from the automaton state of a previous buffer.
+        Returns (hits, state) where hits is a list of (name, position) tuples,
+        positions being shifted by offset. Feeding the returned state with the
+        next buffer finds the signatures that straddle both buffers.
+        '''
+        hits = []
+        if not self.signatures:
+            return hits, state
+
+        if _indexesAsStr and not isinstance(buffer, bytearray):
+            buffer = bytearray(buffer)
+
+        delta = self._delta
+        outputs = self._outputs
+        first = self._first
+        position = 0
+        size = len(buffer)
+        while position < size:
+            if state == 0:
+                match = first.search(buffer, position)
+                if match is None:
+                    break
+                position = match.start()
+            state = delta[state].get(buffer[position], 0)
+            if outputs[state]:
+                for name, length in outputs[state]:
+                    hits.append((name, offset + position - length + 1))
+            position += 1
+        return hits, state
+
+    def findall(self, buffer):
+        '''
+        return a dictionary of {name: [positions]} of the signatures found in buffer
+        '''
+        found = {}
+        for name, position in self.scan(buffer)[0]:
+            found.setdefault(name, []).append(position)
+        return found
+
+    def search(self, buffer):
+        '''
+        return the set of the signature names found in buffer
+        '''
+        if isinstance(buffer, (bytes, bytearray)) and len(buffer) <= kShortBuffer:
+            return set([name for name, signature in self.signatures.items() if signature in buffer])
+        return set([name for name, position in self.scan(buffer)[0]])
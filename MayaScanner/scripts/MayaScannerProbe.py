@@ -0,0 +1,87 @@
+########################################################################
+# DESCRIPTION:
+#
+# Snapshot of the in-scene evidence checked by MayaScannerCleaner.
+#
+# All the mel globals are probed with a single MEL evaluation, the
+# scriptJobs are listed once and the script nodes are read in one
+# OpenMaya sweep over the kScript nodes. The detectors then run on the
+# snapshot instead of querying Maya for each global, job and node.
+#
+########################################################################
+
+import maya.cmds as cmds
+import maya.mel as mel
+import maya.api.OpenMaya as om
+
+from MayaScannerDetect import ruleSet, scriptNodeNeedsData
+
+
+class SceneProbe(object):
+    '''
+    in-scene evidence : mel procedures and globals, scriptJobs and script nodes
+    '''
+
+    def __init__(self):
+        self.procs = {}             # mel procedure name : whatIs result
+        self.jobGlobals = {}        # scriptJob id global name : value, for the globals defined
+        self.scriptJobs = []        # cmds.scriptJob(listJobs=True)
+        self.scriptNodes = []       # (name, before script or None, referenced)
+
+
+def probeGlobals(probe):
+    '''
+    probe all the mel globals of the rules with a single MEL evaluation
+    '''
+    rules = ruleSet()
+    names = list(rules.melGlobals) + ['$' + glb for glb in rules.scriptJobGlobals]
+    if not names:
+        return
+    results = mel.eval('string $MayaScannerProbe_whatIs[] = {%s}' % ', '.join(['`whatIs "%s"`' % name for name in names]))
+    results = list(results or [])
+    results += [''] * (len(names) - len(results))
+
+    for name, result in zip(names, results):
+        if not name.startswith('$'):
+            probe.procs[name] = result
+        elif result and result != 'Unknown':
+            # only defined by the malware, the value is read when it is there
+            probe.jobGlobals[name[1:]] = int(mel.eval('$temp=%s' % name))
+
+
+def probeScriptNodes(probe, nodes=None):
+    '''
+    read the script nodes in one sweep over the kScript nodes. nodes limits the
+    sweep to the script nodes of a node list (the nodes of a reference)
+    '''
+    names = None
+    if nodes is not None:
+        # cmds.ls would list the whole scene for an empty list
+        names = set(cmds.ls(nodes, type='script') if nodes else [])
+        if not names:
+            return
+
+    it = om.MItDependencyNodes(om.MFn.kScript)
+    fn = om.MFnDependencyNode()
+    while not it.isDone():
+        fn.setObject(it.thisNode())
+        name = fn.name()
+        if names is None or name in names:
+            before = None
+            if scriptNodeNeedsData(name):
+                before = fn.findPlug('before', False).asString()
+            probe.scriptNodes.append((name, before, fn.isFromReferencedFile))
+        it.next()
+
+
+def probeScene(nodes=None, sessionChecks=True):
+    '''
+    return the SceneProbe of the current scene. nodes limits the script nodes probed
+    to a node list, sessionChecks=False skips the mel globals and the scriptJobs.
+    '''
+    probe = SceneProbe()
+    if sessionChecks:
+        probeGlobals(probe)
+        probe.scriptJobs = cmds.scriptJob(listJobs=True) or []
+    probeScriptNodes(probe, nodes)
+    return probe
@@ -0,0 +1,227 @@
+########################################################################
+# DESCRIPTION:
+#
+# Content addressed quarantine store for the infected files.
+#
+# The original of every file cleaned, renamed or removed by the scanner
+# is kept once, whatever the number of copies: blobs are gzip streams
+# named by the hash of their uncompressed content. A sqlite index keeps
+# each quarantined file (original path, time, size, ids of the rules hit),
+# so the store can be listed and any file restored.
+#
+# The store defaults to MayaScannerQuarantine in the home directory, it
+# can be overridden with the MAYASCANNER_QUARANTINE environment variable.
+# It holds copies of the user files : it is created private to the user,
+# and not used when owned by another user or writable by others.
+#
+#    python MayaScannerQuarantine.py list [<path pattern>]
+#    python MayaScannerQuarantine.py restore <id> [-o <file>]
+#    python MayaScannerQuarantine.py add <file> [<file> ...]
+#
+########################################################################
+
+import sys
+import os
+import json
+import gzip
+import time
+import shutil
+import sqlite3
+import fnmatch
+import argparse
+import tempfile
+
+from MayaScannerCache import contentDigest, hashFile, privateDir
+
+kQuarantineEnvVar = 'MAYASCANNER_QUARANTINE'
+
+kBlockSize = 1 << 20
+
+
+def quarantineDir():
+    return os.environ.get(kQuarantineEnvVar) or os.path.join(os.path.expanduser('~'), 'MayaScannerQuarantine')
+
+
+class QuarantineStore(object):
+    '''
+    compressed blobs keyed by content hash, and their sqlite index
+    '''
+
+    def __init__(self, root=None):
+        self.root = privateDir(root or quarantineDir())
+        if os.name != 'nt' and os.stat(self.root).st_mode & 0o077:
+            # a store of a previous version, created readable by others
+            os.chmod(self.root, 0o700)
+        if not os.path.isdir(os.path.join(self.root, 'blobs')):
+            os.makedirs(os.path.join(self.root, 'blobs'), 0o700)
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT, path TEXT, time REAL, '
+                         'size INTEGER, mode INTEGER, signatures TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash)')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def blobFile(self, contentHash):
+        return os.path.join(self.root, 'blobs', contentHash[:2], contentHash + '.gz')
+
+    def add(self, fileName, signatures=()):
+        '''
+        quarantine a copy of a file, the file itself is left untouched.
+        The content is hashed first, and only compressed and stored if the store
+        does not hold it yet. signatures are the ids of the rules the file hit.
+        Returns the index entry.
+        '''
+        st = os.stat(fileName)
+        contentHash = hashFile(fileName, kBlockSize)
+        if not os.path.exists(self.blobFile(contentHash)):
+            contentHash = self._storeBlob(fileName)
+
+        entry = {
+            'hash'       : contentHash,
+            'path'       : os.path.abspath(fileName),
+            'time'       : time.time(),
+            'size'       : st.st_size,
+            'mode'       : st.st_mode & 0o7777,
+            'signatures' : sorted(set(signatures)),
+            }
+        cursor = self._db.execute('INSERT INTO entries (hash, path, time, size, mode, signatures) VALUES (?, ?, ?, ?, ?, ?)',
+                                  (entry['hash'], entry['path'], entry['time'], entry['size'], entry['mode'],
+                                   json.dumps(entry['signatures'])))
+        self._db.commit()
+        entry['id'] = cursor.lastrowid
+        return entry
+
+    def _storeBlob(self, fileName):
+        # hashed again while compressed : the blob is named by the content it holds,
+        # even if the file changed since it was first hashed. Returns its hash.
+        digest = contentDigest()
+        blobs = os.path.join(self.root, 'blobs')
+        temp = tempfile.NamedTemporaryFile(dir=blobs, suffix='.tmp', delete=False)
+        try:
+            with temp:
+                with gzip.GzipFile(fileobj=temp, mode='wb', mtime=0) as compressed:
+                    with open(fileName, 'rb') as f:
+                        for block in iter(lambda: f.read(kBlockSize), b''):
+                            digest.update(block)
+                            compressed.write(block)
+
+            contentHash = digest.hexdigest()
+            blob = self.blobFile(contentHash)
+            if os.path.exists(blob):
+                os.remove(temp.name)
+            else:
+                if not os.path.isdir(os.path.dirname(blob)):
+                    os.makedirs(os.path.dirname(blob), 0o700)
+                os.replace(temp.name, blob)
+        except:
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+            raise
+        return contentHash
+
+    @staticmethod
+    def _entry(row):
+        return {'id': row[0], 'hash': row[1], 'path': row[2], 'time': row[3], 'size': row[4],
+                'mode': row[5], 'signatures': json.loads(row[6])}
+
+    def entries(self, pattern=None):
+        '''
+        return the index entries, oldest first. pattern filters the original paths (fnmatch).
+        '''
+        rows = self._db.execute('SELECT id, hash, path, time, size, mode, signatures FROM entries ORDER BY id').fetchall()
+        return [self._entry(row) for row in rows if pattern is None or fnmatch.fnmatch(row[2], pattern)]
+
+    def entry(self, entryId):
+        row = self._db.execute('SELECT id, hash, path, time, size, mode, signatures FROM entries WHERE id=?',
+                               (entryId,)).fetchone()
+        return self._entry(row) if row else None
+
+    def restore(self, entryId, destination=None):
+        '''
+        restore a quarantined file, to its original path or to destination.
+        The file is decompressed next to the destination, which it then atomically replaces.
+        Returns the restored file path.
+        '''
+        entry = self.entry(entryId)
+        if entry is None:
+            raise KeyError('no quarantine entry %s' % entryId)
+        destination = destination or entry['path']
+        temp = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(destination)),
+                                           prefix='.%s.' % os.path.basename(destination), suffix='.tmp', delete=False)
+        try:
+            with temp:
+                with gzip.open(self.blobFile(entry['hash']), 'rb') as compressed:
+                    shutil.copyfileobj(compressed, temp, kBlockSize)
+            os.chmod(temp.name, entry['mode'])
+            os.replace(temp.name, destination)
+        except:
+            if os.path.exists(temp.name):
+                os.remove(temp.name)
+            raise
+        return destination
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+_stores = {}
+
+def quarantineFile(fileName, signatures=(), root=None):
+    '''
+    quarantine a copy of a file in the store (default: the current store), opened
+    once per process. Returns the index entry, or None if the file could not be
+    quarantined.
+    '''
+    root = os.path.abspath(root or quarantineDir())
+    try:
+        if root not in _stores:
+            _stores[root] = QuarantineStore(root)
+        return _stores[root].add(fileName, signatures)
+    except (IOError, OSError, sqlite3.Error):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List, restore or add the files of the MayaScanner quarantine store.')
+    parser.add_argument('--store', default=None, help='quarantine store directory (default: MAYASCANNER_QUARANTINE or ~/MayaScannerQuarantine)')
+    commands = parser.add_subparsers(dest='command')
+    listCommand = commands.add_parser('list', help='list the quarantined files')
+    listCommand.add_argument('pattern', nargs='?', default=None, help='original path pattern')
+    restoreCommand = commands.add_parser('restore', help='restore a quarantined file')
+    restoreCommand.add_argument('id', type=int, help='quarantine entry id')
+    restoreCommand.add_argument('-o', '--output', default=None, help='restore to this file instead of the original path')
+    addCommand = commands.add_parser('add', help='quarantine a copy of files')
+    addCommand.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    try:
+        store = QuarantineStore(args.store)
+    except (IOError, OSError, sqlite3.Error) as e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+
+    with store:
+        if args.command == 'restore':
+            print(store.restore(args.id, args.output))
+        elif args.command == 'add':
+            for fileName in args.files:
+                entry = store.add(fileName)
+                print('%d %s %s' % (entry['id'], entry['hash'], entry['path']))
+        else:
+            for entry in store.entries(getattr(args, 'pattern', None)):
+                print('%d %s %s %10d %s %s' % (entry['id'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])),
+                                              entry['hash'][:12], entry['size'], entry['path'], ','.join(entry['signatures'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
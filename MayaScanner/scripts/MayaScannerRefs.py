@@ -0,0 +1,296 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline recursive scan of the references of Maya scene files.
+#
+# The 'file -r' statements of the Maya ascii files, and the FREF chunks
+# of the Maya binary files, are read to build the reference graph of
+# the scenes. Every unique file of the graph is scanned once, however
+# many scenes share it, and each top level scene is reported tainted
+# through the reference path leading to an infected file.
+#
+# PrefetchScan runs the same scan in a background thread, so a scene and
+# its references can be scanned while Maya is still reading the scene.
+#
+########################################################################
+
+import os
+import re
+import mmap
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from MayaScannerAscii import MelStatementSplitter, parseStatement, iterLines
+from MayaScannerBinary import binaryFormat, iterChunks, kCreateTag
+from MayaScannerBatch import scanFiles, isSceneFile
+from MayaScannerCache import openCache
+
+kReferenceTag = b'FREF'
+
+_copyNumber = re.compile(r'\{\d+\}$')
+
+
+def asciiReferences(fileName):
+    '''
+    return the paths of the files directly referenced by a Maya ascii file.
+    Only the header of the file is read, up to the first node.
+    '''
+    references = []
+    splitter = MelStatementSplitter()
+    buffered = None
+    with open(fileName, 'rb') as stream:
+        for line in iterLines(stream):
+            started = splitter.feed(line)
+            if started:
+                head = line.lstrip()
+                if head.startswith(b'createNode '):
+                    break
+                if head.startswith(b'file '):
+                    buffered = []
+            if buffered is not None:
+                buffered.append(line)
+                if not splitter.inStatement:
+                    tokens = parseStatement(b''.join(buffered))
+                    buffered = None
+                    # the direct references are the 'file -r' statements, the path is the last string
+                    if (False, '-r') in tokens or (False, '-reference') in tokens:
+                        paths = [value for isString, value in tokens if isString]
+                        if paths:
+                            references.append(paths[-1])
+    return references
+
+
+def binaryReferences(fileName):
+    '''
+    return the paths of the files directly referenced by a Maya binary file
+    '''
+    references = []
+    with open(fileName, 'rb') as stream:
+        try:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError('not a Maya binary file')
+        try:
+            layout = binaryFormat(buffer)
+            if layout is None:
+                raise ValueError('not a Maya binary file')
+            for tag, groupType, start, end, parentType in iterChunks(buffer, layout):
+                if tag == kCreateTag:
+                    # the references are stored before the nodes
+                    break
+                if tag == kReferenceTag:
+                    for value in buffer[start:end].split(b'\0'):
+                        value = value.decode('utf-8', 'replace')
+                        if isSceneFile(_copyNumber.sub('', value)):
+                            references.append(value)
+                            break
+        finally:
+            buffer.close()
+    return references
+
+
+def sceneReferences(fileName):
+    if os.path.splitext(fileName)[1].lower() == '.mb':
+        return binaryReferences(fileName)
+    return asciiReferences(fileName)
+
+
+def projectRoot(fileName):
+    '''
+    return the Maya project directory of a scene (holding a workspace.mel), or None
+    '''
+    directory = os.path.dirname(os.path.abspath(fileName))
+    while True:
+        if os.path.exists(os.path.join(directory, 'workspace.mel')):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def resolveReference(reference, sceneFile, searchPaths=()):
+    '''
+    resolve a reference path as Maya would: environment variables, relative to the
+    scene, to its project and to the search paths. Returns the real path or None.
+    '''
+    path = os.path.expandvars(_copyNumber.sub('', reference))
+    candidates = [path]
+    if not os.path.isabs(path):
+        roots = [os.path.dirname(os.path.abspath(sceneFile)), projectRoot(sceneFile)] + list(searchPaths)
+        candidates = [os.path.join(root, path) for root in roots if root]
+    else:
+        # absolute paths from another machine or platform, try their tail in the search paths
+        candidates += [os.path.join(root, os.path.basename(path)) for root in searchPaths]
+
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.realpath(candidate)
+    return None
+
+
+def buildReferenceGraph(scenes, searchPaths=(), threads=8):
+    '''
+    build the reference graph of the scenes, the references of the files of a
+    same depth are read concurrently. Returns (graph, unresolved) where graph
+    maps each unique real path to the list of the real paths it references, and
+    unresolved lists the (scene, reference) that could not be found.
+    '''
+    graph = {}
+    unresolved = []
+
+    def references(fileName):
+        try:
+            return fileName, sceneReferences(fileName)
+        except (IOError, OSError, ValueError):
+            # unreadable files are reported by the scan
+            return fileName, []
+
+    frontier = []
+    for scene in scenes:
+        scene = os.path.realpath(scene)
+        if scene not in graph:
+            graph[scene] = []
+            frontier.append(scene)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while frontier:
+            nextFrontier = []
+            for fileName, refs in pool.map(references, frontier):
+                for reference in refs:
+                    resolved = resolveReference(reference, fileName, searchPaths)
+                    if resolved is None:
+                        unresolved.append((fileName, reference))
+                        continue
+                    if resolved not in graph[fileName]:
+                        graph[fileName].append(resolved)
+                    if resolved not in graph:
+                        graph[resolved] = []
+                        nextFrontier.append(resolved)
+            frontier = nextFrontier
+
+    return graph, unresolved
+
+
+def taintedPaths(graph, results, scene):
+    '''
+    return, for a scene, the shortest reference path to each infected file it uses
+    (the scene itself included)
+    '''
+    parents = {scene: None}
+    queue = [scene]
+    paths = []
+    while queue:
+        nextQueue = []
+        for fileName in queue:
+            if results.get(fileName, {}).get('status') == 'infected':
+                path = []
+                node = fileName
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                paths.append(path[::-1])
+            for child in graph.get(fileName, []):
+                if child not in parents:
+                    parents[child] = fileName
+                    nextQueue.append(child)
+        queue = nextQueue
+    return paths
+
+
+def scanReferenceGraph(scenes, workers=None, cache=None, searchPaths=()):
+    '''
+    scan the scenes and all the files they reference, recursively. Each unique file
+    is scanned once. Returns a report dictionary holding the scan result of each
+    unique file ('files'), the status, tainted reference paths and unresolved references
+    of each scene ('scenes'), the references that could not be resolved ('unresolved')
+    and the reference 'graph' (see buildReferenceGraph). A scene not tainted is in
+    error when a file it uses could not be scanned or one of its references found.
+    '''
+    graph, unresolved = buildReferenceGraph(scenes, searchPaths)
+
+    results = {}
+    for result in scanFiles(sorted(graph), workers, cache):
+        results[result['path']] = result
+
+    report = {'files': results, 'scenes': {}, 'unresolved': unresolved, 'graph': graph}
+    for scene in scenes:
+        realScene = os.path.realpath(scene)
+        paths = taintedPaths(graph, results, realScene)
+        used = usedFiles(graph, realScene)
+        # the references of the scene, or of the files it references, that could not be found
+        missing = [reference for fileName, reference in unresolved if fileName in used]
+        status = 'tainted' if paths else 'clean'
+        if not paths and (missing or any([results.get(f, {}).get('status') == 'error' for f in used])):
+            status = 'error'
+        report['scenes'][scene] = {'status': status, 'paths': paths, 'unresolved': missing}
+    return report
+
+
+def usedFiles(graph, scene):
+    '''
+    return the set of the files a scene uses, itself included
+    '''
+    used = set([scene])
+    queue = [scene]
+    while queue:
+        for child in graph.get(queue.pop(), []):
+            if child not in used:
+                used.add(child)
+                queue.append(child)
+    return used
+
+
+class PrefetchScan(object):
+    '''
+    scan a scene and the files it references in a background thread.
+    The files are scanned in the thread itself, with its own scan cache connection.
+    '''
+
+    def __init__(self, fileName, searchPaths=()):
+        self.fileName = os.path.realpath(_copyNumber.sub('', fileName))
+        self.searchPaths = list(searchPaths)
+        self.report = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name='MayaScannerPrefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        cache = openCache()
+        try:
+            self.report = scanReferenceGraph([self.fileName], 1, cache, self.searchPaths)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def verdict(self, fileName=None, timeout=None):
+        '''
+        wait for the scan and return the verdict of the scene, or of one of the files
+        it references: 'tainted', 'clean', or None when the scan is inconclusive (failed,
+        timed out, file not in the graph, unresolved references or unreadable files).
+        '''
+        self._thread.join(timeout)
+        if self._thread.is_alive() or self.report is None:
+            return None
+
+        graph = self.report['graph']
+        results = self.report['files']
+        fileName = self.fileName if fileName is None else os.path.realpath(_copyNumber.sub('', fileName))
+        if fileName not in graph:
+            return None
+        if taintedPaths(graph, results, fileName):
+            return 'tainted'
+
+        used = usedFiles(graph, fileName)
+        if any([results.get(f, {}).get('status') != 'clean' for f in used]):
+            return None
+        if any([scene in used for scene, reference in self.report['unresolved']]):
+            return None
+        return 'clean'
@@ -0,0 +1,258 @@
+########################################################################
+# DESCRIPTION:
+#
+# Malware signature rules, loaded from a declarative JSON rules file.
+#
+# A rules file holds named signatures (substrings) and rules. A rule
+# applies to a target ('scriptNode', 'scriptJob', 'userSetup.mel',
+# 'userSetup.py', 'vaccine.py', 'pyc') and matches when all its predicates do:
+#
+#    name / shortName : node (or pyc module) name patterns (fnmatch), any of
+#    all / any        : signature names, all of / any of
+#    regex            : regular expressions, any of
+#    minSize/maxSize  : size of the tested data
+#
+# Large data is matched by chunks with a StreamMatch, in constant memory.
+#
+# 'verdict' (default 'infected') qualifies a match. The userSetup rules
+# have a 'cleanRange' : the start/end lines of the block the offline
+# cleaner removes (MayaScannerUserSetup), and the 'tokens' identifying the
+# statements of the injected code. Infected script nodes are removed
+# whole, by their MEL statements, they need no cleanRange.
+#
+# The rules file defaults to MayaScannerRules.json next to this module,
+# it can be overridden with the MAYASCANNER_RULES environment variable.
+# Rule sets are compiled once per process. Compiling takes about a ms, so
+# compiled rule sets are not cached on disk: nothing executable is ever
+# loaded from a shared directory.
+#
+########################################################################
+
+import os
+import re
+import json
+import fnmatch
+import hashlib
+
+from MayaScannerMatcher import SignatureMatcher
+
+kRulesEnvVar = 'MAYASCANNER_RULES'
+kDefaultRulesFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MayaScannerRules.json')
+
+# regexes are matched over windows overlapping by kRegexOverlap bytes, when the data is fed by chunks
+kRegexOverlap = 64 << 10
+
+kTargets = ['scriptNode', 'scriptJob', 'userSetup.mel', 'userSetup.py', 'vaccine.py', 'pyc']
+kVerdicts = ['infected', 'compromised', 'suspect']
+
+
+def _list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class RuleSet(object):
+    '''
+    A compiled rules file
+    '''
+
+    def __init__(self, data, digest):
+        self.version = data.get('version', 'unknown')
+        self.digest = digest
+        self.melGlobals = _list(data.get('melGlobals'))
+        self.scriptJobGlobals = _list(data.get('scriptJobGlobals'))
+        self.signatures = dict(data.get('signatures', {}))
+        self.matcher = SignatureMatcher(self.signatures)
+        self.rules = {}
+        self.targetDigests = {}
+
+        for target in kTargets:
+            self.rules[target] = []
+
+        for rule in data.get('rules', []):
+            self.rules.setdefault(self._checkRule(rule), []).append(self._compileRule(rule))
+
+        # hash of the rules of each target, with the signatures they use.
+        # A cached verdict is only invalidated when the rules of its target change.
+        for target, rules in self.rules.items():
+            used = sorted(set(sum([rule['all'] + rule['any'] for rule in rules], [])))
+            source = [rule['source'] for rule in rules] + [[name, self.signatures[name]] for name in used]
+            self.targetDigests[target] = _digest(json.dumps(source, sort_keys=True).encode('utf-8'))
+
+    def _checkRule(self, rule):
+        ruleId = rule.get('id', '?')
+        target = rule.get('target')
+        if target not in kTargets:
+            raise ValueError('rule %s : unknown target %r' % (ruleId, target))
+        if rule.get('verdict', 'infected') not in kVerdicts:
+            raise ValueError('rule %s : unknown verdict %r' % (ruleId, rule.get('verdict')))
+        for name in _list(rule.get('all')) + _list(rule.get('any')):
+            if name not in self.signatures:
+                raise ValueError('rule %s : unknown signature %r' % (ruleId, name))
+        return target
+
+    def _compileRule(self, rule):
+        compiled = {
+            'id'         : rule.get('id', ''),
+            'malware'    : rule.get('malware', rule.get('id', '')),
+            'target'     : rule['target'],
+            'verdict'    : rule.get('verdict', 'infected'),
+            'all'        : _list(rule.get('all')),
+            'any'        : _list(rule.get('any')),
+            'minSize'    : rule.get('minSize'),
+            'maxSize'    : rule.get('maxSize'),
+            'cleanRange' : rule.get('cleanRange'),
+            'source'     : rule,
+            }
+        compiled['name'] = [re.compile(fnmatch.translate(p)) for p in _list(rule.get('name'))]
+        compiled['shortName'] = [re.compile(fnmatch.translate(p)) for p in _list(rule.get('shortName'))]
+        compiled['regex'] = [re.compile(p.encode('utf-8'), re.M) for p in _list(rule.get('regex'))]
+        compiled['needsData'] = bool(compiled['all'] or compiled['any'] or compiled['regex'] or
+                                     compiled['minSize'] is not None or compiled['maxSize'] is not None)
+        return compiled
+
+    @staticmethod
+    def _matchName(rule, name):
+        if rule['name'] or rule['shortName']:
+            if name is None:
+                return False
+            shortName = name.split('|')[-1].split(':')[-1]
+            if not any([p.match(name) for p in rule['name']] + [p.match(shortName) for p in rule['shortName']]):
+                return False
+        return True
+
+    def needsData(self, target, name=None):
+        '''
+        return True if the data is needed to test name against the target rules
+        '''
+        return any([rule['needsData'] and self._matchName(rule, name) for rule in self.rules.get(target, [])])
+
+    def findSignatures(self, buffer):
+        '''
+        return the set of the signature names found in buffer
+        '''
+        return self.matcher.search(buffer)
+
+    def stream(self, target):
+        '''
+        return a StreamMatch, to match the target rules over data fed by chunks
+        '''
+        return StreamMatch(self, target)
+
+    def match(self, target, buffer=None, name=None, size=None, scanned=None):
+        '''
+        return the list of the target rules matching a name and/or a data buffer
+        (bytes, memoryview or mmap). The buffer is scanned only once.
+        scanned is the StreamMatch of data fed by chunks, instead of the buffer.
+        '''
+        matched = []
+        found = None
+        if scanned is not None:
+            found = scanned.found
+            size = scanned.size
+        elif size is None and buffer is not None:
+            size = len(buffer)
+
+        for rule in self.rules.get(target, []):
+            if not self._matchName(rule, name):
+                continue
+
+            if rule['needsData']:
+                if buffer is None and scanned is None:
+                    continue
+                if rule['minSize'] is not None and size < rule['minSize']:
+                    continue
+                if rule['maxSize'] is not None and size > rule['maxSize']:
+                    continue
+                if rule['all'] or rule['any']:
+                    if found is None:
+                        found = self.findSignatures(buffer)
+                    if not all([s in found for s in rule['all']]):
+                        continue
+                    if rule['any'] and not any([s in found for s in rule['any']]):
+                        continue
+                if rule['regex']:
+                    if scanned is not None:
+                        if not any([p.pattern in scanned.patterns for p in rule['regex']]):
+                            continue
+                    elif not any([p.search(buffer) for p in rule['regex']]):
+                        continue
+
+            matched.append(rule)
+        return matched
+
+
+class StreamMatch(object):
+    '''
+    Match the rules of a target over data fed by chunks, in constant memory.
+    The signatures are found by the automaton, its state carried over from a
+    chunk to the next, and the regexes over windows overlapping by kRegexOverlap
+    bytes, so the matches straddling two chunks are found.
+    '''
+
+    def __init__(self, ruleSet, target):
+        self.ruleSet = ruleSet
+        self.target = target
+        self.found = set()
+        self.patterns = set()       # regex patterns matched
+        self.size = 0
+        self._state = 0
+        self._tail = b''
+        self._regexes = []
+        for rule in ruleSet.rules.get(target, []):
+            self._regexes += rule['regex']
+
+    def feed(self, data):
+        hits, self._state = self.ruleSet.matcher.scan(data, self._state)
+        self.found.update([name for name, position in hits])
+        self.size += len(data)
+        if self._regexes:
+            window = self._tail + data if self._tail else data
+            for regex in self._regexes:
+                if regex.pattern not in self.patterns and regex.search(window):
+                    self.patterns.add(regex.pattern)
+            self._tail = bytes(window[-kRegexOverlap:])
+
+    def match(self, name=None):
+        '''
+        return the list of the target rules matching a name and the data fed so far
+        '''
+        return self.ruleSet.match(self.target, name=name, scanned=self)
+
+
+def rulesFile():
+    return os.environ.get(kRulesEnvVar) or kDefaultRulesFile
+
+
+def compileRules(fileName):
+    '''
+    compile a rules file to a RuleSet
+    '''
+    with open(fileName, 'rb') as f:
+        source = f.read()
+    return RuleSet(json.loads(source.decode('utf-8')), _digest(source))
+
+
+_ruleSets = {}
+
+def loadRules(fileName=None):
+    '''
+    return the compiled RuleSet of a rules file (default: the current rules file).
+    Rule sets are loaded once per process, call reloadRules() to pick up changes.
+    '''
+    fileName = os.path.abspath(fileName or rulesFile())
+    if fileName not in _ruleSets:
+        _ruleSets[fileName] = compileRules(fileName)
+    return _ruleSets[fileName]
+
+
+def reloadRules():
+    _ruleSets.clear()
+    return loadRules()
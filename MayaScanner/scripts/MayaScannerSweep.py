@@ -0,0 +1,265 @@
+########################################################################
+# DESCRIPTION:
+#
+# Host wide sweep of the Maya startup scripts, without Maya.
+#
+# The malware persists through the userSetup.mel, userSetup.py and
+# vaccine.py files Maya runs at startup. The sweep enumerates every
+# directory these can be loaded from on a host: the Maya application
+# directories of all the users and all the Maya versions, the
+# MAYA_SCRIPT_PATH and PYTHONPATH entries and the scripts directories of
+# the Maya modules. The directories are scanned concurrently by a pool
+# of threads, the work being I/O bound on network file systems.
+#
+# To sweep a host and write its report:
+#
+#    python MayaScannerSweep.py [-o <report.json>] [--home <dir>] [-j <threads>]
+#
+# exit codes: 0 no issues found, 19 issues found, 21 no issues found but
+#             some directories or files could not be read
+#
+########################################################################
+
+import sys
+import os
+import stat
+import errno
+import glob
+import json
+import time
+import socket
+import argparse
+import platform
+
+from concurrent.futures import ThreadPoolExecutor
+
+from MayaScannerDetect import ruleSet, matchRules, scanFile
+
+# startup script file names, and their rule targets
+kStartupFiles = {
+    'userSetup.mel' : 'userSetup.mel',
+    'userSetup.py'  : 'userSetup.py',
+    'vaccine.py'    : 'vaccine.py',
+    }
+
+# verdicts by severity, a file gets its most severe verdict
+kSeverity = ['clean', 'suspect', 'compromised', 'infected']
+
+kIssuesFound = 19
+kScanErrors = 21
+
+
+def homeDirectories():
+    '''
+    return the home directories of all the users of the host
+    '''
+    system = platform.system()
+    if system == 'Windows':
+        patterns = [os.path.join(os.environ.get('SystemDrive', 'C:') + os.sep, 'Users', '*')]
+    elif system == 'Darwin':
+        patterns = ['/Users/*']
+    else:
+        patterns = ['/home/*', '/root']
+    homes = [os.path.expanduser('~')]
+    for pattern in patterns:
+        homes += glob.glob(pattern)
+    return homes
+
+
+def _isDir(path):
+    '''
+    return True if path is a directory, or could not be checked (permission
+    denied): the scan of such a directory reports its error
+    '''
+    try:
+        return stat.S_ISDIR(os.stat(path).st_mode)
+    except OSError as e:
+        return e.errno not in (errno.ENOENT, errno.ENOTDIR)
+
+
+def mayaAppDirs(home):
+    '''
+    return the Maya application directories of a user (see MAYA_APP_DIR)
+    '''
+    system = platform.system()
+    if system == 'Windows':
+        candidates = [os.path.join(home, 'Documents', 'maya'), os.path.join(home, 'My Documents', 'maya')]
+    elif system == 'Darwin':
+        candidates = [os.path.join(home, 'Library', 'Preferences', 'Autodesk', 'maya')]
+    else:
+        candidates = [os.path.join(home, 'maya')]
+    return [candidate for candidate in candidates if _isDir(candidate)]
+
+
+def moduleScriptDirs(modulePaths):
+    '''
+    return the scripts directories of the Maya modules described by the .mod
+    files of the module paths
+    '''
+    directories = []
+    for modulePath in modulePaths:
+        for modFile in glob.glob(os.path.join(modulePath, '*.mod')):
+            try:
+                with open(modFile, 'r') as f:
+                    lines = f.readlines()
+            except (IOError, OSError, UnicodeDecodeError):
+                continue
+            for line in lines:
+                # + [key=value ...] NAME VERSION PATH
+                words = line.split()
+                if len(words) < 4 or words[0] != '+':
+                    continue
+                path = os.path.expandvars(words[-1])
+                if not os.path.isabs(path):
+                    path = os.path.join(os.path.dirname(modFile), path)
+                directories.append(os.path.join(path, 'scripts'))
+    return directories
+
+
+def _pathList(environ, name):
+    return [path for path in environ.get(name, '').split(os.pathsep) if path]
+
+
+def sweepRoots(homes=None, environ=None):
+    '''
+    return the (directory, origin) of all the directories to sweep, each directory once
+    '''
+    if homes is None:
+        homes = homeDirectories()
+    if environ is None:
+        environ = os.environ
+
+    roots = []
+    appDirs = _pathList(environ, 'MAYA_APP_DIR')
+    for home in homes:
+        appDirs += mayaAppDirs(home)
+
+    modulePaths = _pathList(environ, 'MAYA_MODULE_PATH')
+    for appDir in appDirs:
+        roots.append((os.path.join(appDir, 'scripts'), 'prefs'))
+        modulePaths.append(os.path.join(appDir, 'modules'))
+        try:
+            os.listdir(appDir)
+        except OSError:
+            # the versions can not be listed, the scan of the directory reports it
+            roots.append((appDir, 'prefs'))
+            continue
+        # one directory per Maya version, and per language (2022/ja_JP)
+        for versionDir in glob.glob(os.path.join(appDir, '*')) + glob.glob(os.path.join(appDir, '*', '*_*')):
+            if _isDir(os.path.join(versionDir, 'prefs')) or _isDir(os.path.join(versionDir, 'scripts')):
+                roots.append((os.path.join(versionDir, 'scripts'), 'prefs'))
+                roots.append((os.path.join(versionDir, 'prefs', 'scripts'), 'prefs'))
+                modulePaths.append(os.path.join(versionDir, 'modules'))
+
+    roots += [(path, 'MAYA_SCRIPT_PATH') for path in _pathList(environ, 'MAYA_SCRIPT_PATH')]
+    roots += [(path, 'PYTHONPATH') for path in _pathList(environ, 'PYTHONPATH')]
+    roots += [(path, 'module') for path in moduleScriptDirs(modulePaths)]
+
+    unique = []
+    seen = set()
+    for directory, origin in roots:
+        key = os.path.normcase(os.path.realpath(directory))
+        if key not in seen and _isDir(directory):
+            seen.add(key)
+            unique.append((directory, origin))
+    return unique
+
+
+def scanStartupFile(fileName):
+    '''
+    scan a startup script file. Returns a result dictionary holding the file 'path',
+    its 'status' (see kSeverity, or 'error'), the ids of the 'rules' matched and
+    the 'error' message.
+    '''
+    target = kStartupFiles[os.path.basename(fileName)]
+    result = {'path': fileName, 'status': 'clean', 'rules': []}
+    try:
+        scanned = scanFile(target, fileName, universalNewlines=True)
+    except (IOError, OSError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    for rule in matchRules(target, scanned):
+        result['rules'].append(rule['id'])
+        if kSeverity.index(rule['verdict']) > kSeverity.index(result['status']):
+            result['status'] = rule['verdict']
+    return result
+
+
+def scanStartupDir(directory):
+    '''
+    scan the startup script files of a directory, return their results.
+    A directory that can not be read gets an 'error' result.
+    '''
+    results = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            results.append({'path': directory, 'status': 'error', 'rules': [], 'error': str(e)})
+        return results
+    for entry in entries:
+        if entry.name in kStartupFiles:
+            results.append(scanStartupFile(entry.path))
+    return results
+
+
+def sweepHost(roots=None, threads=32):
+    '''
+    sweep the startup scripts of the host, return its report dictionary
+    '''
+    start = time.time()
+    if roots is None:
+        roots = sweepRoots()
+
+    files = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for (directory, origin), results in zip(roots, pool.map(scanStartupDir, [root[0] for root in roots])):
+            for result in results:
+                result['origin'] = origin
+                files.append(result)
+
+    summary = dict([(status, 0) for status in kSeverity + ['error']])
+    for result in files:
+        summary[result['status']] += 1
+
+    return {
+        'host'         : socket.gethostname(),
+        'time'         : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'duration'     : round(time.time() - start, 3),
+        'rulesVersion' : ruleSet().version,
+        'roots'        : [{'path': directory, 'origin': origin} for directory, origin in roots],
+        'files'        : files,
+        'summary'      : summary,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep the Maya startup scripts of the host, without Maya.')
+    parser.add_argument('-o', '--output', default=None, help='report file (default: stdout)')
+    parser.add_argument('--home', action='append', default=None, help='home directory to sweep (default: all the users)')
+    parser.add_argument('-j', '--threads', type=int, default=32, help='number of threads')
+    args = parser.parse_args(argv)
+
+    report = sweepHost(sweepRoots(args.home), max(args.threads, 1))
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+    issues = [result for result in report['files'] if result['status'] not in ['clean', 'error']]
+    for result in issues:
+        sys.stderr.write('%s : %s (%s)\n' % (result['path'], result['status'], ', '.join(result['rules'])))
+    errors = [result for result in report['files'] if result['status'] == 'error']
+    for result in errors:
+        sys.stderr.write('%s : error (%s)\n' % (result['path'], result['error']))
+    if issues:
+        return kIssuesFound
+    return kScanErrors if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
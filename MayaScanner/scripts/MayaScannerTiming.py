@@ -0,0 +1,346 @@
+########################################################################
+# DESCRIPTION:
+#
+# Lightweight timing spans of the scanner phases.
+#
+# A span times a block of code (a clean_malware phase, a detector), and
+# nested spans are named after their parents ('clean_malware/fix_userSetup').
+# Each span record goes to the sinks: an in-memory ring buffer of the last
+# kRingSize spans (see spans() and timingStats(), 'MayaScan -stats'), the
+# scanner log, and a JSON lines file when one is set.
+#
+# Timing is off by default, span() then returns a shared no-op context.
+# It is turned on by the MAYASCANNER_TIMING environment variable, or
+# enableTiming() ('MayaScan -timing on'):
+#
+#    MAYASCANNER_TIMING=1              ring buffer and log
+#    MAYASCANNER_TIMING=<file>         ring buffer, log and JSON lines file
+#    MAYASCANNER_PROFILE=<directory>   also profile the top level spans with
+#                                      cProfile, one .prof file per span
+#
+# LatencyStats keeps always-on latency histograms (the scene callbacks of
+# MayaScannerCB) and counters, and periodically flushes them to a JSON
+# file of the private user cache directory, one per host and process, so
+# a latency SLO can be checked across hosts and sessions.
+#
+########################################################################
+
+import os
+import json
+import time
+import bisect
+import socket
+import logging
+import tempfile
+import threading
+import collections
+
+from MayaScannerCache import userCacheDir
+
+kTimingEnvVar = 'MAYASCANNER_TIMING'
+kProfileEnvVar = 'MAYASCANNER_PROFILE'
+
+# spans kept in memory
+kRingSize = 1024
+
+# upper bounds of the latency histogram buckets, in ms, the last bucket is unbounded
+kLatencyBuckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# latency statistics file, and their flush interval in seconds
+kStatsEnvVar = 'MAYASCANNER_STATS'
+kStatsFlushInterval = 60.0
+
+# latency SLO in ms, the calls above it are counted
+kSloEnvVar = 'MAYASCANNER_SLO'
+
+log = logging.getLogger('Autodesk.MayaScanner.timing')
+
+_ring = collections.deque(maxlen=kRingSize)
+_ringLock = threading.Lock()
+_local = threading.local()
+_settings = {'enabled': False, 'file': None, 'profile': None}
+
+
+class _NoSpan(object):
+    '''
+    the span of the disabled timing, does nothing
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_noSpan = _NoSpan()
+
+
+class _Span(object):
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.path = '/'.join(stack + [self.name])
+        self.profiler = None
+        if not stack and _settings['profile']:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        stack.append(self.name)
+        self.time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        duration = time.perf_counter() - self.start
+        _local.stack.pop()
+        record = {'name': self.path, 'time': self.time, 'duration': duration}
+        if self.attributes:
+            record.update(self.attributes)
+        if excType is not None:
+            record['error'] = excType.__name__
+        if self.profiler is not None:
+            self.profiler.disable()
+            record['profile'] = _dumpProfile(self.profiler, self.name, self.time)
+        _emit(record)
+        return False
+
+
+def _dumpProfile(profiler, name, startTime):
+    directory = _settings['profile']
+    fileName = os.path.join(directory, 'MayaScannerProfile-%s-%s-%d.prof' %
+                            (name.replace(' ', '_'), time.strftime('%Y%m%d-%H%M%S', time.localtime(startTime)), os.getpid()))
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(fileName)
+    except (IOError, OSError):
+        return None
+    return fileName
+
+
+def _emit(record):
+    with _ringLock:
+        _ring.append(record)
+        fileName = _settings['file']
+        if fileName:
+            try:
+                with open(fileName, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+            except (IOError, OSError):
+                pass
+    log.info('timing : %s %.3f ms' % (record['name'], record['duration'] * 1000))
+
+
+def enableTiming(enabled=True, fileName=None, profile=None):
+    '''
+    turn the timing on or off. fileName is the JSON lines file sink, profile the
+    directory of the cProfile stats of the top level spans. They keep their current
+    settings (from the environment at first) when None, and are cleared when ''.
+    '''
+    _settings['enabled'] = bool(enabled)
+    if fileName is not None:
+        _settings['file'] = fileName or None
+    if profile is not None:
+        _settings['profile'] = profile or None
+
+
+def timingEnabled():
+    return _settings['enabled']
+
+
+def span(name, **attributes):
+    '''
+    return the context timing a block of code, a no-op when the timing is off
+    '''
+    if not _settings['enabled']:
+        return _noSpan
+    return _Span(name, attributes)
+
+
+def spans(pattern=None):
+    '''
+    return the spans of the ring buffer, oldest first. pattern filters the span names (substring).
+    '''
+    with _ringLock:
+        records = list(_ring)
+    return [record for record in records if pattern is None or pattern in record['name']]
+
+
+def timingStats(pattern=None):
+    '''
+    return the statistics of the spans of the ring buffer, by span name :
+    count, total, mean, max and last duration in seconds
+    '''
+    stats = {}
+    for record in spans(pattern):
+        duration = record['duration']
+        entry = stats.get(record['name'])
+        if entry is None:
+            entry = stats[record['name']] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        entry['count'] += 1
+        entry['total'] += duration
+        entry['max'] = max(entry['max'], duration)
+        entry['last'] = duration
+    for entry in stats.values():
+        entry['mean'] = entry['total'] / entry['count']
+    return stats
+
+
+def formatStats(stats):
+    '''
+    return the lines of a statistics table
+    '''
+    lines = ['%-48s %6s %10s %10s %10s %10s' % ('span', 'count', 'total ms', 'mean ms', 'max ms', 'last ms')]
+    for name in sorted(stats):
+        entry = stats[name]
+        lines.append('%-48s %6d %10.3f %10.3f %10.3f %10.3f' % (name, entry['count'], entry['total'] * 1000,
+                                                                entry['mean'] * 1000, entry['max'] * 1000, entry['last'] * 1000))
+    return lines
+
+
+def clearTiming():
+    with _ringLock:
+        _ring.clear()
+
+
+def _initFromEnvironment():
+    # the profile directory is kept for a timing turned on later in the session
+    _settings['profile'] = os.environ.get(kProfileEnvVar) or None
+    value = os.environ.get(kTimingEnvVar, '')
+    if value.lower() in ('', '0', 'off', 'false'):
+        return
+    fileName = None if value.lower() in ('1', 'on', 'true') else value
+    enableTiming(True, fileName)
+
+
+class LatencyHistogram(object):
+    '''
+    histogram of latencies, in the kLatencyBuckets buckets
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * (len(kLatencyBuckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.overSlo = 0
+
+    def add(self, seconds, slo=None):
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(kLatencyBuckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        if slo is not None and ms > slo:
+            self.overSlo += 1
+
+    def percentile(self, rank):
+        '''
+        upper bound in ms of the bucket holding the rank percentile, the max for the last bucket
+        '''
+        if not self.count:
+            return None
+        target = rank / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return min(kLatencyBuckets[index], self.max) if index < len(kLatencyBuckets) else self.max
+        return self.max
+
+    def asDict(self):
+        return {'count': self.count, 'totalMs': self.total, 'maxMs': self.max, 'overSlo': self.overSlo,
+                'p50Ms': self.percentile(50), 'p99Ms': self.percentile(99), 'buckets': list(self.buckets)}
+
+
+def statsFile(name):
+    '''
+    return the latency statistics file of a component : MAYASCANNER_STATS, or a file of the
+    user cache directory per host and process, so concurrent sessions do not replace the
+    statistics of each other. None when that directory is not private to the user.
+    '''
+    if os.environ.get(kStatsEnvVar):
+        return os.environ[kStatsEnvVar]
+    try:
+        return os.path.join(userCacheDir(), '%sStats-%s-%d.json' % (name, socket.gethostname(), os.getpid()))
+    except OSError:
+        return None
+
+
+class LatencyStats(object):
+    '''
+    latency histograms by name and counters, flushed to a JSON file at most every kStatsFlushInterval seconds
+    '''
+
+    def __init__(self, fileName=None, slo=None):
+        self.fileName = fileName
+        if slo is None and os.environ.get(kSloEnvVar):
+            try:
+                slo = float(os.environ[kSloEnvVar])
+            except ValueError:
+                log.warning('%s : not a latency in ms : %s, ignored' % (kSloEnvVar, os.environ[kSloEnvVar]))
+        self.slo = slo
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+        self._lastFlush = time.time()
+
+    def record(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.add(seconds, self.slo)
+        if self.fileName and time.time() - self._lastFlush >= kStatsFlushInterval:
+            self.flush()
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def asDict(self):
+        return {'host': socket.gethostname(), 'pid': os.getpid(), 'started': self.started, 'time': time.time(),
+                'sloMs': self.slo, 'bucketsMs': kLatencyBuckets, 'counters': dict(self.counters),
+                'latency': dict([(name, histogram.asDict()) for name, histogram in self.histograms.items()])}
+
+    def flush(self):
+        '''
+        write the statistics to the file, atomically. Returns False if they could not be written.
+        '''
+        self._lastFlush = time.time()
+        if not self.fileName:
+            return False
+        temp = None
+        try:
+            directory = os.path.dirname(os.path.abspath(self.fileName))
+            temp = tempfile.NamedTemporaryFile(mode='w', dir=directory, prefix='.%s.' % os.path.basename(self.fileName),
+                                               suffix='.tmp', delete=False)
+            with temp:
+                json.dump(self.asDict(), temp, indent=1, sort_keys=True)
+            os.replace(temp.name, self.fileName)
+        except (IOError, OSError):
+            if temp is not None and os.path.exists(temp.name):
+                os.remove(temp.name)
+            return False
+        return True
+
+    def formatLines(self):
+        '''
+        return the lines of a latency table, and the counters
+        '''
+        lines = ['%-28s %7s %10s %10s %10s %10s %8s' % ('callback', 'count', 'mean ms', 'p50 ms', 'p99 ms', 'max ms', 'over SLO')]
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            lines.append('%-28s %7d %10.3f %10.3f %10.3f %10.3f %8s' % (
+                name, histogram.count, histogram.total / histogram.count, histogram.percentile(50),
+                histogram.percentile(99), histogram.max, histogram.overSlo if self.slo is not None else '-'))
+        for name in sorted(self.counters):
+            lines.append('%s : %d' % (name, self.counters[name]))
+        return lines
+
+
+_initFromEnvironment()
@@ -0,0 +1,355 @@
+########################################################################
+# DESCRIPTION:
+#
+# Offline cleaner for infected userSetup.mel and userSetup.py files.
+#
+# Only the statements injected by the malware are removed, the rest of
+# the user's startup code is kept as is. The file is split in its top
+# level statements (MEL) or parsed with ast (python), the injected block
+# starts at the rule 'cleanRange' start line and runs to its end line, or
+# over the following statements holding the rule tokens when the end line
+# is missing. The cleaned code is checked before it atomically replaces
+# the original, kept in the quarantine store: python code must still
+# compile, MEL code is not parsed, only its blocks, parentheses, strings
+# and comments must still be balanced.
+#
+# To clean userSetup files from a shell, or a manifest listing them:
+#
+#    python MayaScannerUserSetup.py <file> [<file> ...] [-m <manifest>] [-n]
+#
+# exit codes: 0 no issues found, 19 issues found, 20 issues found and fixed
+#
+########################################################################
+
+import sys
+import os
+import re
+import ast
+import shutil
+import argparse
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from MayaScannerQuarantine import quarantineFile
+from MayaScannerDetect import matchRules
+
+# userSetup rule targets by file extension
+kUserSetupTargets = {
+    '.mel' : 'userSetup.mel',
+    '.py'  : 'userSetup.py',
+    }
+
+_melSpecial = re.compile(r'["{}();]|//|/\*')
+_blanks = re.compile(r'\s*')
+
+
+def _statementStart(text, pos):
+    # skip the blanks and the comments before a statement
+    while True:
+        pos = _blanks.match(text, pos).end()
+        if text.startswith('//', pos):
+            end = text.find('\n', pos)
+            pos = len(text) if end < 0 else end
+        elif text.startswith('/*', pos):
+            end = text.find('*/', pos)
+            pos = len(text) if end < 0 else end + 2
+        else:
+            return pos
+
+
+def melStatements(text):
+    '''
+    return ([(firstLine, lastLine)], closed) : the line ranges of the top level
+    statements of a MEL script, 0 based. Blocks ({...}) end their statement, the
+    ';' inside parentheses (for loops) do not.
+    closed is False when the script ends inside a statement, string or comment.
+    '''
+    statements = []
+    depth = 0
+    parentheses = 0
+    start = _statementStart(text, 0)
+    pos = start
+    while True:
+        m = _melSpecial.search(text, pos)
+        if m is None:
+            break
+        token = m.group()
+        if token == '//':
+            end = text.find('\n', m.end())
+            pos = len(text) if end < 0 else end
+            continue
+        if token == '/*':
+            end = text.find('*/', m.end())
+            if end < 0:
+                return statements, False
+            pos = end + 2
+            continue
+        if token == '"':
+            pos = m.end()
+            while True:
+                end = text.find('"', pos)
+                if end < 0:
+                    return statements, False
+                slashes = len(text[pos:end]) - len(text[pos:end].rstrip('\\'))
+                pos = end + 1
+                if slashes % 2 == 0:
+                    break
+            continue
+
+        pos = m.end()
+        if token in '()':
+            parentheses += 1 if token == '(' else -1
+            if parentheses < 0:
+                return statements, False
+            continue
+        if token == '{':
+            depth += 1
+            continue
+        if token == '}':
+            depth -= 1
+            if depth < 0:
+                return statements, False
+        if depth == 0 and parentheses == 0:
+            statements.append((text.count('\n', 0, start), text.count('\n', 0, pos - 1)))
+            start = pos = _statementStart(text, pos)
+
+    if start < len(text):
+        # unterminated last statement
+        statements.append((text.count('\n', 0, start), text.count('\n', 0, len(text.rstrip()))))
+        return statements, False
+    return statements, depth == 0 and parentheses == 0
+
+
+def pythonStatements(text):
+    '''
+    return the (firstLine, lastLine) line ranges of the top level statements
+    of a python script, 0 based, or None if it does not parse
+    '''
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    lines = text.splitlines()
+    firstLines = [min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])]) - 1
+                  for node in tree.body]
+    statements = []
+    for index, node in enumerate(tree.body):
+        first = firstLines[index]
+        if getattr(node, 'end_lineno', None) is not None:
+            statements.append((first, node.end_lineno - 1))
+            continue
+        # no end line before python 3.8 : the statement runs to the next one,
+        # less the blank and comment lines between them
+        last = firstLines[index + 1] - 1 if index + 1 < len(firstLines) else len(lines) - 1
+        while last > first and (not lines[last].strip() or lines[last].lstrip().startswith('#')):
+            last -= 1
+        statements.append((first, max(first, last)))
+    return statements
+
+
+def checkSyntax(text, target):
+    '''
+    return True if the code of a userSetup target still parses : python code
+    must compile, MEL code is not parsed, only its blocks, parentheses, strings
+    and comments must be balanced
+    '''
+    if target == 'userSetup.py':
+        try:
+            compile(text, target, 'exec', dont_inherit=True)
+        except (SyntaxError, ValueError):
+            return False
+        return True
+    return melStatements(text)[1]
+
+
+def injectedRanges(lines, statements, cleanRange):
+    '''
+    return the (firstLine, lastLine) line ranges of the injected blocks, 0 based.
+    A block starts at the cleanRange start line, or at the first statement holding
+    one of its tokens, and ends at its end line, or after the following statements
+    holding a token. A block always covers whole statements.
+    '''
+    startMarker = cleanRange.get('start')
+    endMarker = cleanRange.get('end')
+    tokens = cleanRange.get('tokens', [])
+
+    def hasToken(first, last):
+        block = ''.join(lines[first:last+1])
+        return any([token in block for token in tokens])
+
+    ranges = []
+    line = 0
+    while line < len(lines):
+        candidates = []
+        if startMarker:
+            candidates += [i for i in range(line, len(lines)) if startMarker in lines[i]][:1]
+        candidates += [first for first, last in statements if first >= line and hasToken(first, last)][:1]
+        if not candidates:
+            break
+        first = min(candidates)
+
+        last = first
+        if endMarker:
+            last = ([i for i in range(first, len(lines)) if endMarker in lines[i]] + [first])[0]
+        for statementFirst, statementLast in statements:
+            if statementLast < first:
+                continue
+            if statementFirst <= last or hasToken(statementFirst, statementLast):
+                last = max(last, statementLast)
+                continue
+            break
+
+        ranges.append((first, last))
+        line = last + 1
+    return ranges
+
+
+def _readText(fileName):
+    with open(fileName, 'rb') as f:
+        data = f.read()
+    # keep any byte as is, the file is written back with the same encoding
+    return data, data.decode('utf-8', 'surrogateescape')
+
+
+def _writeFile(fileName, text, signatures):
+    directory = os.path.dirname(os.path.abspath(fileName))
+    temp = tempfile.NamedTemporaryFile(dir=directory, prefix='.%s.' % os.path.basename(fileName),
+                                       suffix='.tmp', delete=False)
+    try:
+        with temp:
+            temp.write(text.encode('utf-8', 'surrogateescape'))
+        shutil.copymode(fileName, temp.name)
+        if quarantineFile(fileName, signatures) is None:
+            raise IOError('unable to quarantine %s' % fileName)
+        os.replace(temp.name, fileName)
+    except:
+        if os.path.exists(temp.name):
+            os.remove(temp.name)
+        raise
+
+
+def cleanUserSetupFile(fileName, dryRun=False):
+    '''
+    remove the injected code of a userSetup.mel or userSetup.py file.
+    Returns a result dictionary holding the file 'path', its 'status' ('clean',
+    'cleaned', 'infected' when it could not be cleaned, or 'error'), the 'issues'
+    found (rule 'id', 'malware' and removed 'lines', 1 based) and an 'error' message.
+    Nothing is written when the file is clean, or when dryRun is set.
+    '''
+    result = {'path': fileName, 'status': 'clean', 'issues': []}
+    target = kUserSetupTargets.get(os.path.splitext(fileName)[1].lower())
+    try:
+        if target is None:
+            raise ValueError('not a userSetup file')
+        data, text = _readText(fileName)
+    except (IOError, OSError, ValueError) as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        return result
+
+    rules = [rule for rule in matchRules(target, data) if rule['verdict'] != 'suspect']
+    if not rules:
+        return result
+    result['status'] = 'infected'
+
+    lines = text.splitlines(True)
+    if target == 'userSetup.py':
+        statements = pythonStatements(text)
+        if statements is None:
+            # already broken, fall back to the lines
+            statements = [(i, i) for i in range(len(lines))]
+    else:
+        statements = melStatements(text)[0]
+
+    removed = set()
+    for rule in rules:
+        ranges = injectedRanges(lines, statements, rule['cleanRange'] or {})
+        for first, last in ranges:
+            removed.update(range(first, last + 1))
+        result['issues'].append({'id': rule['id'], 'malware': rule['malware'],
+                                 'lines': [[first + 1, last + 1] for first, last in ranges]})
+
+    cleaned = ''.join([line for i, line in enumerate(lines) if i not in removed])
+    if not removed or matchRules(target, cleaned.encode('utf-8', 'surrogateescape')) or not checkSyntax(cleaned, target):
+        result['error'] = 'unable to remove the injected code safely'
+        return result
+    if dryRun:
+        return result
+
+    try:
+        _writeFile(fileName, cleaned, [rule['id'] for rule in rules])
+    except (IOError, OSError) as e:
+        result['error'] = str(e)
+        return result
+    result['status'] = 'cleaned'
+    return result
+
+
+def readManifest(fileName):
+    '''
+    return the paths listed in a manifest file, one per line.
+    Blank lines and lines starting with # are skipped.
+    '''
+    with open(fileName, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+def cleanUserSetupFiles(fileNames, dryRun=False, threads=8):
+    '''
+    clean userSetup files concurrently, yield the results in order
+    '''
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for result in pool.map(lambda fileName: cleanUserSetupFile(fileName, dryRun), fileNames):
+            yield result
+
+
+def issueMessage(result):
+    '''
+    format the issues of a userSetup clean result for the logs
+    '''
+    if result['status'] == 'error':
+        return '%s : unable to clean : %s' % (result['path'], result['error'])
+    messages = []
+    for issue in result['issues']:
+        lines = ', '.join(['%d-%d' % tuple(r) for r in issue['lines']]) or 'none'
+        action = 'removed' if result['status'] == 'cleaned' else 'present'
+        messages.append('%s : %s %s : lines %s (%s)' % (result['path'], issue['id'], action, lines, issue['malware']))
+    if result.get('error'):
+        messages.append('%s : not cleaned : %s' % (result['path'], result['error']))
+    return '\n'.join(messages)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Remove the injected malware code from userSetup.mel/userSetup.py files.')
+    parser.add_argument('paths', nargs='*', help='userSetup files to clean')
+    parser.add_argument('-m', '--manifest', action='append', default=[], help='file listing the userSetup files to clean, one per line')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='report the injected code, do not modify the files')
+    parser.add_argument('-j', '--threads', type=int, default=8, help='number of files processed concurrently')
+    args = parser.parse_args(argv)
+
+    fileNames = list(args.paths)
+    for manifest in args.manifest:
+        fileNames.extend(readManifest(manifest))
+
+    scanned = infected = cleaned = errors = 0
+    for result in cleanUserSetupFiles(fileNames, args.dry_run, max(args.threads, 1)):
+        scanned += 1
+        if result['status'] == 'infected':
+            infected += 1
+        elif result['status'] == 'cleaned':
+            cleaned += 1
+        elif result['status'] == 'error':
+            errors += 1
+        if result['status'] != 'clean':
+            print(issueMessage(result))
+            sys.stdout.flush()
+
+    print('processed %d files : %d cleaned, %d infected, %d errors' % (scanned, cleaned, infected, errors))
+    if infected:
+        return 19
+    return 20 if cleaned else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
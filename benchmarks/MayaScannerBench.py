@@ -0,0 +1,308 @@
+########################################################################
+# DESCRIPTION:
+#
+# Benchmarks of the offline scanning engines, on a corpus generated by
+# MayaScannerBenchCorpus.py.
+#
+# Every engine runs in its own process, over the corpus files it handles,
+# and reports files/s, MB/s, the p50/p99 latency per file, its peak RSS,
+# and the infected files it missed or wrongly flagged according to the
+# corpus manifest. The bin/ shell tools are run the same way on a copy of
+# the corpus. The baseline is the grep/sed tools of the original release,
+# kept as they were in the baseline/ directory: the bin/ tools now call
+# the Python cleaner.
+#
+# The results are saved as JSON. Compared with the results of a previous
+# version, the engines slower than the threshold are reported and the
+# exit code is 1.
+#
+#    python MayaScannerBench.py <corpus dir> [-o results.json] [-e <engine> ...] [--compare previous.json]
+#
+########################################################################
+
+import sys
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak RSS is not reported
+    resource = None
+
+kBenchDir = os.path.dirname(os.path.abspath(__file__))
+kScriptsDir = os.path.join(os.path.dirname(kBenchDir), 'MayaScanner', 'scripts')
+kBinDir = os.path.join(os.path.dirname(kBenchDir), 'MayaScanner', 'bin')
+kBaselineDir = os.path.join(kBenchDir, 'baseline')
+sys.path.insert(0, kScriptsDir)
+
+kResultsVersion = 1
+
+# engines, in the order they are run. The shell tools engines are the tools of a directory,
+# bin/ for the current tools, baseline/ for the sed tools of the original release.
+kEngines = ['ascii', 'binary', 'batch', 'startup', 'userSetup',
+            'bin/cleanScriptNode', 'bin/cleanUserSetup', 'bin/scanAndCleanScriptNode',
+            'baseline/cleanScriptNode', 'baseline/cleanUserSetup', 'baseline/scanAndCleanScriptNode']
+kToolDirs = {'bin': kBinDir, 'baseline': kBaselineDir}
+
+
+def _sceneFiles(manifest, extension):
+    return [entry for entry in manifest['scenes'] if entry['path'].endswith(extension)]
+
+
+def _userSetupFiles(manifest):
+    return [entry for entry in manifest['startup'] if os.path.basename(entry['path']).startswith('userSetup.')]
+
+
+def engineFiles(engine, manifest):
+    '''
+    return the manifest entries of the files an engine scans
+    '''
+    tool = engine.split('/')[-1]
+    if tool in ('ascii', 'cleanScriptNode') or engine == 'baseline/scanAndCleanScriptNode':
+        # the original scanAndCleanScriptNode only finds the Maya ascii files
+        return _sceneFiles(manifest, '.ma')
+    if engine == 'binary':
+        return _sceneFiles(manifest, '.mb')
+    if tool in ('batch', 'scanAndCleanScriptNode'):
+        return manifest['scenes']
+    if engine == 'startup':
+        return manifest['startup']
+    return _userSetupFiles(manifest)
+
+
+def isToolEngine(engine):
+    return engine.split('/')[0] in kToolDirs
+
+
+def _runTool(engine, *args):
+    directory, tool = engine.split('/')
+    env = dict(os.environ)
+    env.setdefault('MAYASCANNER_PYTHON', sys.executable)
+    process = subprocess.run(['bash', os.path.join(kToolDirs[directory], tool)] + list(args), env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process.returncode
+
+
+def _runBaselineTool(engine, fileName):
+    # the sed tools always exit with 0, sed -i.bak only runs, and keeps a backup, on the files they flag
+    _runTool(engine, fileName)
+    return os.path.exists(fileName + '.bak')
+
+
+def fileScanner(engine):
+    '''
+    return the function scanning a file with an engine, it returns whether the file is infected
+    '''
+    if engine == 'ascii':
+        from MayaScannerAscii import scanAsciiScene
+        return lambda fileName: bool(scanAsciiScene(fileName))
+    if engine == 'binary':
+        from MayaScannerBinary import scanBinaryScene
+        return lambda fileName: bool(scanBinaryScene(fileName))
+    if engine == 'startup':
+        from MayaScannerSweep import scanStartupFile
+        return lambda fileName: scanStartupFile(fileName)['status'] in ('compromised', 'infected')
+    if engine == 'userSetup':
+        from MayaScannerUserSetup import cleanUserSetupFile
+        return lambda fileName: cleanUserSetupFile(fileName, dryRun=True)['status'] != 'clean'
+    if engine in ('bin/cleanScriptNode', 'bin/cleanUserSetup'):
+        return lambda fileName: _runTool(engine, fileName) != 0
+    if engine in ('baseline/cleanScriptNode', 'baseline/cleanUserSetup'):
+        return lambda fileName: _runBaselineTool(engine, fileName)
+    return None
+
+
+def percentile(values, rank):
+    '''
+    nearest rank percentile of the values, None when there are none
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(rank / 100.0 * len(values))) - 1))]
+
+
+def peakRss():
+    '''
+    peak resident set size in bytes of this process, and of its largest child process
+    '''
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def runEngine(engine, manifest, workers=None):
+    '''
+    run an engine over its corpus files in the current process, return its statistics
+    '''
+    entries = engineFiles(engine, manifest)
+    copies = None
+    if isToolEngine(engine):
+        # the tools clean the files they scan, they work on a copy of the corpus
+        copies = tempfile.mkdtemp(prefix='MayaScannerBench-')
+        os.environ['MAYASCANNER_QUARANTINE'] = os.path.join(copies, 'quarantine')
+        os.environ['MAYASCANNER_CACHE'] = os.path.join(copies, 'cache.db')
+        root = os.path.commonpath([entry['path'] for entry in entries]) if entries else copies
+        if os.path.isfile(root):
+            root = os.path.dirname(root)
+        entries = [dict(entry, path=os.path.join(copies, 'corpus', os.path.relpath(entry['path'], root)))
+                   for entry in entries]
+        shutil.copytree(root, os.path.join(copies, 'corpus'))
+
+    latencies = []
+    infected = {}
+    try:
+        start = time.perf_counter()
+        scanner = fileScanner(engine)
+        if scanner is not None:
+            for entry in entries:
+                fileStart = time.perf_counter()
+                infected[entry['path']] = scanner(entry['path'])
+                latencies.append(time.perf_counter() - fileStart)
+        elif engine == 'batch':
+            from MayaScannerBatch import scanFiles
+            for result in scanFiles([entry['path'] for entry in entries], workers):
+                infected[result['path']] = result['status'] == 'infected'
+        elif engine == 'bin/scanAndCleanScriptNode':
+            # a single run over the scene tree, the files are not reported one by one
+            _runTool(engine, os.path.join(copies, 'corpus'), '-j', str(workers or os.cpu_count() or 1))
+        else:
+            # the original tool runs cleanScriptNode on each file found, one at a time
+            _runTool(engine, os.path.join(copies, 'corpus'))
+        seconds = time.perf_counter() - start
+    finally:
+        if copies is not None:
+            shutil.rmtree(copies, ignore_errors=True)
+
+    size = sum([entry['size'] for entry in entries])
+    rss, childRss = peakRss()
+    stats = {
+        'files'      : len(entries),
+        'bytes'      : size,
+        'seconds'    : seconds,
+        'filesPerSec': len(entries) / seconds if seconds else None,
+        'mbPerSec'   : size / float(1 << 20) / seconds if seconds else None,
+        'p50'        : percentile(latencies, 50),
+        'p99'        : percentile(latencies, 99),
+        # the tools and worker pools run in child processes
+        'peakRss'    : childRss if isToolEngine(engine) else (max(rss, childRss) if rss is not None else None),
+        'missed'     : None,
+        'falsePositives': None,
+        }
+    if infected:
+        stats['missed'] = len([entry for entry in entries if entry['payloads'] and not infected.get(entry['path'])])
+        stats['falsePositives'] = len([entry for entry in entries if not entry['payloads'] and infected.get(entry['path'])])
+    return stats
+
+
+def benchEngine(engine, corpus, workers=None):
+    '''
+    run an engine in its own process, so its peak RSS is its own. Returns its statistics.
+    '''
+    args = [sys.executable, os.path.abspath(__file__), corpus, '--child', engine]
+    if workers:
+        args += ['-j', str(workers)]
+    output = subprocess.check_output(args)
+    return json.loads(output.decode('utf-8'))
+
+
+def compareResults(results, previous, threshold=0.1):
+    '''
+    return the regressions of results from the previous ones : (engine, metric, previous, current)
+    for the throughputs lower and the latencies higher than the threshold ratio
+    '''
+    regressions = []
+    for engine, stats in sorted(results['engines'].items()):
+        old = previous.get('engines', {}).get(engine)
+        if not old:
+            continue
+        for metric in ('filesPerSec', 'mbPerSec'):
+            if old.get(metric) and stats.get(metric) is not None and stats[metric] < old[metric] * (1 - threshold):
+                regressions.append((engine, metric, old[metric], stats[metric]))
+        for metric in ('p50', 'p99'):
+            if old.get(metric) and stats.get(metric) is not None and stats[metric] > old[metric] * (1 + threshold):
+                regressions.append((engine, metric, old[metric], stats[metric]))
+    return regressions
+
+
+def _format(value, format='%.1f', scale=1.0):
+    return '-' if value is None else format % (value * scale)
+
+
+def printResults(results):
+    print('%-32s %6s %9s %8s %9s %9s %9s %6s %4s' % ('engine', 'files', 'files/s', 'MB/s', 'p50 ms', 'p99 ms',
+                                                    'RSS MB', 'missed', 'FP'))
+    for engine in kEngines:
+        stats = results['engines'].get(engine)
+        if stats is None:
+            continue
+        print('%-32s %6d %9s %8s %9s %9s %9s %6s %4s' % (
+            engine, stats['files'], _format(stats['filesPerSec']), _format(stats['mbPerSec']),
+            _format(stats['p50'], '%.2f', 1000), _format(stats['p99'], '%.2f', 1000),
+            _format(stats['peakRss'], '%.1f', 1.0 / (1 << 20)),
+            _format(stats['missed'], '%d'), _format(stats['falsePositives'], '%d')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the MayaScanner engines on a generated corpus.')
+    parser.add_argument('corpus', help='corpus directory (see MayaScannerBenchCorpus.py)')
+    parser.add_argument('-e', '--engine', action='append', choices=kEngines, help='engine to run, repeatable (default: all)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes of the batch engines (default: cpu count)')
+    parser.add_argument('-o', '--output', default=None, help='save the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous version to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='regression threshold ratio (default: 0.1)')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.corpus, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    if args.child:
+        json.dump(runEngine(args.child, manifest, args.workers), sys.stdout)
+        return 0
+
+    from MayaScannerRules import loadRules
+    results = {
+        'version'     : kResultsVersion,
+        'time'        : time.time(),
+        'host'        : platform.node(),
+        'platform'    : platform.platform(),
+        'python'      : platform.python_version(),
+        'cpus'        : os.cpu_count(),
+        'rulesVersion': loadRules().version,
+        'corpus'      : {'path': os.path.abspath(args.corpus), 'seed': manifest['seed'], 'size': manifest['size'],
+                         'nodes': manifest['nodes'], 'rate': manifest['rate'], 'scenes': len(manifest['scenes']),
+                         'startup': len(manifest['startup'])},
+        'engines'     : {},
+        }
+    for engine in args.engine or kEngines:
+        results['engines'][engine] = benchEngine(engine, args.corpus, args.workers)
+    printResults(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compareResults(results, previous, args.threshold)
+        for engine, metric, old, new in regressions:
+            print('Regression : %s %s %.4g -> %.4g' % (engine, metric, old, new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
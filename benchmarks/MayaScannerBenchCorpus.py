@@ -0,0 +1,251 @@
+########################################################################
+# DESCRIPTION:
+#
+# Synthetic corpus of Maya scenes and startup scripts for the benchmarks.
+#
+# Maya ascii and binary (FOR4 and FOR8) scenes are generated with the
+# requested size and node count: transforms and meshes with their vertex
+# data, the usual ui/scene configuration script nodes, and at a controlled
+# rate the script nodes of the known malware (MayaMelUIConfigurationFile,
+# vaccine_gene, breed_gene). Maya application directories are generated
+# the same way, with clean or infected userSetup.mel, userSetup.py and
+# vaccine.py files.
+#
+# The corpus manifest.json lists every file and the payloads planted in
+# it, so the benchmarks also check what the scanners find.
+#
+#    python MayaScannerBenchCorpus.py <output dir> [-n <scenes>] [--size 1M] [--nodes 200] [--rate 0.1]
+#
+########################################################################
+
+import sys
+import os
+import json
+import random
+import struct
+import argparse
+
+# scene payloads : script node name, before script
+kScenePayloads = {
+    'MayaMelUIConfigurationFile' : ('MayaMelUIConfigurationFile',
+                                    '// Maya Mel UI Configuration File.Maya Mel UI Configuration File..\n// \n//\n'
+                                    '//  This script is machine generated.  Edit at your own risk.\n//\n//\n\n'
+                                    'global proc UI_Mel_Configuration_think(){ string $fuck_All_U = "x;"; }\n'
+                                    'UI_Mel_Configuration_think();\n'),
+    'vaccine_gene'               : ('vaccine_gene',
+                                    "import base64; exec(base64.urlsafe_b64decode('aW1wb3J0IG9z'))\n"),
+    'breed_gene'                 : ('breed_gene',
+                                    "petri_dish_path = cmds.internalVar(userAppDir=True) + 'scripts/userSetup.py'\n"
+                                    "leukocyte.antivirus()\n"),
+    }
+
+# startup script payloads, by file name
+kStartupPayloads = {
+    'userSetup.mel' : ('// Maya Mel UI Configuration File.Maya Mel UI Configuration File..\n// \n//\n'
+                       '//  This script is machine generated.  Edit at your own risk\n'
+                       'global proc UI_Mel_Configuration_think()\n{\n'
+                       '    string $chengxu = "fuck_All_U";\n' +
+                       '    print "UI_Mel_Configuration_think autoUpdateAttrEd_SelectSystem";\n' * 64 +
+                       '}\nUI_Mel_Configuration_think();\n'),
+    'userSetup.py'  : ("import vaccine\n"
+                       "cmds.evalDeferred('leukocyte = vaccine.phage()')\n"
+                       "cmds.evalDeferred('leukocyte.occupation()')\n"),
+    'vaccine.py'    : ("import maya.cmds as cmds\n"
+                       "petri_dish_path = cmds.internalVar(userAppDir=True) + 'scripts/userSetup.py'\n"
+                       "class phage:\n    def occupation(self):\n        pass\n"),
+    }
+
+# clean startup code
+kStartupCode = {
+    'userSetup.mel' : '// studio setup\nsource "studioTools.mel";\nputenv "STUDIO_SHOW" "bench";\n',
+    'userSetup.py'  : 'import maya.cmds as cmds\ncmds.evalDeferred("import studioTools; studioTools.setup()")\n',
+    'vaccine.py'    : None,
+    }
+
+kCleanScriptNodes = [
+    ('uiConfigurationScriptNode', '// Maya Mel UI Configuration File.\n// no panels\n'),
+    ('sceneConfigurationScriptNode', 'playbackOptions -min 1 -max 120 -ast 1 -aet 200 '),
+    ]
+
+
+def parseSize(value):
+    '''
+    parse a size : 1024, 64K, 10M, 1G
+    '''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def melString(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def asciiScriptNode(name, script):
+    return ('createNode script -n "%s";\n'
+            '\trename -uid "%s";\n'
+            '\tsetAttr ".b" -type "string" %s;\n'
+            '\tsetAttr ".st" 1;\n' % (name, name.upper()[:8], melString(script)))
+
+
+def asciiMesh(index, vertices, rng):
+    lines = ['createNode transform -n "pCube%d";\n' % index,
+             '\trename -uid "T%06d";\n' % index,
+             'createNode mesh -n "pCubeShape%d" -p "pCube%d";\n' % (index, index),
+             '\tsetAttr -k off ".v";\n',
+             '\tsetAttr -s %d ".vt[0:%d]"' % (vertices, vertices - 1)]
+    for start in range(0, vertices, 4):
+        values = ' '.join(['%.6f' % rng.uniform(-10, 10) for i in range(3 * min(4, vertices - start))])
+        lines.append('\n\t\t %s' % values)
+    lines.append(';\n')
+    return ''.join(lines)
+
+
+def writeAsciiScene(fileName, size, nodes, payloads, rng):
+    header = ('//Maya ASCII 2022 scene\n//Name: %s\n'
+              'requires maya "2022";\ncurrentUnit -l centimeter -a degree -t film;\n'
+              'fileInfo "application" "maya";\nfileInfo "product" "Maya 2022";\n' % os.path.basename(fileName))
+    scriptNodes = [asciiScriptNode(name, script) for name, script in kCleanScriptNodes]
+    scriptNodes += [asciiScriptNode(*kScenePayloads[payload]) for payload in payloads]
+    fixedSize = len(header) + sum([len(node) for node in scriptNodes])
+    # each vertex line holds 4 vertices of ~33 bytes
+    vertices = max(4, (size - fixedSize) // max(nodes, 1) // 33)
+
+    positions = set([rng.randrange(nodes + 1) for node in scriptNodes])
+    with open(fileName, 'w', newline='\n') as f:
+        f.write(header)
+        for index in range(nodes + 1):
+            if index in positions:
+                for node in scriptNodes:
+                    f.write(node)
+                scriptNodes = []
+            if index < nodes:
+                f.write(asciiMesh(index, vertices, rng))
+        for node in scriptNodes:
+            f.write(node)
+        f.write('// End of %s\n' % os.path.basename(fileName))
+
+
+class IffWriter(object):
+    '''
+    chunks of a Maya binary file, FOR4 (32 bits) or FOR8 (64 bits)
+    '''
+
+    def __init__(self, wide=False):
+        self.wide = wide
+        self.alignment = 8 if wide else 4
+        self.form = b'FOR8' if wide else b'FOR4'
+
+    def chunk(self, tag, data):
+        if self.wide:
+            header = struct.pack('>4s4xQ', tag, len(data))
+        else:
+            header = struct.pack('>4sI', tag, len(data))
+        return header + data + b'\0' * (-len(data) % self.alignment)
+
+    def group(self, groupType, children):
+        return self.chunk(self.form, groupType + b'\0' * (self.alignment - 4) + b''.join(children))
+
+    def node(self, nodeType, name, chunks):
+        return self.group(nodeType, [self.chunk(b'CREA', b'\0' + name.encode('utf-8') + b'\0')] + chunks)
+
+    def scriptNode(self, name, script):
+        return self.node(b'SCRP', name, [self.chunk(b'STR ', b'b\0\0' + script.encode('utf-8') + b'\0'),
+                                         self.chunk(b'STR ', b'st\0\0' + b'1\0')])
+
+
+def writeBinaryScene(fileName, size, nodes, payloads, rng, wide=False):
+    iff = IffWriter(wide)
+    scriptNodes = [iff.scriptNode(name, script) for name, script in kCleanScriptNodes]
+    scriptNodes += [iff.scriptNode(*kScenePayloads[payload]) for payload in payloads]
+    vertices = max(4, (size - sum([len(node) for node in scriptNodes])) // max(nodes, 1) // 24)
+
+    children = [iff.group(b'HEAD', [iff.chunk(b'VERS', b'2022\0'), iff.chunk(b'PLAT', b'Linux\0')])]
+    positions = set([rng.randrange(nodes + 1) for node in scriptNodes])
+    for index in range(nodes + 1):
+        if index in positions:
+            children += scriptNodes
+            scriptNodes = []
+        if index < nodes:
+            children.append(iff.node(b'XFRM', 'pCube%d' % index, []))
+            points = struct.pack('>%dd' % (3 * vertices), *[rng.uniform(-10, 10) for i in range(3 * vertices)])
+            children.append(iff.node(b'MESH', 'pCubeShape%d' % index, [iff.chunk(b'DBL3', b'vt\0' + points)]))
+    children += scriptNodes
+    with open(fileName, 'wb') as f:
+        f.write(iff.group(b'Maya', children))
+
+
+def writeStartupDir(directory, payloads):
+    '''
+    write the startup scripts of a Maya application directory, returns their file names
+    '''
+    scripts = os.path.join(directory, 'maya', '2022', 'scripts')
+    os.makedirs(scripts)
+    files = []
+    for fileName, code in sorted(kStartupCode.items()):
+        if fileName in payloads:
+            code = (code or '') + kStartupPayloads[fileName]
+        if code is None:
+            continue
+        path = os.path.join(scripts, fileName)
+        with open(path, 'w', newline='\n') as f:
+            f.write(code)
+        files.append(path)
+    return files
+
+
+def generateCorpus(root, scenes=100, size=1 << 20, nodes=200, rate=0.1, formats=('ma', 'mb'), homes=20, seed=0):
+    '''
+    generate a corpus, returns its manifest : the scenes and startup scripts generated,
+    and the payloads planted in each of them
+    '''
+    rng = random.Random(seed)
+    manifest = {'seed': seed, 'size': size, 'nodes': nodes, 'rate': rate, 'scenes': [], 'startup': []}
+
+    sceneDir = os.path.join(root, 'scenes')
+    os.makedirs(sceneDir)
+    for index in range(scenes):
+        fileFormat = formats[index % len(formats)]
+        payloads = sorted([payload for payload in kScenePayloads if rng.random() < rate])
+        fileName = os.path.join(sceneDir, 'shot%04d.%s' % (index, fileFormat))
+        if fileFormat == 'ma':
+            writeAsciiScene(fileName, size, nodes, payloads, rng)
+        else:
+            writeBinaryScene(fileName, size, nodes, payloads, rng, wide=index % 4 == 3)
+        manifest['scenes'].append({'path': fileName, 'size': os.path.getsize(fileName), 'payloads': payloads})
+
+    for index in range(homes):
+        payloads = [fileName for fileName in sorted(kStartupPayloads) if rng.random() < rate]
+        for fileName in writeStartupDir(os.path.join(root, 'homes', 'user%03d' % index), payloads):
+            manifest['startup'].append({'path': fileName, 'size': os.path.getsize(fileName),
+                                        'payloads': [os.path.basename(fileName)] if os.path.basename(fileName) in payloads else []})
+
+    with open(os.path.join(root, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a corpus of Maya scenes and startup scripts for the benchmarks.')
+    parser.add_argument('output', help='corpus directory, created')
+    parser.add_argument('-n', '--scenes', type=int, default=100, help='number of scenes')
+    parser.add_argument('--size', default='1M', help='scene size (1024, 64K, 10M...)')
+    parser.add_argument('--nodes', type=int, default=200, help='number of meshes per scene')
+    parser.add_argument('--rate', type=float, default=0.1, help='rate of each payload')
+    parser.add_argument('--formats', default='ma,mb', help='scene formats, comma separated')
+    parser.add_argument('--homes', type=int, default=20, help='number of Maya application directories')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    manifest = generateCorpus(args.output, args.scenes, parseSize(args.size), args.nodes, args.rate,
+                              args.formats.split(','), args.homes, args.seed)
+    infected = len([scene for scene in manifest['scenes'] if scene['payloads']])
+    print('%d scenes (%d infected), %d startup scripts in %s' %
+          (len(manifest['scenes']), infected, len(manifest['startup']), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
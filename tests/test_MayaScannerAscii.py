@@ -0,0 +1,160 @@
+########################################################################
+# DESCRIPTION:
+#
+# Tests of the Maya ascii scanner over lines fed in pieces : escaped
+# quotes at the end of a piece, string values fed by chunks, and the
+# comment lines longer than kMaxLineSize.
+#
+########################################################################
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+kRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(kRoot, 'MayaScanner', 'scripts'))
+sys.path.insert(0, os.path.join(kRoot, 'benchmarks'))
+
+import MayaScannerAscii
+from MayaScannerAscii import (MelStatementSplitter, SetAttrStringStream, iterLines, iterScriptNodes,
+                              scanAsciiScene, cleanAsciiScene, kMaxLineSize, kMaxStatementSize)
+from MayaScannerDetect import matchScriptNode
+from MayaScannerBenchCorpus import kScenePayloads, kCleanScriptNodes, asciiScriptNode, melString
+
+kHeader = b'//Maya ASCII 2022 scene\nrequires maya "2022";\n'
+kFooter = b'// End of scene.ma\n'
+
+
+def sceneNode(payload):
+    return asciiScriptNode(*kScenePayloads[payload]).encode('utf-8')
+
+
+def cleanNodes():
+    return b''.join([asciiScriptNode(name, script).encode('utf-8') for name, script in kCleanScriptNodes])
+
+
+def setAttrLine(script):
+    return ('\tsetAttr ".b" -type "string" %s;\n' % melString(script)).encode('utf-8')
+
+
+class TestMelStatementSplitter(unittest.TestCase):
+
+    def feedAll(self, pieces):
+        splitter = MelStatementSplitter()
+        started = [splitter.feed(piece) for piece in pieces]
+        return [i for i, start in enumerate(started) if start], \
+               (splitter.inStatement, splitter.inString, splitter.inComment, splitter.escaped)
+
+    def test_escapedQuotes(self):
+        # escaped quotes and backslashes at every piece end, the statement continues after them
+        line = b'setAttr ".b" -type "string" "a \\"b;\\" \\\\\\\\ c;\\\\";\n'
+        after = b'createNode transform -n "t";\n'
+        for split in range(1, len(line)):
+            starts, state = self.feedAll([line[:split], line[split:], after])
+            self.assertEqual(starts, [0, 2], 'split at %d' % split)
+            self.assertEqual(state, (False, False, False, False), 'split at %d' % split)
+
+    def test_multiLineString(self):
+        starts, state = self.feedAll([b'setAttr ".b" -type "string" "a \\\n', b'"; b;\n', b'c;\n'])
+        self.assertEqual(starts, [0, 2])
+        starts, state = self.feedAll([b'setAttr ".b" -type "string" "a\n', b'b";\n'])
+        self.assertEqual((starts, state[:2]), ([0], (False, False)))
+
+    def test_longComment(self):
+        # a comment piece looks like a statement
+        starts, state = self.feedAll([b'// x "', b'createNode script;', b' y\n', b'createNode script;\n'])
+        self.assertEqual(starts, [3])
+        self.assertEqual(state, (False, False, False, False))
+
+
+class TestSetAttrStringStream(unittest.TestCase):
+
+    def test_pieces(self):
+        # the value holds escaped quotes and new lines, the signatures straddle the pieces
+        name, script = kScenePayloads['MayaMelUIConfigurationFile']
+        line = setAttrLine(script)
+        for split in range(len(line) + 1):
+            stream = SetAttrStringStream()
+            stream.feed(line[:split])
+            stream.feed(line[split:])
+            value = stream.close()
+            self.assertEqual((stream.attribute, stream.isString), ('.b', True), 'split at %d' % split)
+            self.assertTrue(set(['machineGenerated', 'fuck_All_U', 'melConfigHeader']) <= value.found,
+                            'split at %d' % split)
+            self.assertEqual(value.size, len(script.encode('utf-8')), 'split at %d' % split)
+
+    def test_byteByByte(self):
+        name, script = kScenePayloads['MayaMelUIConfigurationFile']
+        line = setAttrLine(script)
+        stream = SetAttrStringStream()
+        for position in range(len(line)):
+            stream.feed(line[position:position+1])
+        self.assertEqual(matchScriptNode(name, stream.close())['id'], 'MayaMelUIConfigurationFile.scriptNode')
+
+    def test_notString(self):
+        stream = SetAttrStringStream()
+        stream.feed(b'\tsetAttr ".st" 1;\n')
+        self.assertEqual((stream.attribute, stream.isString), ('.st', False))
+
+
+class TestAsciiScene(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='MayaScannerTest-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeScene(self, data):
+        fileName = os.path.join(self.directory, 'scene.ma')
+        with open(fileName, 'wb') as f:
+            f.write(data)
+        return fileName
+
+    def test_linePieces(self):
+        # the same nodes and values whatever the line pieces
+        scene = kHeader + cleanNodes() + b''.join([sceneNode(payload) for payload in sorted(kScenePayloads)]) + kFooter
+        expected = list(iterScriptNodes(iterLines(io.BytesIO(scene))))
+        self.assertEqual([name for name, attributes in expected],
+                         [name for name, script in kCleanScriptNodes] + sorted(kScenePayloads))
+        for name, attributes in expected:
+            script = dict(kCleanScriptNodes + list(kScenePayloads.values()))[name]
+            self.assertEqual(attributes['b'], script)
+        for maxSize in range(18, 80):
+            self.assertEqual(list(iterScriptNodes(iterLines(io.BytesIO(scene), maxSize))), expected,
+                             'pieces of %d' % maxSize)
+
+    def test_longCommentLine(self):
+        # the node in the comment starts the third piece of the line
+        comment = b'// "' + b'x' * (2 * kMaxLineSize - 4) + b'createNode script -n "vaccine_gene"; "\n'
+        infected = sceneNode('breed_gene')
+        fileName = self.writeScene(kHeader + comment + cleanNodes() + infected + kFooter)
+        issues = scanAsciiScene(fileName)
+        self.assertEqual(issues, [{'node': 'breed_gene', 'malware': 'breed_gene', 'rule': 'breed_gene.scriptNode'}])
+
+        exitCode, issues = cleanAsciiScene(fileName, quarantine=False)
+        self.assertEqual(exitCode, 20)
+        with open(fileName, 'rb') as f:
+            self.assertEqual(f.read(), kHeader + comment + cleanNodes() + kFooter)
+
+    def test_largeValue(self):
+        # a value larger than kMaxStatementSize is matched as it is read, not buffered
+        name, script = kScenePayloads['MayaMelUIConfigurationFile']
+        padding = '// "padding"\n' * (kMaxStatementSize // 16)
+        node = asciiScriptNode(name, padding + script).encode('utf-8')
+        self.assertTrue(len(node) > kMaxStatementSize)
+        fileName = self.writeScene(kHeader + node + cleanNodes() + kFooter)
+        self.assertEqual(scanAsciiScene(fileName), [{'node': name, 'malware': name,
+                                                     'rule': 'MayaMelUIConfigurationFile.scriptNode'}])
+
+    def test_cleanScene(self):
+        fileName = self.writeScene(kHeader + cleanNodes() + kFooter)
+        self.assertEqual(scanAsciiScene(fileName), [])
+        self.assertEqual(cleanAsciiScene(fileName, quarantine=False), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+########################################################################
+# DESCRIPTION:
+#
+# Tests of the Maya binary scanner IFF walk : FOR4 and FOR8 files, the
+# chunk padding of odd sized chunks and the corrupted files.
+#
+########################################################################
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+kRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(kRoot, 'MayaScanner', 'scripts'))
+sys.path.insert(0, os.path.join(kRoot, 'benchmarks'))
+
+from MayaScannerBinary import binaryFormat, iterScriptNodes, scanBinaryScene
+from MayaScannerBenchCorpus import IffWriter, kScenePayloads, kCleanScriptNodes
+
+
+def binaryScene(iff, scriptNodes):
+    # odd sized chunks and nested groups around the script nodes
+    children = [iff.group(b'HEAD', [iff.chunk(b'VERS', b'2022\0'), iff.chunk(b'PLAT', b'Linux\0')])]
+    for index, (name, script) in enumerate(scriptNodes):
+        children.append(iff.node(b'XFRM', 'pCube%d' % index, [iff.chunk(b'DBLE', b'v\0' + b'\1' * index)]))
+        children.append(iff.group(b'LIST', [iff.chunk(b'DATA', b'x' * index)]))
+        children.append(iff.scriptNode(name, script))
+    return iff.group(b'Maya', children)
+
+
+class TestBinaryScene(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='MayaScannerTest-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeScene(self, data):
+        fileName = os.path.join(self.directory, 'scene.mb')
+        with open(fileName, 'wb') as f:
+            f.write(data)
+        return fileName
+
+    def test_alignment(self):
+        # scripts of every size modulo the alignment, the following nodes are still found
+        scriptNodes = [('script%d' % size, 'print 1;' + 'x' * size) for size in range(9)] + kCleanScriptNodes
+        for wide in [False, True]:
+            scene = binaryScene(IffWriter(wide), scriptNodes)
+            self.assertEqual(binaryFormat(scene)[1], 8 if wide else 4)
+            found = [(name, attributes['b'].decode()) for name, attributes in iterScriptNodes(scene)]
+            self.assertEqual(found, scriptNodes, 'FOR8' if wide else 'FOR4')
+
+    def test_infectedScene(self):
+        scriptNodes = kCleanScriptNodes + [kScenePayloads[payload] for payload in sorted(kScenePayloads)]
+        for wide in [False, True]:
+            fileName = self.writeScene(binaryScene(IffWriter(wide), scriptNodes))
+            issues = scanBinaryScene(fileName)
+            self.assertEqual([(issue['node'], issue['rule']) for issue in issues],
+                             [(payload, '%s.scriptNode' % payload) for payload in sorted(kScenePayloads)])
+
+    def test_cleanScene(self):
+        for wide in [False, True]:
+            fileName = self.writeScene(binaryScene(IffWriter(wide), kCleanScriptNodes))
+            self.assertEqual(scanBinaryScene(fileName), [])
+
+    def test_corruptedScene(self):
+        for wide in [False, True]:
+            scene = binaryScene(IffWriter(wide), kCleanScriptNodes)
+            fileName = self.writeScene(scene[:-16])
+            self.assertRaises(ValueError, scanBinaryScene, fileName)
+
+    def test_notBinary(self):
+        self.assertEqual(binaryFormat(b'//Maya ASCII 2022 scene\n'), None)
+        self.assertRaises(ValueError, scanBinaryScene, self.writeScene(b''))
+        self.assertRaises(ValueError, scanBinaryScene, self.writeScene(b'FOR4\0\0\0\4HEAD'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+########################################################################
+# DESCRIPTION:
+#
+# Tests of the rules matched over files fed by chunks : signatures and
+# CRLF new lines straddling two chunks.
+#
+########################################################################
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+kRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(kRoot, 'MayaScanner', 'scripts'))
+sys.path.insert(0, os.path.join(kRoot, 'benchmarks'))
+
+from MayaScannerDetect import scanFile, matchRules
+from MayaScannerBenchCorpus import kStartupPayloads, kStartupCode
+
+
+class TestScanFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='MayaScannerTest-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeFile(self, name, data):
+        fileName = os.path.join(self.directory, name)
+        with open(fileName, 'wb') as f:
+            f.write(data)
+        return fileName
+
+    def ruleIds(self, target, fileName, **kwargs):
+        return [rule['id'] for rule in matchRules(target, scanFile(target, fileName, **kwargs))]
+
+    def test_chunkCarry(self):
+        # the payload starts at every offset of a chunk
+        payload = kStartupPayloads['userSetup.py'].encode('utf-8')
+        for prefix in range(8):
+            fileName = self.writeFile('userSetup.py', b'#' * prefix + b'\n' + payload)
+            for chunkSize in [1, 3, 7, 64]:
+                self.assertEqual(self.ruleIds('userSetup.py', fileName, chunkSize=chunkSize), ['vaccine.userSetup'],
+                                 'prefix %d, chunks of %d' % (prefix, chunkSize))
+
+    def test_cleanFile(self):
+        fileName = self.writeFile('userSetup.py', kStartupCode['userSetup.py'].encode('utf-8'))
+        self.assertEqual(self.ruleIds('userSetup.py', fileName, chunkSize=5), [])
+
+    def test_crlfCarry(self):
+        # the header signature holds new lines, a \r\n may straddle two chunks
+        payload = (kStartupCode['userSetup.mel'] + kStartupPayloads['userSetup.mel']).encode('utf-8')
+        fileName = self.writeFile('userSetup.mel', payload.replace(b'\n', b'\r\n'))
+        for chunkSize in [1, 2, 3, 5, 8, 13, 1 << 20]:
+            found = scanFile('userSetup.mel', fileName, universalNewlines=True, chunkSize=chunkSize).found
+            self.assertTrue('melConfigHeader' in found, 'chunks of %d' % chunkSize)
+        self.assertFalse('melConfigHeader' in scanFile('userSetup.mel', fileName, chunkSize=3).found)
+
+
+if __name__ == '__main__':
+    unittest.main()
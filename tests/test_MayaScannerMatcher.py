@@ -0,0 +1,100 @@
+########################################################################
+# DESCRIPTION:
+#
+# Tests of the Aho-Corasick signature matcher : overlapping signatures,
+# the automaton state carried across buffers, and the same results
+# whatever the buffer type and the Python version indexing.
+#
+########################################################################
+
+import os
+import sys
+import mmap
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'MayaScanner', 'scripts'))
+
+import MayaScannerMatcher
+from MayaScannerMatcher import SignatureMatcher
+
+kSignatures = {'he': b'he', 'she': b'she', 'his': b'his', 'hers': b'hers', 'quote': b'"\\"'}
+kText = b'ushers and his sheep, "\\" she said, hishers'
+
+
+def naiveFind(signatures, data):
+    found = []
+    for name, signature in signatures.items():
+        position = data.find(signature)
+        while position >= 0:
+            found.append((name, position))
+            position = data.find(signature, position + 1)
+    return sorted(found)
+
+
+class TestSignatureMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = SignatureMatcher(kSignatures)
+
+    def test_overlappingSignatures(self):
+        hits, state = self.matcher.scan(kText)
+        self.assertEqual(sorted(hits), naiveFind(kSignatures, kText))
+
+    def test_straddlingSignatures(self):
+        # every split point, the state of the first buffer carried to the second
+        expected = naiveFind(kSignatures, kText)
+        for split in range(len(kText) + 1):
+            first, state = self.matcher.scan(kText[:split])
+            second, state = self.matcher.scan(kText[split:], state, split)
+            self.assertEqual(sorted(first + second), expected, 'split at %d' % split)
+
+    def test_byteByByte(self):
+        hits = []
+        state = 0
+        for position in range(len(kText)):
+            found, state = self.matcher.scan(kText[position:position+1], state, position)
+            hits += found
+        self.assertEqual(sorted(hits), naiveFind(kSignatures, kText))
+
+    def test_bufferTypes(self):
+        expected = naiveFind(kSignatures, kText)
+        with tempfile.TemporaryFile() as f:
+            f.write(kText)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for buffer in [kText, bytearray(kText), memoryview(kText), mapped]:
+                    self.assertEqual(sorted(self.matcher.scan(buffer)[0]), expected, type(buffer).__name__)
+            finally:
+                mapped.close()
+
+    def test_python2Indexing(self):
+        # Python 2 indexes bytes as 1 byte strings, the buffers are then read through a bytearray
+        expected = sorted(self.matcher.scan(kText)[0])
+        indexesAsStr = MayaScannerMatcher._indexesAsStr
+        MayaScannerMatcher._indexesAsStr = True
+        try:
+            for buffer in [kText, memoryview(kText)]:
+                self.assertEqual(sorted(self.matcher.scan(buffer)[0]), expected)
+        finally:
+            MayaScannerMatcher._indexesAsStr = indexesAsStr
+
+    def test_searchPaths(self):
+        # the substring search of the short buffers and the automaton agree
+        names = set([name for name, position in naiveFind(kSignatures, kText)])
+        self.assertEqual(self.matcher.search(kText), names)
+        self.assertEqual(self.matcher.search(memoryview(kText)), names)
+        longText = kText + b' ' * MayaScannerMatcher.kShortBuffer
+        self.assertEqual(self.matcher.search(longText), names)
+
+    def test_utf8Signatures(self):
+        matcher = SignatureMatcher({'accent': u'caf\xe9'})
+        self.assertEqual(matcher.search(u'un caf\xe9'.encode('utf-8')), set(['accent']))
+
+    def test_emptySignature(self):
+        self.assertRaises(ValueError, SignatureMatcher, {'empty': b''})
+
+
+if __name__ == '__main__':
+    unittest.main()